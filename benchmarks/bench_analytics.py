@@ -0,0 +1,131 @@
+"""
+Бенчмарк: аналитика трека за месяц точек раз в 30 секунд.
+
+Запуск:
+    python benchmarks/bench_analytics.py [дней] [интервал_с]
+
+Один водитель (≈86 тыс. точек за 30 дней) среди 10 других с таким же
+треком: езда днём и ночью, стоянки по 20–90 минут. Замеряются чтение
+из БД (db.get_track → массивы), расчёт track_analytics.analyze() и,
+для сравнения, тот же расчёт пробега/скорости циклом Python по точкам.
+"""
+
+import asyncio
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import db_pool
+import geo
+import track_analytics
+
+DRIVERS = 11
+TARGET = 1
+
+
+def _track(days: float, interval_s: float, seed: int) -> list[tuple[float, float, datetime]]:
+    """Синтетический трек: отрезки езды 40–90 км/ч вперемешку со стоянками."""
+    rnd = random.Random(seed)
+    lat, lon = 55.75, 37.62
+    ts = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    end = ts + timedelta(days=days)
+    heading = rnd.uniform(0, 2 * math.pi)
+    points = []
+    while ts < end:
+        if rnd.random() < 0.2:
+            for _ in range(int(rnd.uniform(20, 90) * 60 / interval_s)):
+                points.append((lat + rnd.gauss(0, 1e-5), lon + rnd.gauss(0, 1e-5), ts))
+                ts += timedelta(seconds=interval_s)
+        else:
+            speed_ms = rnd.uniform(40, 90) / 3.6
+            heading += rnd.gauss(0, 0.3)
+            for _ in range(int(rnd.uniform(30, 180) * 60 / interval_s)):
+                step = speed_ms * interval_s
+                lat += math.degrees(step * math.cos(heading) / geo.EARTH_RADIUS_M)
+                lon += math.degrees(
+                    step * math.sin(heading) / geo.EARTH_RADIUS_M / math.cos(math.radians(lat))
+                )
+                points.append((lat, lon, ts))
+                ts += timedelta(seconds=interval_s)
+    return points
+
+
+async def _populate(days: float, interval_s: float) -> int:
+    count = 0
+    for uid in range(1, DRIVERS + 1):
+        track = _track(days, interval_s, uid)
+        await db.save_points([(uid, lat, lon, ts) for lat, lon, ts in track])
+        count += len(track) if uid == TARGET else 0
+    return count
+
+
+def _python_loop(rows: list[tuple[float, float, int]]) -> tuple[float, float]:
+    """Пробег и максимальная скорость циклом по точкам — для сравнения."""
+    distance_m, max_kmh = 0.0, 0.0
+    for (lat1, lon1, t1), (lat2, lon2, t2) in zip(rows, rows[1:]):
+        step = geo.haversine_m(lat1, lon1, lat2, lon2)
+        dt = (t2 - t1) / 1000
+        if dt > 0 and step / dt * 3.6 >= track_analytics.STOP_SPEED_KMH:
+            distance_m += step
+            max_kmh = max(max_kmh, step / dt * 3.6)
+    return distance_m, max_kmh
+
+
+async def _measure(name: str, fn, repeat: int) -> None:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        if asyncio.iscoroutine(result):
+            await result
+        samples.append(time.perf_counter() - t0)
+    print(f"{name:<22} median={statistics.median(samples) * 1000:8.1f} ms  min={min(samples) * 1000:8.1f} ms")
+
+
+async def main(days: float, interval_s: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        await db.init()
+        try:
+            count = await _populate(days, interval_s)
+            print(f"{count} points for driver {TARGET} ({days:g} days every {interval_s:g} s)")
+            since = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+            rows = await db.get_track(TARGET, since)
+            lat, lon, ts = await track_analytics.load_track(TARGET, since)
+            report = track_analytics.analyze(lat, lon, ts)
+            print(
+                f"distance={report['distance_km']:.0f} km  stops={len(report['stops'])}  "
+                f"night={report['night_driving_hours']:.0f} h"
+            )
+
+            await _measure("fetch (get_track)", lambda: db.get_track(TARGET, since), 5)
+            await _measure("fetch → arrays", lambda: track_analytics.load_track(TARGET, since), 5)
+            await _measure("analyze (numpy)", lambda: track_analytics.analyze(lat, lon, ts), 20)
+            await _measure("python loop (dist)", lambda: _python_loop(rows), 3)
+
+            async def end_to_end():
+                return track_analytics.analyze(*await track_analytics.load_track(TARGET, since))
+
+            await _measure("end to end", end_to_end, 5)
+        finally:
+            await db_pool.close_all()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 30,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 30,
+    ))
@@ -0,0 +1,122 @@
+"""
+Бенчмарк: save_point / get_trip с новым соединением на каждый вызов и через пул.
+
+Запуск:
+    python benchmarks/bench_db_pool.py [количество_вызовов]
+
+«До» воспроизводит старую схему доступа: aiosqlite.connect() + DDL схемы
+(бывшие _ensure_schema) на каждый вызов. «После» вызывает db.save_point
+и db_trips.get_trip, которые берут соединение из db_pool.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+
+import db
+import db_pool
+import db_trips
+
+
+# DDL, который раньше выполнялся перед каждым запросом
+_LEGACY_POINTS_DDL = [
+    """CREATE TABLE IF NOT EXISTS points (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+        lat REAL NOT NULL, lon REAL NOT NULL, ts TEXT NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS idx_points_user_ts ON points(user_id, ts DESC)",
+]
+_LEGACY_TRIPS_DDL = [
+    "CREATE INDEX IF NOT EXISTS idx_trips_phone ON trips(phone)",
+    "CREATE INDEX IF NOT EXISTS idx_trips_user ON trips(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_trips_status ON trips(status)",
+    "CREATE INDEX IF NOT EXISTS idx_trips_number ON trips(trip_number)",
+    "CREATE INDEX IF NOT EXISTS idx_trip_events_trip ON trip_events(trip_id, created_at DESC)",
+]
+
+
+async def _legacy_ddl(conn: aiosqlite.Connection, statements: list[str]) -> None:
+    for sql in statements:
+        await conn.execute(sql)
+    await conn.commit()
+
+
+def _report(name: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1000
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1000
+    print(f"{name:<28} p50={p50:7.3f} ms  p99={p99:7.3f} ms  n={len(samples)}")
+
+
+async def _before(n: int) -> None:
+    """Старый путь: отдельное соединение и DDL на каждый вызов."""
+    save, get = [], []
+    ts = datetime.now(timezone.utc)
+    for i in range(n):
+        t0 = time.perf_counter()
+        async with aiosqlite.connect(db.DB_PATH) as conn:
+            await _legacy_ddl(conn, _LEGACY_POINTS_DDL)
+            await conn.execute(
+                "INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)",
+                (i % 50, 55.75, 37.61, db.to_epoch_ms(ts)),
+            )
+            await conn.commit()
+        save.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        async with aiosqlite.connect(db_trips.DB_PATH) as conn:
+            await _legacy_ddl(conn, _LEGACY_TRIPS_DDL)
+            await conn.execute("SELECT sdek_tracking FROM trips LIMIT 1")
+            conn.row_factory = aiosqlite.Row
+            async with conn.execute("SELECT * FROM trips WHERE trip_id = ?", (1,)) as cur:
+                await cur.fetchone()
+        get.append(time.perf_counter() - t0)
+    _report("before: save_point", save)
+    _report("before: get_trip", get)
+
+
+async def _after(n: int) -> None:
+    """Новый путь: функции модулей БД поверх пула."""
+    save, get = [], []
+    ts = datetime.now(timezone.utc)
+    for i in range(n):
+        t0 = time.perf_counter()
+        await db.save_point(i % 50, 55.75, 37.61, ts)
+        save.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await db_trips.get_trip(1)
+        get.append(time.perf_counter() - t0)
+    _report("after:  save_point", save)
+    _report("after:  get_trip", get)
+
+
+async def main(n: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        db_trips.DB_PATH = Path(tmp) / "trips.db"
+        await db.init()
+        await db_trips.init()
+        await db_trips.create_trip_by_curator(
+            "+79990000000", "Москва", "01.01.2025", "Казань", "02.01.2025", 1000, 1
+        )
+        try:
+            await _before(n)
+            await _after(n)
+        finally:
+            await db_pool.close_all()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,132 @@
+"""
+Бенчмарк: список водителей /api/drivers на 1 000 и 20 000 водителей.
+
+Запуск:
+    python benchmarks/bench_drivers.py [водителей ...]
+
+«До» — прежний обработчик: get_last_points() и get_phone() на каждого
+водителя (с холодным и прогретым кэшем профилей), ответ через
+jsonable_encoder. «После» — новый /api/drivers: весь парк, страница
+1000, только координаты, bbox и повторный запрос с If-None-Match (304).
+Замеряется полный HTTP-запрос через ASGI без сети.
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_SECRET_TOKEN", "bench")
+
+import httpx
+
+import db
+import db_documents
+import db_pool
+import db_trips
+import driver_cache
+from web import api
+
+HEADERS = {"Authorization": f"Bearer {api.API_SECRET_TOKEN}"}
+
+
+async def _old_list_drivers():
+    """Прежняя реализация /api/drivers (N+1 запросов за телефонами)."""
+    result = []
+    for user_id, last_ts in await db.get_last_points():
+        result.append({
+            "user_id": user_id,
+            "phone": await db.get_phone(user_id),
+            "last_update": last_ts.isoformat(),
+        })
+    return {"drivers": result}
+
+
+api.app.get("/bench/old-drivers")(_old_list_drivers)
+
+
+async def _populate(drivers: int) -> None:
+    rnd = random.Random(5)
+    now = datetime.now(timezone.utc)
+    async with db_pool.connection(db.DB_PATH) as conn:
+        await conn.execute("DELETE FROM points")
+        await conn.execute("DELETE FROM drivers")
+        await conn.executemany(
+            "INSERT INTO drivers(user_id, phone, active) VALUES(?, ?, ?)",
+            [(uid, f"+7999{uid:07d}", int(rnd.random() < 0.8)) for uid in range(1, drivers + 1)],
+        )
+        await conn.executemany(
+            "INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)",
+            [
+                (
+                    uid,
+                    rnd.uniform(43, 62),
+                    rnd.uniform(28, 60),
+                    db.to_epoch_ms(now - timedelta(minutes=rnd.uniform(0, 48 * 60))),
+                )
+                for uid in range(1, drivers + 1)
+            ],
+        )
+        await conn.commit()
+
+
+async def _measure(client: httpx.AsyncClient, name: str, url: str, repeat: int, before=None, headers=None):
+    samples, response = [], None
+    for _ in range(repeat):
+        if before:
+            before()
+        t0 = time.perf_counter()
+        response = await client.get(url, headers={**HEADERS, **(headers or {})})
+        samples.append(time.perf_counter() - t0)
+    count = len(response.json()["drivers"]) if response.status_code == 200 else "-"
+    print(
+        f"  {name:<24} median={statistics.median(samples) * 1000:8.1f} ms  "
+        f"min={min(samples) * 1000:8.1f} ms  status={response.status_code} rows={count} "
+        f"bytes={len(response.content)}"
+    )
+    return response
+
+
+async def main(sizes: list[int]) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        db_trips.DB_PATH = Path(tmp) / "trips.db"
+        db_documents.DB_PATH = Path(tmp) / "documents.db"
+        await api.startup()
+        try:
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for drivers in sizes:
+                    await _populate(drivers)
+                    print(f"{drivers} drivers")
+                    await _measure(client, "before, cold cache", "/bench/old-drivers", 3, driver_cache.clear)
+                    await _measure(client, "before, warm cache", "/bench/old-drivers", 3)
+                    full = await _measure(client, "after, all", "/api/drivers", 10)
+                    await _measure(client, "after, page 1000", "/api/drivers?limit=1000", 20)
+                    await _measure(client, "after, lat/lon only", "/api/drivers?fields=user_id,lat,lon", 10)
+                    await _measure(
+                        client, "after, active+stale 24h", "/api/drivers?active_only=true&stale_hours=24", 10
+                    )
+                    await _measure(
+                        client, "after, bbox Moscow",
+                        "/api/drivers?min_lat=54&min_lon=35&max_lat=57&max_lon=40", 20,
+                    )
+                    await _measure(
+                        client, "after, 304", "/api/drivers", 50,
+                        headers={"If-None-Match": full.headers["etag"]},
+                    )
+        finally:
+            await api.shutdown()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or [1_000, 20_000]))
@@ -0,0 +1,124 @@
+"""
+Бенчмарк: /api/fleet.geojson на 10 000 машин.
+
+Запуск:
+    python benchmarks/bench_fleet.py [водителей]
+
+Машины сгущаются вокруг крупных городов европейской части России.
+Для окон карты 1920×1080 на разных масштабах замеряются число объектов в
+ответе (отдельные водители + кластеры), время FleetIndex.geojson() и
+полного HTTP-запроса через ASGI, а также стоимость обновления индекса
+новой точкой.
+"""
+
+import asyncio
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("API_SECRET_TOKEN", "bench")
+
+import httpx
+
+import db
+import db_documents
+import db_pool
+import db_trips
+from web import api
+from web.api_fleet import fleet_index
+
+HEADERS = {"Authorization": f"Bearer {api.API_SECRET_TOKEN}"}
+CITIES = [(55.7558, 37.6173), (59.9343, 30.3351), (56.3269, 44.0059), (47.2357, 39.7015), (55.7963, 49.1088)]
+VIEW_PX = (1920, 1080)
+
+
+async def _populate(drivers: int) -> None:
+    rnd = random.Random(11)
+    now = datetime.now(timezone.utc)
+    positions = []
+    for uid in range(1, drivers + 1):
+        if rnd.random() < 0.6:
+            lat, lon = rnd.choice(CITIES)
+            positions.append((uid, rnd.gauss(lat, 0.3), rnd.gauss(lon, 0.5)))
+        else:
+            positions.append((uid, rnd.uniform(43, 62), rnd.uniform(28, 60)))
+    async with db_pool.connection(db.DB_PATH) as conn:
+        await conn.executemany(
+            "INSERT INTO drivers(user_id, phone, active) VALUES(?, ?, 1)",
+            [(uid, f"+7999{uid:07d}") for uid in range(1, drivers + 1)],
+        )
+        await conn.executemany(
+            "INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)",
+            [
+                (uid, lat, lon, db.to_epoch_ms(now - timedelta(minutes=rnd.uniform(0, 600))))
+                for uid, lat, lon in positions
+            ],
+        )
+        await conn.commit()
+
+
+def _window(lat: float, lon: float, zoom: int) -> str:
+    """bbox окна VIEW_PX с центром (lat, lon) на масштабе zoom."""
+    deg_per_px = 360 / (256 * 2 ** zoom)
+    half_w = VIEW_PX[0] / 2 * deg_per_px
+    half_h = VIEW_PX[1] / 2 * deg_per_px * math.cos(math.radians(lat))
+    return f"{lon - half_w},{lat - half_h},{lon + half_w},{lat + half_h}"
+
+
+async def main(drivers: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        db_trips.DB_PATH = Path(tmp) / "trips.db"
+        db_documents.DB_PATH = Path(tmp) / "documents.db"
+        await api.startup()
+        try:
+            await _populate(drivers)
+            t0 = time.perf_counter()
+            await fleet_index.ensure()
+            print(f"{drivers} drivers, index load {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for zoom in (4, 6, 8, 10, 12, 14):
+                    bbox = _window(*CITIES[0], zoom)
+                    window = tuple(float(x) for x in bbox.split(","))
+                    samples = []
+                    for _ in range(20):
+                        t0 = time.perf_counter()
+                        data = fleet_index.geojson(window, zoom)
+                        samples.append(time.perf_counter() - t0)
+                    http = []
+                    for _ in range(10):
+                        t0 = time.perf_counter()
+                        response = await client.get(
+                            "/api/fleet.geojson", params={"bbox": bbox, "zoom": zoom}, headers=HEADERS
+                        )
+                        http.append(time.perf_counter() - t0)
+                    print(
+                        f"zoom {zoom:>2}: in view={data['total']:>5}  features={len(data['features']):>4}  "
+                        f"clustered={data['clustered']!s:<5}  geojson()={statistics.median(samples) * 1000:6.2f} ms  "
+                        f"http={statistics.median(http) * 1000:6.1f} ms  bytes={len(response.content)}"
+                    )
+
+            rnd = random.Random(1)
+            now_ms = db.to_epoch_ms(datetime.now(timezone.utc))
+            t0 = time.perf_counter()
+            for i in range(10_000):
+                fleet_index.apply(rnd.randint(1, drivers), 55.75, 37.62, now_ms + i)
+            print(f"index update: {(time.perf_counter() - t0) / 10_000 * 1e6:.1f} µs per point")
+        finally:
+            await api.shutdown()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,103 @@
+"""
+Бенчмарк: задержка хендлера локации под нагрузкой 200 водителей.
+
+Запуск:
+    python benchmarks/bench_ingest.py [водителей] [точек_на_водителя]
+
+Каждый водитель шлёт точки с небольшим случайным интервалом, все
+одновременно. Меряем время «пришла точка → можно отвечать водителю»
+(p50/p99) для двух вариантов пути хендлера поверх point_writer:
+
+* «до»    — is_active(), запись точки, get_phone() для эха в группу:
+            три похода в пул соединений на точку;
+* «после» — point_writer.ingest(): флаг active, вставка и телефон
+            одной транзакцией в пачке.
+
+Оба варианта запускаются с холодным кэшем профилей (TTL = 0, как при
+изменениях из другого процесса) и с тёплым (TTL по умолчанию).
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import db_pool
+import driver_cache
+from bot.point_writer import PointWriter
+
+
+async def _before(writer: PointWriter, uid: int, ts: datetime) -> None:
+    """Прежний путь: проверка active, запись точки, телефон — по отдельности."""
+    if not await db.is_active(uid):
+        return
+    await writer.ingest(uid, 55.0, 37.0, ts)
+    await db.get_phone(uid)
+
+
+async def _after(writer: PointWriter, uid: int, ts: datetime) -> None:
+    await writer.ingest(uid, 55.0, 37.0, ts)
+
+
+async def _driver(handler, writer, uid: int, points: int, rnd: random.Random, samples: list) -> None:
+    for _ in range(points):
+        await asyncio.sleep(rnd.uniform(0, 0.02))
+        t0 = time.perf_counter()
+        await handler(writer, uid, datetime.now(timezone.utc))
+        samples.append(time.perf_counter() - t0)
+
+
+async def _run(name: str, handler, drivers: int, points: int) -> None:
+    writer = PointWriter()
+    writer.start()
+    samples: list[float] = []
+    rnd = random.Random(7)
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            _driver(handler, writer, uid, points, rnd, samples) for uid in range(1, drivers + 1)
+        ])
+    finally:
+        await writer.stop()
+    wall = time.perf_counter() - t0
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"{name:<14} p50={statistics.median(samples) * 1000:6.1f} ms  "
+        f"p99={p99 * 1000:6.1f} ms  {len(samples) / wall:7.0f} points/s"
+    )
+
+
+async def main(drivers: int, points: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        await db.init()
+        try:
+            for uid in range(1, drivers + 1):
+                await db.save_phone(uid, f"+7999{uid:07d}")
+            for label, ttl in (("cold", 0.0), ("warm", driver_cache.TTL_S)):
+                driver_cache.profiles.ttl = ttl
+                driver_cache.clear()
+                await _run(f"before/{label}", _before, drivers, points)
+                driver_cache.clear()
+                await _run(f"after/{label}", _after, drivers, points)
+        finally:
+            await db_pool.close_all()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50,
+    ))
@@ -0,0 +1,108 @@
+"""
+Бенчмарк: «какие машины в радиусе 50 км» на 100 000 водителей.
+
+Запуск:
+    python benchmarks/bench_nearby.py [водителей] [радиус_км]
+
+Водители разбросаны по европейской части России (лат. 43–62, долг. 28–60).
+«Скан» — прежний путь: все последние позиции в Python и haversine по
+каждой. «R*Tree» — db.drivers_within() (индекс + точная проверка
+расстояния) и сырой запрос к индексу без Python-обработки строк.
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import db_pool
+import geo
+
+CENTERS = [(55.7558, 37.6173), (59.9343, 30.3351), (56.3269, 44.0059), (47.2357, 39.7015)]
+
+
+async def _populate(drivers: int) -> None:
+    rnd = random.Random(3)
+    ts = datetime.now(timezone.utc)
+    async with db_pool.connection(db.DB_PATH) as conn:
+        await conn.executemany(
+            "INSERT INTO drivers(user_id, phone, active) VALUES(?, ?, 1)",
+            [(uid, f"+7999{uid:07d}") for uid in range(1, drivers + 1)],
+        )
+        await conn.executemany(
+            "INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)",
+            [
+                (uid, rnd.uniform(43, 62), rnd.uniform(28, 60), db.to_epoch_ms(ts))
+                for uid in range(1, drivers + 1)
+            ],
+        )
+        await conn.commit()
+
+
+async def _scan(lat: float, lon: float, radius_km: float) -> int:
+    async with db_pool.connection(db.DB_PATH) as conn:
+        async with conn.execute("SELECT user_id, lat, lon FROM driver_last_position") as cur:
+            rows = await cur.fetchall()
+    return sum(1 for _, plat, plon in rows if geo.haversine_m(lat, lon, plat, plon) <= radius_km * 1000)
+
+
+async def _rtree(lat: float, lon: float, radius_km: float) -> int:
+    return len(await db.drivers_within(lat, lon, radius_km))
+
+
+async def _raw_index(lat: float, lon: float, radius_km: float) -> int:
+    """Только запрос к индексу в том же соединении — стоимость SQLite без Python."""
+    d = radius_km / 111.0
+    async with db_pool.connection(db.DB_PATH) as conn:
+        async with conn.execute(
+            """
+            SELECT count(*) FROM driver_position_rtree
+             WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?
+            """,
+            (lat + d, lat - d, lon + 2 * d, lon - 2 * d),
+        ) as cur:
+            return (await cur.fetchone())[0]
+
+
+async def _measure(name: str, fn, radius_km: float, repeat: int) -> None:
+    samples, found = [], 0
+    for i in range(repeat):
+        lat, lon = CENTERS[i % len(CENTERS)]
+        t0 = time.perf_counter()
+        found = await fn(lat, lon, radius_km)
+        samples.append(time.perf_counter() - t0)
+    print(
+        f"{name:<10} median={statistics.median(samples) * 1000:8.2f} ms  "
+        f"min={min(samples) * 1000:8.2f} ms  found={found}"
+    )
+
+
+async def main(drivers: int, radius_km: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        await db.init()
+        try:
+            await _populate(drivers)
+            await _measure("scan", _scan, radius_km, 8)
+            await _measure("rtree", _rtree, radius_km, 200)
+            await _measure("raw index", _raw_index, radius_km, 200)
+        finally:
+            await db_pool.close_all()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 50,
+    ))
@@ -0,0 +1,121 @@
+"""
+Бенчмарк: поиск водителей для напоминаний/эскалаций на 10 000 водителей.
+
+Запуск:
+    python benchmarks/bench_overdue.py [водителей] [точек_на_водителя]
+
+«До» воспроизводит прежний цикл remind_every_12h без отправки сообщений:
+SELECT DISTINCT по points ⋈ drivers, затем последняя точка каждого водителя
+отдельным запросом и телефон отдельным запросом для каждой эскалации.
+«После» — один вызов db.get_overdue_drivers(), где окна считаются в SQL.
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import db_pool
+
+REMIND = timedelta(hours=0.2)
+ESCALATE = REMIND + timedelta(hours=2)
+CURATORS = [1, 2, 3]
+
+
+async def _populate(drivers: int, per_driver: int) -> None:
+    now = datetime.now(timezone.utc)
+    rnd = random.Random(1)
+    async with db_pool.connection(db.DB_PATH) as conn:
+        await conn.executemany(
+            "INSERT INTO drivers(user_id, phone, active) VALUES(?, ?, ?)",
+            [(uid, f"+7999{uid:07d}", int(rnd.random() > 0.1)) for uid in range(1, drivers + 1)],
+        )
+        await conn.commit()
+    for uid in range(1, drivers + 1):
+        # треть парка молчит дольше окна эскалации
+        last = now - timedelta(hours=rnd.choice([0.05, 1, 5]))
+        await db.save_points([
+            (uid, 55.0, 37.0, last - timedelta(minutes=10 * i)) for i in range(per_driver)
+        ])
+
+
+async def _before() -> int:
+    """Прежний цикл: N+1 запросов."""
+    now = datetime.now(timezone.utc)
+    async with db_pool.connection(db.DB_PATH) as conn:
+        async with conn.execute(
+            """
+            SELECT DISTINCT p.user_id
+            FROM points p
+            INNER JOIN drivers d ON p.user_id = d.user_id
+            WHERE d.active = 1
+            """
+        ) as cur:
+            user_ids = [row[0] for row in await cur.fetchall()]
+
+    escalations = 0
+    for uid in user_ids:
+        if uid in CURATORS:
+            continue
+        async with db_pool.connection(db.DB_PATH) as conn:
+            async with conn.execute(
+                "SELECT id, user_id, lat, lon, ts FROM points WHERE user_id = ? ORDER BY ts DESC LIMIT 1",
+                (uid,),
+            ) as cur:
+                row = await cur.fetchone()
+        last_ts = db.from_epoch_ms(row[4])
+        if now - last_ts > ESCALATE:
+            async with db_pool.connection(db.DB_PATH) as conn:
+                async with conn.execute("SELECT phone FROM drivers WHERE user_id = ?", (uid,)) as cur:
+                    await cur.fetchone()
+            escalations += 1
+    return escalations
+
+
+async def _after() -> int:
+    rows = await db.get_overdue_drivers(REMIND, ESCALATE, CURATORS)
+    return sum(row["escalate"] for row in rows)
+
+
+async def _measure(name: str, fn, repeat: int) -> None:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = await fn()
+        samples.append(time.perf_counter() - t0)
+    print(
+        f"{name:<8} median={statistics.median(samples) * 1000:8.1f} ms  "
+        f"min={min(samples) * 1000:8.1f} ms  escalations={result}"
+    )
+
+
+async def main(drivers: int, per_driver: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "points.db"
+        await db.init()
+        try:
+            t0 = time.perf_counter()
+            await _populate(drivers, per_driver)
+            print(f"{drivers} drivers × {per_driver} points in {time.perf_counter() - t0:.1f} s")
+            await _measure("before", _before, 5)
+            await _measure("after", _after, 5)
+        finally:
+            await db_pool.close_all()
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    ))
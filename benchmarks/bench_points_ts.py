@@ -0,0 +1,164 @@
+"""
+Бенчмарк: диапазонные выборки по points с ts в ISO TEXT и в INTEGER (мс эпохи).
+
+Запуск:
+    python benchmarks/bench_points_ts.py [количество_точек]
+
+Строит две синтетические таблицы одинакового содержания (по умолчанию
+2 000 000 точек, 500 водителей): старую раскладку (ts TEXT, индекс
+(user_id, ts DESC)) и новую (ts INTEGER, индекс (user_id, ts)). Замеряет:
+
+* выборку суточного трека водителя: только SQL и вместе с преобразованием
+  ts в datetime (fromisoformat + подстановка tzinfo против from_epoch_ms);
+* подсчёт точек водителя за неделю (только по индексу);
+* последнюю точку каждого водителя (MAX(ts) GROUP BY user_id);
+* подсчёт точек старше порога, как в cleanup_old_drivers.py.
+
+Используется синхронный sqlite3, чтобы мерить сам запрос, а не пул.
+"""
+
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+DRIVERS = 500
+STEP_S = 60  # интервал между точками одного водителя
+
+
+def _build(path: str, n: int, as_text: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        f"""CREATE TABLE points (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            lat REAL NOT NULL, lon REAL NOT NULL, ts {'TEXT' if as_text else 'INTEGER'} NOT NULL)"""
+    )
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rnd = random.Random(42)
+
+    def rows():
+        for i in range(n):
+            ts = start + timedelta(seconds=(i // DRIVERS) * STEP_S)
+            value = ts.isoformat() if as_text else db.to_epoch_ms(ts)
+            yield (i % DRIVERS, 55 + rnd.random(), 37 + rnd.random(), value)
+
+    conn.executemany("INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)", rows())
+    order = " DESC" if as_text else ""
+    conn.execute(f"CREATE INDEX idx_points_user_ts ON points(user_id, ts{order})")
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def _text_to_dt(value: str) -> datetime:
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _queries(conn: sqlite3.Connection, as_text: bool, n: int) -> dict:
+    """Набор замеряемых запросов для одной раскладки; одинаковый seed у обеих."""
+    span = (n // DRIVERS) * STEP_S
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rnd = random.Random(7)
+    convert = _text_to_dt if as_text else db.from_epoch_ms
+    bound = (lambda dt: dt.isoformat()) if as_text else db.to_epoch_ms
+
+    def window(days: int):
+        uid = rnd.randrange(DRIVERS)
+        lo = start + timedelta(seconds=rnd.randrange(max(span - days * 86400, 1)))
+        return uid, bound(lo), bound(lo + timedelta(days=days))
+
+    def track_raw():
+        conn.execute(
+            "SELECT lat, lon, ts FROM points WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            window(1),
+        ).fetchall()
+
+    def track():
+        rows = conn.execute(
+            "SELECT lat, lon, ts FROM points WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            window(1),
+        ).fetchall()
+        [(lat, lon, convert(ts)) for lat, lon, ts in rows]
+
+    def week_count():
+        conn.execute(
+            "SELECT COUNT(*) FROM points WHERE user_id = ? AND ts >= ? AND ts < ?",
+            window(7),
+        ).fetchone()
+
+    def latest():
+        rows = conn.execute("SELECT user_id, MAX(ts) FROM points GROUP BY user_id").fetchall()
+        [(uid, convert(ts)) for uid, ts in rows]
+
+    cutoff = bound(start + timedelta(seconds=span // 2))
+
+    def older_than():
+        conn.execute("SELECT COUNT(*) FROM points WHERE ts < ?", (cutoff,)).fetchone()
+
+    return {
+        "24h track, SQL only": (track_raw, 1000),
+        "24h track + convert": (track, 1000),
+        "7d count (index only)": (week_count, 1000),
+        "MAX(ts) per driver": (latest, 10),
+        "count ts < cutoff": (older_than, 10),
+    }
+
+
+def _p50(samples: list[float]) -> float:
+    return statistics.median(samples) * 1000
+
+
+def _p99(samples: list[float]) -> float:
+    samples = sorted(samples)
+    return samples[max(int(len(samples) * 0.99) - 1, 0)] * 1000
+
+
+def main(n: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        layouts = {}
+        for as_text in (True, False):
+            path = os.path.join(tmp, f"points_{'text' if as_text else 'int'}.db")
+            t0 = time.perf_counter()
+            conn = _build(path, n, as_text)
+            print(
+                f"built {'TEXT' if as_text else 'INTEGER'} table: {n} rows, "
+                f"{os.path.getsize(path) / 2**20:.0f} MiB, {time.perf_counter() - t0:.1f} s"
+            )
+            layouts[as_text] = (conn, _queries(conn, as_text, n))
+        print()
+
+        # запросы двух раскладок чередуются, чтобы шум машины делился поровну
+        text_q, int_q = layouts[True][1], layouts[False][1]
+        for name, (text_fn, repeat) in text_q.items():
+            int_fn = int_q[name][0]
+            text_s, int_s = [], []
+            for _ in range(repeat):
+                for fn, samples in ((text_fn, text_s), (int_fn, int_s)):
+                    t0 = time.perf_counter()
+                    fn()
+                    samples.append(time.perf_counter() - t0)
+            print(
+                f"{name:<24} text p50={_p50(text_s):8.3f} p99={_p99(text_s):8.3f} ms | "
+                f"int p50={_p50(int_s):8.3f} p99={_p99(int_s):8.3f} ms | "
+                f"{_p50(text_s) / _p50(int_s):4.2f}x"
+            )
+
+        for conn, _ in layouts.values():
+            conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
@@ -2,9 +2,14 @@ import asyncio, os, sys
 # make parent directory importable to resolve `import db`
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 import db
+import db_pool
 
 async def main() -> None:
-    await db.clear_all()
+    await db.init()
+    try:
+        await db.clear_all()
+    finally:
+        await db_pool.close_all()
     print("Database cleared")
 
 if __name__ == "__main__":
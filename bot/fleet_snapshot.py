@@ -0,0 +1,212 @@
+"""
+Сводка по парку в группе диспетчеров вместо эха каждой точки.
+
+Раньше на каждую точку в группу уходило два сообщения (локация и подпись).
+В режиме snapshot точки только помечают сводку «устаревшей», а фоновая
+задача раз в FLEET_SNAPSHOT_INTERVAL_S секунд перечитывает последние
+позиции одним запросом и редактирует одно закреплённое сообщение. Без
+новых точек сводка всё равно перерисовывается не реже раза в
+FLEET_SNAPSHOT_MAX_PERIOD_S секунд: иначе «N мин назад» и отметки ⚠️
+замёрзли бы, и замолчавший водитель не стал бы «без связи».
+Id сообщения хранится в bot_state, поэтому после перезапуска бот
+продолжает править ту же сводку.
+
+GROUP_ECHO_MODE:
+    snapshot — только сводка (по умолчанию);
+    echo     — прежнее эхо каждой точки;
+    both     — и то, и другое;
+    off      — ничего не отправлять в группу.
+"""
+
+import asyncio
+import html
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText, PinChatMessage, SendMessage
+
+import db
+from bot.outbox import LOW, NORMAL, outbox
+
+logger = logging.getLogger(__name__)
+
+GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
+GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR) if GROUP_CHAT_ID_STR else None
+
+GROUP_ECHO_MODE = os.getenv("GROUP_ECHO_MODE", "snapshot").strip().lower()
+INTERVAL_S = float(os.getenv("FLEET_SNAPSHOT_INTERVAL_S", "60"))
+MAX_PERIOD_S = float(os.getenv("FLEET_SNAPSHOT_MAX_PERIOD_S", "60"))
+MAP_LINKS = os.getenv("FLEET_SNAPSHOT_MAP_LINKS", "1") == "1"
+STALE_HOURS = float(os.getenv("REMIND_HOURS", "0.2"))
+
+STATE_KEY = "fleet_snapshot_message_id"
+MAX_TEXT = 4000  # лимит Telegram — 4096 символов
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+
+def echo_enabled() -> bool:
+    """Слать ли в группу эхо каждой точки."""
+    return bool(GROUP_CHAT_ID) and GROUP_ECHO_MODE in ("echo", "both")
+
+
+def snapshot_enabled() -> bool:
+    return bool(GROUP_CHAT_ID) and GROUP_ECHO_MODE in ("snapshot", "both")
+
+
+def map_link(lat: float, lon: float) -> str:
+    """Ссылка на статичную карту с меткой водителя."""
+    return (
+        "https://static-maps.yandex.ru/1.x/"
+        f"?ll={lon:.6f},{lat:.6f}&z=12&l=map&pt={lon:.6f},{lat:.6f},pm2rdm"
+    )
+
+
+def _age(delta: timedelta) -> str:
+    minutes = int(delta.total_seconds() // 60)
+    if minutes < 1:
+        return "только что"
+    if minutes < 60:
+        return f"{minutes} мин назад"
+    hours = minutes // 60
+    if hours < 24:
+        return f"{hours} ч {minutes % 60} мин назад"
+    return f"{hours // 24} д назад"
+
+
+def render(positions: list[dict], now: Optional[datetime] = None) -> str:
+    """Текст сводки (HTML). Свежие водители сверху; не влезшие — счётчиком."""
+    now = now or datetime.now(timezone.utc)
+    stale_after = timedelta(hours=STALE_HOURS)
+    stale = sum(1 for pos in positions if now - pos["ts"] > stale_after)
+    header = (
+        f"🚚 <b>Водителей на связи: {len(positions) - stale}</b>"
+        + (f" · ⚠️ без связи: {stale}" if stale else "")
+        + f"\n🕐 Обновлено {now.astimezone(MOSCOW_TZ):%d.%m %H:%M} (МСК)\n"
+    )
+    lines = []
+    length = len(header)
+    for i, pos in enumerate(positions):
+        age = now - pos["ts"]
+        mark = "⚠️" if age > stale_after else "📍"
+        who = html.escape(pos["phone"] or f"ID {pos['user_id']}")
+        line = f"{mark} {who} — {_age(age)}"
+        if MAP_LINKS:
+            url = html.escape(map_link(pos["lat"], pos["lon"]))
+            line += f' · <a href="{url}">карта</a>'
+        rest = f"\n… и ещё {len(positions) - i}"
+        if length + len(line) + 1 + len(rest) > MAX_TEXT:
+            lines.append(rest.strip())
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return header + "\n" + "\n".join(lines) if lines else header + "\nНет активных водителей"
+
+
+class FleetSnapshot:
+    """Периодически редактируемое закреплённое сообщение со сводкой по парку."""
+
+    def __init__(self, interval_s: float = INTERVAL_S, max_period_s: float = MAX_PERIOD_S):
+        self.interval_s = interval_s
+        self.max_period_s = max_period_s
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._message_id: Optional[int] = None
+        self._last_text: Optional[str] = None
+
+    def mark_dirty(self) -> None:
+        """Пришла точка: обновить сводку в ближайшее окно."""
+        self._dirty.set()
+
+    def start(self) -> None:
+        if self._task is None and snapshot_enabled():
+            self._task = asyncio.create_task(self._run(), name="fleet-snapshot")
+            logger.info("fleet-snapshot: started (interval=%ss)", self.interval_s)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        restored = False
+        self._dirty.set()  # первая сводка сразу после старта
+        while True:
+            try:
+                # окно накопления уже прошло — ждём остаток периода
+                await asyncio.wait_for(
+                    self._dirty.wait(), max(self.max_period_s - self.interval_s, 0)
+                )
+            except asyncio.TimeoutError:
+                pass  # точек нет, но возраст и отметки ⚠️ нужно обновить
+            self._dirty.clear()
+            try:
+                if not restored:
+                    # без id закреплённой сводки refresh() отправил бы дубль
+                    stored = await db.get_state(STATE_KEY)
+                    self._message_id = int(stored) if stored else None
+                    restored = True
+                await self.refresh()
+            except Exception:
+                logger.exception("fleet-snapshot: refresh failed")
+                self._dirty.set()  # повторим в следующее окно
+            # окно накопления: точки за это время попадут в одну правку
+            await asyncio.sleep(self.interval_s)
+
+    async def refresh(self) -> None:
+        """Перечитать позиции и отредактировать (или создать) сообщение."""
+        text = render(await db.get_fleet_positions())
+        if text == self._last_text:
+            return
+
+        if self._message_id is not None:
+            try:
+                await outbox.submit(
+                    EditMessageText(
+                        chat_id=GROUP_CHAT_ID,
+                        message_id=self._message_id,
+                        text=text,
+                        parse_mode="HTML",
+                        disable_web_page_preview=True,
+                    ),
+                    LOW,
+                )
+                self._last_text = text
+                return
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    self._last_text = text
+                    return
+                # сообщение удалили — создадим новое
+                logger.warning("fleet-snapshot: cannot edit %s: %s", self._message_id, e)
+
+        message = await outbox.submit(
+            SendMessage(
+                chat_id=GROUP_CHAT_ID,
+                text=text,
+                parse_mode="HTML",
+                disable_web_page_preview=True,
+                disable_notification=True,
+            ),
+            NORMAL,
+        )
+        self._message_id = message.message_id
+        self._last_text = text
+        await db.set_state(STATE_KEY, str(self._message_id))
+        # закрепить может только админ группы — без прав просто пропускаем
+        outbox.post(
+            PinChatMessage(
+                chat_id=GROUP_CHAT_ID, message_id=self._message_id, disable_notification=True
+            ),
+            NORMAL,
+        )
+
+
+fleet_snapshot = FleetSnapshot()
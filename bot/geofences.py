@@ -0,0 +1,278 @@
+"""
+Геозоны погрузки/выгрузки: автоматическая фиксация прибытия и отъезда.
+
+У рейса может быть геозона погрузки и выгрузки (центр + радиус, задаёт
+куратор или геокодер). Все геозоны незавершённых рейсов держатся в памяти
+в сеточном индексе: ключ — (user_id, ячейка GEOFENCE_CELL_DEG×GEOFENCE_CELL_DEG),
+значение — геозоны водителя, задевающие ячейку. На каждую сохранённую
+точку проверяются только геозоны из её ячейки и те, внутри которых
+водитель уже находится (чтобы заметить выезд), — без обращений к БД.
+
+Вход фиксируется на радиусе, выход — на радиусе × GEOFENCE_EXIT_FACTOR,
+чтобы дрожание GPS на границе не давало череду въездов/выездов. Переход
+пишется событием рейса (geofence_enter / geofence_exit) через
+db_trips.log_trip_event; флаг «внутри» сохраняется в trip_geofences и
+переживает перезапуск. С GEOFENCE_AUTO_STATUS=1 выезд с погрузки
+переводит рейс в «в пути», а въезд на выгрузку — в «доставлен».
+
+Геозоны, заданные из веба (другой процесс), подхватываются перечитыванием
+раз в GEOFENCE_RELOAD_S секунд. Для нового рейса адреса погрузки и
+выгрузки геокодируются одним пакетом; найденные координаты становятся
+геозонами, если куратор ещё не задал их сам.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import db_trips
+from geo import EARTH_RADIUS_M, haversine_m
+from geocoding import geocoder
+
+logger = logging.getLogger(__name__)
+
+CELL_DEG = float(os.getenv("GEOFENCE_CELL_DEG", "0.05"))  # ≈ 5,5 км по широте
+EXIT_FACTOR = float(os.getenv("GEOFENCE_EXIT_FACTOR", "1.2"))
+RELOAD_S = float(os.getenv("GEOFENCE_RELOAD_S", "300"))
+AUTO_STATUS = os.getenv("GEOFENCE_AUTO_STATUS", "0") == "1"
+DEFAULT_RADIUS_M = float(os.getenv("GEOFENCE_RADIUS_M", "1000"))
+
+ENTER = "geofence_enter"
+EXIT = "geofence_exit"
+
+_DESCRIPTIONS = {
+    ("loading", ENTER): "Водитель прибыл на погрузку",
+    ("loading", EXIT): "Водитель уехал с погрузки",
+    ("unloading", ENTER): "Водитель прибыл на выгрузку",
+    ("unloading", EXIT): "Водитель уехал с выгрузки",
+}
+
+# (kind, переход) → (из каких статусов, в какой статус) при GEOFENCE_AUTO_STATUS
+_AUTO_STATUS = {
+    ("loading", EXIT): (("active", "loading"), "in_transit"),
+    ("unloading", ENTER): (("in_transit", "unloading"), "delivered"),
+}
+
+_Cell = Tuple[int, int, int]  # (user_id, строка, столбец)
+
+
+@dataclass
+class Geofence:
+    id: int
+    trip_id: int
+    user_id: int
+    status: str
+    kind: str
+    lat: float
+    lon: float
+    radius_m: float
+    inside: bool
+
+
+def _cell(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG)
+
+
+class GeofenceEngine:
+    """Сеточный индекс геозон и обработка въездов/выездов."""
+
+    def __init__(self):
+        self._fences: Dict[int, Geofence] = {}
+        # (trip_id, kind) → геозона
+        self._by_trip: Dict[Tuple[int, str], Geofence] = {}
+        self._grid: Dict[_Cell, List[Geofence]] = {}
+        # user_id → id геозон, внутри которых водитель сейчас
+        self._inside: Dict[int, Set[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+        # переходы пишутся по одному, в порядке точек
+        self._emit_lock = asyncio.Lock()
+
+    # ------------------------------------------------------------------
+    # индекс
+    # ------------------------------------------------------------------
+
+    def load(self, rows: List[dict]) -> None:
+        """Перестроить индекс из строк db_trips.get_active_geofences()."""
+        fences: Dict[int, Geofence] = {}
+        for row in rows:
+            fence = Geofence(
+                id=row["id"],
+                trip_id=row["trip_id"],
+                user_id=row["user_id"],
+                status=row["status"],
+                kind=row["kind"],
+                lat=row["lat"],
+                lon=row["lon"],
+                radius_m=row["radius_m"],
+                inside=bool(row["inside"]),
+            )
+            known = self._fences.get(fence.id)
+            if known is not None and (known.lat, known.lon, known.radius_m) == (
+                fence.lat, fence.lon, fence.radius_m
+            ):
+                # запись перехода могла ещё не дойти до БД — память свежее
+                fence.inside = known.inside
+            fences[fence.id] = fence
+
+        grid: Dict[_Cell, List[Geofence]] = {}
+        inside: Dict[int, Set[int]] = {}
+        for fence in fences.values():
+            reach_m = fence.radius_m * EXIT_FACTOR
+            dlat = math.degrees(reach_m / EARTH_RADIUS_M)
+            dlon = dlat / max(math.cos(math.radians(fence.lat)), 0.01)
+            row0, col0 = _cell(fence.lat - dlat, fence.lon - dlon)
+            row1, col1 = _cell(fence.lat + dlat, fence.lon + dlon)
+            for row in range(row0, row1 + 1):
+                for col in range(col0, col1 + 1):
+                    grid.setdefault((fence.user_id, row, col), []).append(fence)
+            if fence.inside:
+                inside.setdefault(fence.user_id, set()).add(fence.id)
+
+        self._fences, self._grid, self._inside = fences, grid, inside
+        self._by_trip = {(fence.trip_id, fence.kind): fence for fence in fences.values()}
+        logger.debug("geofences: %s fences in %s cells", len(fences), len(grid))
+
+    async def reload(self) -> None:
+        self.load(await db_trips.get_active_geofences())
+
+    def fence(self, trip_id: int, kind: str) -> Optional[Geofence]:
+        """Геозона рейса из памяти (None, если не задана или рейс завершён)."""
+        return self._by_trip.get((trip_id, kind))
+
+    # ------------------------------------------------------------------
+    # проверка точки
+    # ------------------------------------------------------------------
+
+    def check(self, user_id: int, lat: float, lon: float) -> List[Tuple[Geofence, str, float]]:
+        """Переходы (геозона, ENTER/EXIT, расстояние в м) для новой точки водителя."""
+        row, col = _cell(lat, lon)
+        candidates = self._grid.get((user_id, row, col), ())
+        inside = self._inside.get(user_id)
+        if not candidates and not inside:
+            return []
+
+        seen = set()
+        transitions = []
+        for fence in [*candidates, *(self._fences[i] for i in inside or ())]:
+            if fence.id in seen:
+                continue
+            seen.add(fence.id)
+            distance_m = haversine_m(fence.lat, fence.lon, lat, lon)
+            if not fence.inside and distance_m <= fence.radius_m:
+                fence.inside = True
+                self._inside.setdefault(user_id, set()).add(fence.id)
+                transitions.append((fence, ENTER, distance_m))
+            elif fence.inside and distance_m > fence.radius_m * EXIT_FACTOR:
+                fence.inside = False
+                self._inside[user_id].discard(fence.id)
+                transitions.append((fence, EXIT, distance_m))
+        return transitions
+
+    def on_point(self, user_id: int, lat: float, lon: float, ts: datetime) -> None:
+        """Сохранённая точка водителя: проверить геозоны, переходы записать в фоне."""
+        for fence, transition, distance_m in self.check(user_id, lat, lon):
+            logger.info(
+                "geofences: trip %s %s %s (%.0f m)", fence.trip_id, fence.kind, transition, distance_m
+            )
+            task = asyncio.create_task(self._emit(fence, transition, lat, lon, ts, distance_m))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _emit(
+        self, fence: Geofence, transition: str, lat: float, lon: float, ts: datetime, distance_m: float
+    ) -> None:
+        async with self._emit_lock:
+            await self._record(fence, transition, lat, lon, ts, distance_m)
+
+    async def _record(
+        self, fence: Geofence, transition: str, lat: float, lon: float, ts: datetime, distance_m: float
+    ) -> None:
+        try:
+            await db_trips.set_geofence_inside(fence.id, transition == ENTER)
+            await db_trips.log_trip_event(
+                trip_id=fence.trip_id,
+                event_type=transition,
+                description=_DESCRIPTIONS[(fence.kind, transition)],
+                created_by=fence.user_id,
+                metadata=json.dumps({
+                    "kind": fence.kind,
+                    "lat": lat,
+                    "lon": lon,
+                    "ts": ts.isoformat(),
+                    "distance_m": round(distance_m),
+                }),
+            )
+            rule = _AUTO_STATUS.get((fence.kind, transition))
+            if AUTO_STATUS and rule and fence.status in rule[0]:
+                await db_trips.update_trip_status(
+                    fence.trip_id, rule[1], comment=f"{_DESCRIPTIONS[(fence.kind, transition)]} (геозона)"
+                )
+                for other in self._fences.values():
+                    if other.trip_id == fence.trip_id:
+                        other.status = rule[1]
+        except Exception:
+            logger.exception("geofences: failed to record %s for trip %s", transition, fence.trip_id)
+
+    # ------------------------------------------------------------------
+    # геозоны из адресов рейса
+    # ------------------------------------------------------------------
+
+    def geocode_trip(self, trip_id: int, loading_address: str, unloading_address: str) -> None:
+        """Геокодировать адреса нового рейса в фоне и поставить геозоны."""
+        task = asyncio.create_task(self._geocode_trip(trip_id, loading_address, unloading_address))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _geocode_trip(self, trip_id: int, loading_address: str, unloading_address: str) -> None:
+        try:
+            coords = await geocoder.resolve_many([loading_address, unloading_address])
+            existing = {fence["kind"] for fence in await db_trips.get_trip_geofences(trip_id)}
+            added = False
+            for kind, address in (("loading", loading_address), ("unloading", unloading_address)):
+                point = coords[address]
+                if point is None or kind in existing:
+                    continue  # не найден или куратор уже задал точнее
+                await db_trips.set_trip_geofence(
+                    trip_id, kind, point[0], point[1], DEFAULT_RADIUS_M, source="geocoder"
+                )
+                added = True
+            if added:
+                await self.reload()
+        except Exception:
+            logger.exception("geofences: failed to geocode trip %s", trip_id)
+
+    # ------------------------------------------------------------------
+    # фоновое перечитывание
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="geofences")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("geofences: reload failed")
+            await asyncio.sleep(RELOAD_S)
+
+
+geofence_engine = GeofenceEngine()
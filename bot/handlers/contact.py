@@ -13,6 +13,8 @@ GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
 GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR) if GROUP_CHAT_ID_STR else None
 from ..keyboards import location_kb, curator_kb
 from ..utils import is_curator
+from ..outbox import outbox
+from ..reminders import reminder_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +38,8 @@ async def save_contact(msg: Message) -> None:
     # Сохраняем телефон
     await save_phone(user_id, phone)
     logger.info("Phone saved: user_id=%s -> phone=%s", user_id, phone)
+    # save_phone снова включает отслеживание — возвращаем водителя в расписание
+    await reminder_scheduler.track(user_id)
 
     # Проверяем роль пользователя
     if is_curator(user_id):
@@ -69,7 +73,7 @@ async def save_contact(msg: Message) -> None:
             try:
                 from datetime import datetime, timezone, timedelta
                 moscow_tz = timezone(timedelta(hours=3))
-                await msg.bot.send_message(
+                outbox.post_message(
                     GROUP_CHAT_ID,
                     f"🆕 **Новый водитель зарегистрировался**\n\n"
                     f"📞 {phone}\n"
@@ -127,7 +131,7 @@ async def ask_help(msg: Message) -> None:
             f"⚠️ Водитель {user} просит связаться!"
         )
         try:
-            await msg.bot.send_message(GROUP_CHAT_ID, caption)
+            outbox.post_message(GROUP_CHAT_ID, caption)
         except Exception as e:
             logger.warning("Не удалось отправить /help в группу: %s", e)
 
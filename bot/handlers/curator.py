@@ -11,13 +11,18 @@ from datetime import datetime, timezone, timedelta
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import db_trips
-from db import get_user_id_by_phone
+import track_analytics
+from db import drivers_within, get_user_id_by_phone
+from bot.fleet_snapshot import MOSCOW_TZ, map_link
+from bot.geofences import DEFAULT_RADIUS_M, geofence_engine
+from bot.outbox import HIGH, outbox
+from bot.trip_metrics import format_metrics, trip_metrics
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -252,6 +257,117 @@ async def list_trips_command(message: Message):
         await message.answer("❌ Ошибка загрузки списка рейсов")
 
 
+NEARBY_DEFAULT_KM = 50
+NEARBY_MAX_SHOWN = 15
+
+
+@router.message(Command("nearby"))
+async def nearby_command(message: Message, command: CommandObject):
+    """
+    Водители рядом с точкой (только для кураторов).
+
+    Использование: /nearby <широта> <долгота> [радиус_км]
+    Пример: /nearby 55.7558, 37.6173 50
+    """
+    if not is_curator(message.from_user.id):
+        await message.answer("❌ Эта команда доступна только кураторам")
+        return
+
+    try:
+        parts = (command.args or "").replace(",", " ").split()
+        lat, lon = float(parts[0]), float(parts[1])
+        radius_km = float(parts[2]) if len(parts) > 2 else NEARBY_DEFAULT_KM
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and radius_km > 0):
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer(
+            "Использование: /nearby <широта> <долгота> [радиус_км]\n"
+            "Пример: /nearby 55.7558, 37.6173 50"
+        )
+        return
+
+    try:
+        drivers = await drivers_within(lat, lon, radius_km)
+    except Exception as e:
+        logger.error(f"Failed to find nearby drivers: {e}", exc_info=True)
+        await message.answer("❌ Ошибка поиска водителей")
+        return
+
+    if not drivers:
+        await message.answer(f"🔍 В радиусе {radius_km:g} км водителей нет")
+        return
+
+    now = datetime.now(timezone.utc)
+    text = f"🔍 <b>Водители в радиусе {radius_km:g} км: {len(drivers)}</b>\n\n"
+    for driver in drivers[:NEARBY_MAX_SHOWN]:
+        minutes = int((now - driver["ts"]).total_seconds() // 60)
+        who = driver["phone"] or f"ID {driver['user_id']}"
+        text += (
+            f"🚚 {who} — {driver['distance_km']:.1f} км, {minutes} мин назад · "
+            f'<a href="{map_link(driver["lat"], driver["lon"]).replace("&", "&amp;")}">карта</a>\n'
+        )
+    if len(drivers) > NEARBY_MAX_SHOWN:
+        text += f"\n... и еще {len(drivers) - NEARBY_MAX_SHOWN}"
+
+    await message.answer(text, parse_mode="HTML", disable_web_page_preview=True)
+
+
+GEOFENCE_KIND_NAMES = {
+    "погрузка": "loading",
+    "loading": "loading",
+    "выгрузка": "unloading",
+    "unloading": "unloading",
+}
+
+
+@router.message(Command("geofence"))
+async def geofence_command(message: Message, command: CommandObject):
+    """
+    Задать геозону погрузки/выгрузки рейса (только для кураторов).
+
+    Использование: /geofence <номер_рейса> <погрузка|выгрузка> <широта> <долгота> [радиус_м]
+    Пример: /geofence ТЛ-0042 погрузка 55.7558, 37.6173 800
+    """
+    if not is_curator(message.from_user.id):
+        await message.answer("❌ Эта команда доступна только кураторам")
+        return
+
+    try:
+        parts = (command.args or "").replace(",", " ").split()
+        trip_number = parts[0]
+        kind = GEOFENCE_KIND_NAMES[parts[1].lower()]
+        lat, lon = float(parts[2]), float(parts[3])
+        radius_m = float(parts[4]) if len(parts) > 4 else DEFAULT_RADIUS_M
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and radius_m > 0):
+            raise ValueError
+    except (IndexError, KeyError, ValueError):
+        await message.answer(
+            "Использование: /geofence <номер_рейса> <погрузка|выгрузка> <широта> <долгота> [радиус_м]\n"
+            "Пример: /geofence ТЛ-0042 погрузка 55.7558, 37.6173 800"
+        )
+        return
+
+    try:
+        trip = await db_trips.get_trip_by_number(trip_number)
+        if not trip:
+            await message.answer(f"❌ Рейс {trip_number} не найден")
+            return
+
+        await db_trips.set_trip_geofence(trip['trip_id'], kind, lat, lon, radius_m)
+        await geofence_engine.reload()
+    except Exception as e:
+        logger.error(f"Failed to set geofence: {e}", exc_info=True)
+        await message.answer("❌ Ошибка сохранения геозоны")
+        return
+
+    kind_name = "погрузки" if kind == "loading" else "выгрузки"
+    await message.answer(
+        f"📍 Геозона {kind_name} рейса <b>{trip['trip_number']}</b>: "
+        f"{lat:.5f}, {lon:.5f}, радиус {radius_m:.0f} м",
+        parse_mode="HTML"
+    )
+
+
 @router.message(Command("create_trip"))
 async def start_create_trip(message: Message, state: FSMContext):
     """
@@ -377,6 +493,9 @@ async def process_trip_data(message: Message, state: FSMContext):
             curator_id=message.from_user.id
         )
 
+        # координаты адресов → геозоны рейса (в фоне, из кэша геокодера)
+        geofence_engine.geocode_trip(trip_id, loading_address, unloading_address)
+
         await state.clear()
 
         # Формируем клавиатуру
@@ -417,7 +536,7 @@ async def process_trip_data(message: Message, state: FSMContext):
         # Уведомляем в группу кураторов
         if GROUP_CHAT_ID:
             try:
-                await message.bot.send_message(
+                outbox.post_message(
                     GROUP_CHAT_ID,
                     f"🆕 <b>Создан новый рейс</b>\n\n"
                     f"🚚 Рейс #{trip_number}\n"
@@ -497,7 +616,7 @@ async def activate_trip_callback(callback: CallbackQuery):
         # Отправляем уведомление водителю
         if trip['user_id'] and trip['user_id'] > 0:
             try:
-                await callback.bot.send_message(
+                outbox.post_message(
                     trip['user_id'],
                     f"🚚 <b>Ваш рейс активирован куратором!</b>\n\n"
                     f"Рейс #{trip['trip_number']}\n"
@@ -508,7 +627,8 @@ async def activate_trip_callback(callback: CallbackQuery):
                     f"📅 Выгрузка: {trip['unloading_date']}\n"
                     f"💰 Ставка: {trip['rate']:,.0f} ₽\n\n"
                     f"Не забывайте делиться местоположением!",
-                    parse_mode="HTML"
+                    parse_mode="HTML",
+                    priority=HIGH,
                 )
             except Exception as e:
                 logger.warning(f"Failed to notify driver: {e}")
@@ -562,6 +682,9 @@ async def view_trip_callback(callback: CallbackQuery):
         else:
             loc_text = "нет данных"
 
+        # Пробег, скорость и ETA — накоплены по точкам, трек не перечитываем
+        metrics_text = format_metrics(await trip_metrics.get(trip_id))
+
         # Визуализация прогресса рейса
         progress_stages = {
             'assigned': ('⏳', '⬜️', '⬜️', '⬜️', '⬜️'),
@@ -618,13 +741,14 @@ async def view_trip_callback(callback: CallbackQuery):
         # Общие кнопки
         kb.button(text="📍 Местоположение", callback_data=f"request_location:{trip_id}")
         kb.button(text="📋 История", callback_data=f"trip_history:{trip_id}")
+        kb.button(text="📊 Аналитика", callback_data=f"trip_analytics:{trip_id}")
 
         # Кнопка отмены (для незавершенных рейсов)
         if trip['status'] not in ['completed', 'cancelled']:
             kb.button(text="❌ Отменить", callback_data=f"cancel_trip:{trip_id}")
 
         kb.button(text="◀️ Назад", callback_data="list_trips")
-        kb.adjust(1, 2, 1, 1)
+        kb.adjust(1, 2, 1, 1, 1)
 
         await callback.message.edit_text(
             f"🚚 <b>Рейс #{trip['trip_number']}</b>\n\n"
@@ -640,6 +764,7 @@ async def view_trip_callback(callback: CallbackQuery):
             f"💰 Ставка: {trip['rate']:,.0f} ₽\n"
             f"{docs_text}\n\n"
             f"📍 Последняя локация: {loc_text}\n"
+            f"{metrics_text}"
             f"🕐 Создан: {trip['created_at'][:10]}",
             reply_markup=kb.as_markup(),
             parse_mode="HTML"
@@ -721,13 +846,14 @@ async def confirm_location_callback(callback: CallbackQuery):
         kb.button(text="📍 Поделиться местоположением", request_location=True)
         kb.adjust(1)
 
-        await callback.bot.send_message(
+        await outbox.send_message(
             trip['user_id'],
             f"📍 <b>Напоминание от куратора</b>\n\n"
             f"Пожалуйста, поделитесь текущим местоположением.\n\n"
             f"🚚 Рейс #{trip['trip_number']}",
             reply_markup=kb.as_markup(resize_keyboard=True),
-            parse_mode="HTML"
+            parse_mode="HTML",
+            priority=HIGH,
         )
 
         # Логируем событие
@@ -813,13 +939,14 @@ async def confirm_complete_callback(callback: CallbackQuery):
         # Уведомляем водителя
         if trip['user_id'] and trip['user_id'] > 0:
             try:
-                await callback.bot.send_message(
+                outbox.post_message(
                     trip['user_id'],
                     f"✅ <b>Рейс #{trip['trip_number']} завершен!</b>\n\n"
                     f"Спасибо за работу! 🎉\n\n"
                     f"Отслеживание местоположения остановлено.\n"
                     f"При получении нового рейса вы получите уведомление.",
-                    parse_mode="HTML"
+                    parse_mode="HTML",
+                    priority=HIGH,
                 )
             except Exception as e:
                 logger.warning(f"Failed to notify driver: {e}")
@@ -853,12 +980,12 @@ async def confirm_complete_callback(callback: CallbackQuery):
                     f"✅ Рейс успешно завершен! Отслеживание остановлено."
                 )
 
-                await callback.bot.send_message(
+                outbox.post_message(
                     GROUP_CHAT_ID,
                     notification_text,
                     parse_mode="HTML"
                 )
-                logger.info(f"Sent completion notification to group {GROUP_CHAT_ID} for trip #{trip['trip_number']}")
+                logger.info(f"Queued completion notification to group {GROUP_CHAT_ID} for trip #{trip['trip_number']}")
             except Exception as e:
                 logger.error(f"Failed to send completion notification to group {GROUP_CHAT_ID}: {e}", exc_info=True)
 
@@ -962,13 +1089,14 @@ async def confirm_delivered(callback: CallbackQuery, trip_id: int):
         # Уведомляем водителя
         if trip['user_id'] and trip['user_id'] > 0:
             try:
-                await callback.bot.send_message(
+                outbox.post_message(
                     trip['user_id'],
                     f"📦 <b>Рейс #{trip['trip_number']}</b>\n\n"
                     f"✅ Груз доставлен!\n\n"
                     f"Пожалуйста, отправьте оригиналы документов через СДЭК.\n"
                     f"После отправки сообщите куратору трек-номер.",
-                    parse_mode="HTML"
+                    parse_mode="HTML",
+                    priority=HIGH,
                 )
             except Exception as e:
                 logger.warning(f"Failed to notify driver: {e}")
@@ -976,7 +1104,7 @@ async def confirm_delivered(callback: CallbackQuery, trip_id: int):
         # Уведомляем группу
         if GROUP_CHAT_ID:
             try:
-                await callback.bot.send_message(
+                outbox.post_message(
                     GROUP_CHAT_ID,
                     f"📦 <b>ГРУЗ ДОСТАВЛЕН</b>\n\n"
                     f"🚚 Рейс #{trip['trip_number']}\n"
@@ -1064,12 +1192,13 @@ async def confirm_cancel_callback(callback: CallbackQuery):
         # Уведомляем водителя
         if trip['user_id'] and trip['user_id'] > 0:
             try:
-                await callback.bot.send_message(
+                outbox.post_message(
                     trip['user_id'],
                     f"❌ <b>Рейс #{trip['trip_number']} отменён</b>\n\n"
                     f"К сожалению, рейс был отменён.\n"
                     f"За подробностями обратитесь к куратору.",
-                    parse_mode="HTML"
+                    parse_mode="HTML",
+                    priority=HIGH,
                 )
             except Exception as e:
                 logger.warning(f"Failed to notify driver: {e}")
@@ -1077,7 +1206,7 @@ async def confirm_cancel_callback(callback: CallbackQuery):
         # Уведомляем группу
         if GROUP_CHAT_ID:
             try:
-                await callback.bot.send_message(
+                outbox.post_message(
                     GROUP_CHAT_ID,
                     f"❌ <b>РЕЙС ОТМЕНЁН</b>\n\n"
                     f"🚚 Рейс #{trip['trip_number']}\n"
@@ -1425,3 +1554,63 @@ async def trip_history_callback(callback: CallbackQuery):
     except Exception as e:
         logger.error(f"Failed to show history: {e}", exc_info=True)
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+
+@router.callback_query(F.data.startswith("trip_analytics:"))
+async def trip_analytics_callback(callback: CallbackQuery):
+    """Отчёт по треку рейса: пробег, скорости, стоянки, простой, ночная езда."""
+    if not is_curator(callback.from_user.id):
+        await callback.answer("❌ Недостаточно прав", show_alert=True)
+        return
+
+    trip_id = int(callback.data.split(":")[1])
+
+    try:
+        trip = await db_trips.get_trip(trip_id)
+        if not trip:
+            await callback.answer("❌ Рейс не найден", show_alert=True)
+            return
+
+        report = await track_analytics.trip_analytics(trip_id)
+        text = f"📊 <b>Аналитика рейса #{trip['trip_number']}</b>\n\n"
+
+        if report["points"] < 2:
+            text += "Недостаточно точек для анализа"
+        else:
+            dwell = report["dwell_minutes"]
+            text += (
+                f"📍 Точек: {report['points']}\n"
+                f"🛣 Пробег: {report['distance_km']:.1f} км\n"
+                f"🚚 В движении: {report['moving_hours']:.1f} ч\n"
+                f"⏱ Средняя скорость: {report['avg_speed_kmh'] or 0:.0f} км/ч\n"
+                f"⚡️ Максимальная: {report['max_speed_kmh'] or 0:.0f} км/ч\n"
+                f"🌙 Ночью за рулём: {report['night_driving_hours']:.1f} ч\n"
+                f"🅿️ Стоянок: {len(report['stops'])} ({report['stopped_hours']:.1f} ч)\n"
+            )
+            if "loading" in dwell:
+                text += f"📦 Простой на погрузке: {dwell['loading']:.0f} мин\n"
+            if "unloading" in dwell:
+                text += f"📦 Простой на выгрузке: {dwell['unloading']:.0f} мин\n"
+
+            longest = sorted(report["stops"], key=lambda stop: stop["minutes"], reverse=True)[:5]
+            if longest:
+                text += "\n<b>Самые долгие стоянки:</b>\n"
+                for stop in longest:
+                    start = datetime.fromisoformat(stop["start"]).astimezone(MOSCOW_TZ)
+                    place = {"loading": " (погрузка)", "unloading": " (выгрузка)"}.get(stop["at"], "")
+                    text += f"• {start:%d.%m %H:%M} — {stop['minutes']:.0f} мин{place}\n"
+
+        kb = InlineKeyboardBuilder()
+        kb.button(text="◀️ Назад", callback_data=f"view_trip:{trip_id}")
+
+        await callback.message.edit_text(
+            text,
+            reply_markup=kb.as_markup(),
+            parse_mode="HTML"
+        )
+
+        await callback.answer()
+
+    except Exception as e:
+        logger.error(f"Failed to show analytics: {e}", exc_info=True)
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
@@ -14,6 +14,7 @@ import logging
 
 import db_documents
 from db import get_phone
+from bot.outbox import outbox
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -148,7 +149,7 @@ async def handle_photo_document(message: Message, state: FSMContext):
                     f"📋 ID документа: {doc_id}"
                 )
 
-                sent_msg = await message.bot.send_photo(
+                sent_msg = await outbox.send_photo(
                     GROUP_CHAT_ID,
                     photo=file_id,
                     caption=caption,
@@ -228,7 +229,7 @@ async def handle_file_document(message: Message, state: FSMContext):
                     f"📋 ID документа: {doc_id}"
                 )
 
-                await message.bot.send_document(
+                await outbox.send_document(
                     GROUP_CHAT_ID,
                     document=file_id,
                     caption=caption,
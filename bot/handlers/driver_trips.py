@@ -259,7 +259,13 @@ async def confirm_status(callback: CallbackQuery):
         # Если завершен - останавливаем отслеживание
         if new_status == 'completed':
             from db import set_active
+            from bot.live_location import live_downsampler
+            from bot.reminders import reminder_scheduler
+            from gps_filter import gps_filter
             await set_active(user_id, False)
+            reminder_scheduler.forget(user_id)
+            gps_filter.forget(user_id)
+            live_downsampler.forget(user_id)
 
         await callback.message.edit_text(
             f"✅ **Рейс #{trip['trip_number']} завершен!**\n\n"
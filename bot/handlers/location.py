@@ -1,46 +1,113 @@
-from aiogram import Router, F, Bot
+from aiogram import Router, F
+from aiogram.methods import SendLocation, SendMessage
 from aiogram.types import Message
 
-import os, logging
-from db import save_point, get_phone, is_active
+import logging
+from datetime import datetime, timezone
+from db import is_active
+from bot.live_location import live_downsampler
+from bot.geofences import geofence_engine
+from bot.fleet_snapshot import GROUP_CHAT_ID, echo_enabled, fleet_snapshot
+from bot.outbox import LOW, outbox
+from bot.point_writer import point_writer
+from bot.reminders import reminder_scheduler
+from bot.trip_metrics import trip_metrics
+from gps_filter import DUPLICATE, STALE
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID", "0"))
+# ответы водителю на отбракованную gps_filter точку
+_REJECTED_REPLIES = {
+    DUPLICATE: "Это местоположение уже получено.",
+    STALE: "Получено устаревшее местоположение — оно не сохранено. Отправьте текущее.",
+}
+_REJECTED_DEFAULT = (
+    "⚠️ Местоположение не сохранено: похоже на сбой GPS. "
+    "Проверьте геолокацию на телефоне и отправьте ещё раз."
+)
+
+
+async def _after_save(user_id: int, lat: float, lon: float, ts: datetime, tracked: bool) -> None:
+    live_downsampler.note(user_id, lat, lon, ts)
+    # переносим дедлайны напоминания/эскалации (и сбрасываем эскалацию) —
+    # только зарегистрированным активным водителям, как и при старте
+    if tracked:
+        reminder_scheduler.on_point(user_id, ts)
+    # сводка по парку обновится в ближайшее окно FLEET_SNAPSHOT_INTERVAL_S
+    fleet_snapshot.mark_dirty()
+    # въезд/выезд из геозон погрузки и выгрузки
+    geofence_engine.on_point(user_id, lat, lon, ts)
+    # пробег, скорость и ETA активного рейса
+    await trip_metrics.on_point(user_id, lat, lon, ts)
+
 
 @router.message(F.location)
 async def handle_location(msg: Message):
     user_id = msg.from_user.id
-    # Пропускаем, если водитель отключил отслеживание
-    if not await is_active(user_id):
-        logger.info("ignore location from inactive driver %s", user_id)
-        return
     lat = msg.location.latitude
     lon = msg.location.longitude
     ts = msg.date
 
-    await save_point(user_id, lat, lon, ts)
-
-    # FIX: Очищаем эскалацию при получении локации
+    # ждём коммита пачки с этой точкой — только после него отвечаем водителю;
+    # флаг active и телефон приходят из той же транзакции
     try:
-        from bot.main import escalation_sent
-        escalation_sent.pop(user_id, None)
+        stored, phone, rejected, tracked = await point_writer.ingest(user_id, lat, lon, ts)
     except Exception:
-        pass  # Если main еще не загружен
-
-    # дублируем в группу
-    GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
-    GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR) if GROUP_CHAT_ID_STR else None
-    if GROUP_CHAT_ID:
-        bot: Bot = msg.bot
-        phone = await get_phone(user_id)
+        logger.exception("Failed to save point for %s", user_id)
+        await msg.answer("❌ Не удалось сохранить местоположение. Попробуйте ещё раз.")
+        return
+    if rejected and not stored:
+        # повтор или сбой GPS: дедлайны, сводку и эхо не трогаем, а водителю
+        # честно говорим, что точка не записана
+        if await is_active(user_id):
+            await msg.answer(_REJECTED_REPLIES.get(rejected, _REJECTED_DEFAULT))
+        return
+    # Пропускаем, если водитель отключил отслеживание
+    if not stored:
+        logger.info("ignore location from inactive driver %s", user_id)
+        return
+
+    await _after_save(user_id, lat, lon, ts, tracked)
+
+    # эхо каждой точки в группу — только в режиме GROUP_ECHO_MODE=echo|both
+    if echo_enabled():
         caption = f"📞 {phone}" if phone else f"Водитель {user_id}"
-        try:
-            await bot.send_location(GROUP_CHAT_ID, lat, lon, disable_notification=True)
-            await bot.send_message(GROUP_CHAT_ID, caption, disable_notification=True)
-        except Exception as e:
-            logger.warning("Не удалось отправить точку в группу: %s", e)
+        # низкий приоритет и без ожидания: эхо не задерживает ответ водителю,
+        # порядок «точка → подпись» в одном чате сохраняется
+        outbox.post(
+            SendLocation(chat_id=GROUP_CHAT_ID, latitude=lat, longitude=lon, disable_notification=True),
+            LOW,
+        )
+        outbox.post(SendMessage(chat_id=GROUP_CHAT_ID, text=caption, disable_notification=True), LOW)
 
     await msg.answer("Спасибо, местоположение сохранено!")
+
+
+@router.edited_message(F.location)
+async def handle_live_location(msg: Message):
+    """
+    Очередная точка Live Location (Telegram присылает её правкой сообщения).
+
+    Точка прореживается по расстоянию/времени и сохраняется молча:
+    без ответа водителю и без эха в группу.
+    """
+    user_id = msg.from_user.id
+    # из кэша профилей: неактивного водителя не прореживаем и не пишем
+    if not await is_active(user_id):
+        return
+    lat = msg.location.latitude
+    lon = msg.location.longitude
+    # время правки, а не исходного сообщения — иначе весь поток «в прошлом»
+    ts = datetime.fromtimestamp(msg.edit_date, timezone.utc) if msg.edit_date else msg.date
+
+    if not await live_downsampler.accept(user_id, lat, lon, ts):
+        return
+    try:
+        result = await point_writer.ingest(user_id, lat, lon, ts)
+    except Exception:
+        logger.exception("Failed to save live point for %s", user_id)
+        return
+    if result.stored:
+        await _after_save(user_id, lat, lon, ts, result.tracked)
@@ -14,6 +14,8 @@ import logging
 
 from db import set_active, get_phone
 from bot.keyboards import location_kb
+from bot.outbox import outbox
+from bot.reminders import reminder_scheduler
 
 GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
 GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR) if GROUP_CHAT_ID_STR else None
@@ -27,6 +29,7 @@ async def resume_tracking(message: types.Message):
 
     # 1. Активируем трекинг
     await set_active(uid, True)
+    await reminder_scheduler.track(uid)
 
     # 2. Сообщаем водителю и отдаём клавиатуру
     await message.answer(
@@ -44,6 +47,6 @@ async def resume_tracking(message: types.Message):
             f"✅ Водитель {uid} возобновил отслеживание."
         )
         try:
-            await message.bot.send_message(GROUP_CHAT_ID, caption)
+            outbox.post_message(GROUP_CHAT_ID, caption)
         except Exception as exc:
             logging.getLogger(__name__).warning("Не удалось уведомить группу: %s", exc)
\ No newline at end of file
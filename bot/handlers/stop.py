@@ -13,6 +13,10 @@ from bot.keyboards import resume_kb
 
 
 from db import get_phone, set_active
+from bot.outbox import outbox
+from bot.live_location import live_downsampler
+from bot.reminders import reminder_scheduler
+from gps_filter import gps_filter
 
 import os
 GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
@@ -38,6 +42,11 @@ async def stop_tracking(message: types.Message):
     
     # помечаем водителя как неактивного
     await set_active(message.from_user.id, False)
+    reminder_scheduler.forget(message.from_user.id)
+    # после /resume водитель может оказаться где угодно: прежняя точка
+    # не должна ни отбраковывать, ни прореживать новые
+    gps_filter.forget(message.from_user.id)
+    live_downsampler.forget(message.from_user.id)
 
     # 2. Уведомление диспетчерской
     if GROUP_CHAT_ID:
@@ -48,7 +57,7 @@ async def stop_tracking(message: types.Message):
             else f"🚫 Водитель {message.from_user.id} прекратил отслеживание."
         )
         try:
-            await message.bot.send_message(GROUP_CHAT_ID, caption)
+            outbox.post_message(GROUP_CHAT_ID, caption)
         except Exception as exc:
             # не критично, просто записываем в лог
             import logging
@@ -0,0 +1,76 @@
+"""
+Прореживание потока Live Location.
+
+Пока водитель транслирует геопозицию, Telegram присылает edited_message
+с новой точкой примерно раз в 30 секунд — до 2 880 строк в сутки на машину.
+Точка из потока сохраняется, только если водитель сдвинулся хотя бы на
+LIVE_MIN_DISTANCE_M метров или с прошлой сохранённой точки прошло
+LIVE_MIN_INTERVAL_S секунд. На стоянке остаётся «пульс» раз в интервал,
+в движении трек не теряет поворотов.
+"""
+
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import db
+from geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+MIN_DISTANCE_M = float(os.getenv("LIVE_MIN_DISTANCE_M", "200"))
+MIN_INTERVAL_S = float(os.getenv("LIVE_MIN_INTERVAL_S", "300"))
+
+# user_id → (lat, lon, ts) последней сохранённой точки
+_Fix = Tuple[float, float, datetime]
+
+
+class LiveDownsampler:
+    """Решает, сохранять ли очередную точку Live Location водителя."""
+
+    def __init__(self, min_distance_m: float = MIN_DISTANCE_M, min_interval_s: float = MIN_INTERVAL_S):
+        self.min_distance_m = min_distance_m
+        self.min_interval_s = min_interval_s
+        self._last: Dict[int, _Fix] = {}
+        self.accepted = 0
+        self.dropped = 0
+
+    def note(self, user_id: int, lat: float, lon: float, ts: datetime) -> None:
+        """Запомнить сохранённую точку (в том числе отправленную кнопкой)."""
+        last = self._last.get(user_id)
+        if last is None or ts >= last[2]:
+            self._last[user_id] = (lat, lon, ts)
+
+    def forget(self, user_id: int) -> None:
+        self._last.pop(user_id, None)
+
+    async def _last_fix(self, user_id: int) -> Optional[_Fix]:
+        last = self._last.get(user_id)
+        if last is None:
+            # первый апдейт после рестарта — берём последнюю точку из БД
+            point = await db.get_last_point(user_id)
+            if point is not None:
+                last = (point["lat"], point["lon"], point["ts"])
+                self._last[user_id] = last
+        return last
+
+    async def accept(self, user_id: int, lat: float, lon: float, ts: datetime) -> bool:
+        """True, если точку из потока нужно сохранить."""
+        last = await self._last_fix(user_id)
+        if last is not None:
+            last_lat, last_lon, last_ts = last
+            elapsed = (ts - last_ts).total_seconds()
+            if elapsed < self.min_interval_s and (
+                haversine_m(last_lat, last_lon, lat, lon) < self.min_distance_m
+            ):
+                self.dropped += 1
+                return False
+        self.accepted += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"drivers": len(self._last), "accepted": self.accepted, "dropped": self.dropped}
+
+
+live_downsampler = LiveDownsampler()
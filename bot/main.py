@@ -2,16 +2,15 @@ import asyncio
 import logging
 import os
 import sys
-from datetime import datetime, timezone, timedelta
-from dateutil.parser import isoparse
 from zoneinfo import ZoneInfo
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-import aiosqlite
 import db
 import db_trips
 import db_documents
+import db_pool
+import driver_cache
 
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -28,19 +27,16 @@ from bot.handlers.resume import router as resume_router
 from bot.handlers.redeploy import redeploy
 from bot.handlers.curator import router as curator_router
 from bot.handlers.driver_trips import router as driver_trips_router
-from db import get_phone, is_active
-from bot.utils import is_curator
-
-# === intervals (in hours) ===
-REMIND_HOURS = float(os.getenv("REMIND_HOURS", "0.2"))  # default 0.2 h ≈ 12 min
-
-# FIX: GROUP_CHAT_ID может быть отрицательным (группы в Telegram)
-GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
-GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR) if GROUP_CHAT_ID_STR else None
-ESCALATE_DELAY = timedelta(hours=REMIND_HOURS + 2)  # reminder + 2 h
-
-# minutes to wait if DB fetch fails (at least 2 min, or REMIND_HOURS*60)
-POLL_MINUTES = max(int(REMIND_HOURS * 60), 2)
+from bot.fleet_snapshot import fleet_snapshot
+from bot.geofences import geofence_engine
+from bot.live_location import live_downsampler
+from bot.outbox import outbox
+from bot.point_writer import point_writer
+from bot.reminders import REMIND_HOURS, reminder_scheduler
+from bot.trip_metrics import trip_metrics
+from change_feed import change_pruner
+from geocoding import geocoder
+from gps_filter import gps_filter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -51,124 +47,6 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
-# ============================================================================
-# FIX 1: Трекинг отправленных эскалаций (чтобы не спамить)
-# ============================================================================
-escalation_sent = {}  # {user_id: timestamp когда отправили эскалацию}
-escalation_lock = asyncio.Lock()  # Защита от race conditions
-
-
-async def remind_every_12h(bot: Bot) -> None:
-    logger.info("reminder-loop: started (REMIND_HOURS=%s)", REMIND_HOURS)
-    while True:
-        now = datetime.now(timezone.utc)
-
-        try:
-            async with aiosqlite.connect(db.DB_PATH) as conn:
-                await db._ensure_schema(conn)
-
-                # FIX 2: Берем только АКТИВНЫХ водителей
-                # (у которых есть запись в drivers с active=1)
-                query = """
-                    SELECT DISTINCT p.user_id
-                    FROM points p
-                    INNER JOIN drivers d ON p.user_id = d.user_id
-                    WHERE d.active = 1
-                """
-                async with conn.execute(query) as cur:
-                    rows = await cur.fetchall()
-                    user_ids = [row[0] for row in rows]
-                    logger.debug(
-                        "reminder-loop: active users=%s (now=%s)", user_ids, now
-                    )
-        except (aiosqlite.Error, OSError) as err:
-            logger.exception("Failed to fetch user list: %s", err)
-            await asyncio.sleep(POLL_MINUTES * 60)
-            continue
-
-        for uid in user_ids:
-            # FIX: Пропускаем кураторов - им не нужны напоминания о местоположении
-            if is_curator(uid):
-                logger.debug("Skipping curator %s from location reminders", uid)
-                continue
-
-            try:
-                point = await db.get_last_point(uid)
-            except Exception:
-                continue
-
-            if not point:
-                continue
-
-            # FIX 3: Унифицированная обработка timezone
-            val = point["ts"]
-            if isinstance(val, str):
-                last_ts = isoparse(val).astimezone(timezone.utc)
-            elif val.tzinfo is None:
-                # naive datetime - считаем UTC
-                last_ts = val.replace(tzinfo=timezone.utc)
-            else:
-                last_ts = val.astimezone(timezone.utc)
-
-            time_since_last = now - last_ts
-
-            # 1. Личное напоминание (>REMIND_HOURS h)
-            if time_since_last > timedelta(hours=REMIND_HOURS):
-                logger.info("Sending %.2f‑hour reminder to %s", REMIND_HOURS, uid)
-                try:
-                    await bot.send_message(
-                        uid,
-                        "Напоминание! Пожалуйста, нажмите «Поделиться местоположением».",
-                    )
-                except Exception as exc:
-                    logger.exception("Failed to send reminder to %s: %s", uid, exc)
-
-            # 2. Эскалация в группу (>REMIND_HOURS + 2 h)
-            # FIX 4: Отправляем эскалацию только ОДИН РАЗ
-            if time_since_last > ESCALATE_DELAY and GROUP_CHAT_ID:
-                # Используем lock для безопасного доступа к escalation_sent
-                async with escalation_lock:
-                    # Проверяем, не отправляли ли уже эскалацию
-                    last_escalation = escalation_sent.get(uid)
-
-                    # Отправляем эскалацию, если:
-                    # - ещё не отправляли OR
-                    # - с последней эскалации прошло >12 часов (чтобы напомнить снова)
-                    should_escalate = last_escalation is None or (
-                        now - last_escalation
-                    ) > timedelta(hours=12)
-
-                    if should_escalate:
-                        logger.info("Escalating: no coords from %s since %s", uid, last_ts)
-                        phone = await get_phone(uid)
-                        caption = (
-                            f"⚠️ Нет координат от водителя 📞 {phone} с {last_ts:%d.%m %H:%M} UTC"
-                            if phone
-                            else f"⚠️ Нет координат от водителя {uid} с {last_ts:%d.%m %H:%M} UTC"
-                        )
-                        try:
-                            await bot.send_message(GROUP_CHAT_ID, caption)
-                            escalation_sent[uid] = now  # Запоминаем время эскалации
-                        except Exception as e:
-                            logger.warning("Не удалось отправить эскалацию: %s", e)
-
-            # FIX 5: Очищаем трекинг эскалации, если водитель снова активен
-            if time_since_last <= timedelta(hours=REMIND_HOURS):
-                async with escalation_lock:
-                    escalation_sent.pop(uid, None)
-
-        # FIX 6: Очищаем старые записи эскалаций (>24 часов)
-        async with escalation_lock:
-            cutoff_time = now - timedelta(hours=24)
-            escalation_sent_copy = {
-                uid: ts for uid, ts in escalation_sent.items()
-                if ts > cutoff_time
-            }
-            escalation_sent.clear()
-            escalation_sent.update(escalation_sent_copy)
-
-        await asyncio.sleep(max(int(REMIND_HOURS * 60), 2) * 60)
-
 
 async def main() -> None:
     # полезный стартовый лог
@@ -188,6 +66,11 @@ async def main() -> None:
     await db_trips.init()
     await db_documents.init_documents_db()
 
+    # фильтру GPS нужна последняя принятая точка каждого водителя
+    gps_filter.seed(
+        (pos["user_id"], pos["lat"], pos["lon"], pos["ts"]) for pos in await db.get_fleet_positions()
+    )
+
     # Создаем бота (aiogram 3.0.0 не поддерживает async with)
     bot = Bot(BOT_TOKEN)
     dp = Dispatcher(storage=MemoryStorage())
@@ -202,22 +85,42 @@ async def main() -> None:
     dp.include_router(curator_router)
     dp.include_router(driver_trips_router)
 
-    # запускаем фоновый цикл напоминаний
-    reminder_task = asyncio.create_task(remind_every_12h(bot))
+    # запускаем пакетную запись точек, очередь исходящих, напоминания, сводку, геозоны и метрики рейсов
+    point_writer.start()
+    outbox.start(bot)
+    reminder_scheduler.start()
+    fleet_snapshot.start()
+    geofence_engine.start()
+    trip_metrics.start()
+    # журнал changes растёт с каждой точкой — чистим его и без веба
+    change_pruner.start()
 
     try:
         logger.info("🚀 Starting polling")
         await dp.start_polling(bot)
     finally:
         # корректная остановка фоновой задачи
-        reminder_task.cancel()
-        try:
-            await reminder_task
-        except asyncio.CancelledError:
-            pass
+        await reminder_scheduler.stop()
+        await fleet_snapshot.stop()
+        await change_pruner.stop()
+        # дописываем точки из очереди до закрытия пулов
+        await point_writer.stop()
+        # и события геозон и метрики рейсов по этим точкам
+        await geofence_engine.stop()
+        await trip_metrics.stop()
+        await geocoder.close()
+        # досылаем очередь исходящих сообщений
+        await outbox.stop()
         # Закрываем сессию бота
         await bot.session.close()
-
+        # Закрываем пулы соединений с БД
+        await db_pool.close_all()
+
+    logger.info("driver-cache: %s", driver_cache.stats())
+    logger.info("live-location: %s", live_downsampler.stats())
+    logger.info("gps-filter: %s", gps_filter.stats())
+    logger.info("geocoder: %s", geocoder.stats())
+    logger.info("trip-metrics: %s", trip_metrics.stats())
     logger.info("🛑 Bot stopped")
 
 
@@ -0,0 +1,374 @@
+"""
+Исходящие сообщения в Telegram через единый диспетчер с лимитами.
+
+Все отправки бота (напоминания, эскалации, уведомления кураторов и группы,
+пересылка документов) ставятся в очередь вместо прямого bot.send_*:
+
+* три приоритета (HIGH — личные уведомления водителю/куратору, NORMAL —
+  напоминания и уведомления группы, LOW — эхо точек в группу);
+* token bucket на весь бот (~30 сообщений/с), на личный чат (~1/с) и на
+  группу (~20/мин), как в ограничениях Bot API;
+* TelegramRetryAfter: чат «замораживается» на retry_after секунд, а
+  сообщение возвращается в начало очереди чата;
+* порядок сообщений в одном чате сохраняется (эхо: точка, затем подпись);
+* метрики: глубина очередей, задержка постановка→отправка (p50/p99),
+  число отправленных/ошибок/RetryAfter.
+
+Ответы в рамках текущего апдейта (message.answer, callback.answer,
+edit_text) идут напрямую — они и так ограничены действиями пользователя.
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendDocument, SendLocation, SendMessage, SendPhoto
+from aiogram.methods.base import TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+# Лимиты (можно переопределить через .env)
+GLOBAL_PER_SEC = float(os.getenv("OUTBOX_GLOBAL_PER_SEC", "30"))
+CHAT_PER_SEC = float(os.getenv("OUTBOX_CHAT_PER_SEC", "1"))
+GROUP_PER_MIN = float(os.getenv("OUTBOX_GROUP_PER_MIN", "20"))
+MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "8"))
+MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+STATS_INTERVAL_S = float(os.getenv("OUTBOX_STATS_INTERVAL_S", "300"))
+
+HIGH, NORMAL, LOW = 0, 1, 2
+_PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 — можно сейчас)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+@dataclass
+class _Job:
+    method: TelegramMethod
+    future: asyncio.Future
+    priority: int
+    enqueued: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    # очереди сообщений чата по приоритетам
+    queues: Dict[int, Deque[_Job]] = field(
+        default_factory=lambda: {HIGH: deque(), NORMAL: deque(), LOW: deque()}
+    )
+    blocked_until: float = 0.0  # RetryAfter
+    in_flight: bool = False     # ждём ответа на предыдущее сообщение чата
+
+
+class Outbox:
+    """Очередь исходящих сообщений с приоритетами и лимитами Bot API."""
+
+    def __init__(
+        self,
+        global_per_sec: float = GLOBAL_PER_SEC,
+        chat_per_sec: float = CHAT_PER_SEC,
+        group_per_min: float = GROUP_PER_MIN,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        self.chat_per_sec = chat_per_sec
+        self.group_per_min = group_per_min
+        self.max_in_flight = max(max_in_flight, 1)
+        self._global = TokenBucket(global_per_sec, max(global_per_sec, 1))
+        self._chats: "OrderedDict[int | str, _Chat]" = OrderedDict()
+        self._depth = {HIGH: 0, NORMAL: 0, LOW: 0}
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sending: set = set()
+        # метрики
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._stats_logged = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # постановка в очередь
+    # ------------------------------------------------------------------
+
+    def _chat(self, chat_id: int | str) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if not isinstance(chat_id, int) or chat_id < 0:
+                # группы и каналы: ~20 сообщений в минуту
+                bucket = TokenBucket(self.group_per_min / 60, max(self.group_per_min, 1))
+            else:
+                bucket = TokenBucket(self.chat_per_sec, 1)
+            chat = self._chats[chat_id] = _Chat(bucket)
+        return chat
+
+    def submit(self, method: TelegramMethod, priority: int = NORMAL) -> asyncio.Future:
+        """
+        Поставить метод Bot API в очередь.
+
+        Возвращает future с результатом вызова (например, Message) или
+        ошибкой Bot API. Если результат не нужен, используйте post().
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self._task is None:
+            # диспетчер не запущен (скрипты): отправляем напрямую
+            if self._bot is None:
+                future.set_exception(RuntimeError("Outbox is not started"))
+            else:
+                asyncio.ensure_future(self._direct(method, future))
+            return future
+
+        job = _Job(method, future, priority)
+        self._chat(method.chat_id).queues[priority].append(job)
+        self._depth[priority] += 1
+        self._wakeup.set()
+        return future
+
+    def post(self, method: TelegramMethod, priority: int = NORMAL) -> asyncio.Future:
+        """Отправить без ожидания результата; ошибка попадёт в лог."""
+        future = self.submit(method, priority)
+        future.add_done_callback(_log_failure)
+        return future
+
+    async def _direct(self, method: TelegramMethod, future: asyncio.Future) -> None:
+        try:
+            future.set_result(await self._bot(method))
+        except Exception as e:
+            future.set_exception(e)
+
+    async def send_message(self, chat_id: int, text: str, priority: int = NORMAL, **kwargs: Any):
+        return await self.submit(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def post_message(self, chat_id: int, text: str, priority: int = NORMAL, **kwargs: Any) -> asyncio.Future:
+        """
+        send_message без ожидания: для уведомлений из хендлеров.
+
+        Группа ограничена ~20 сообщениями в минуту — ожидание отправки
+        задержало бы ответ пользователю на секунды и минуты.
+        """
+        return self.post(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    async def send_location(
+        self, chat_id: int, latitude: float, longitude: float, priority: int = NORMAL, **kwargs: Any
+    ):
+        return await self.submit(
+            SendLocation(chat_id=chat_id, latitude=latitude, longitude=longitude, **kwargs), priority
+        )
+
+    async def send_photo(self, chat_id: int, photo: Any, priority: int = NORMAL, **kwargs: Any):
+        return await self.submit(SendPhoto(chat_id=chat_id, photo=photo, **kwargs), priority)
+
+    async def send_document(self, chat_id: int, document: Any, priority: int = NORMAL, **kwargs: Any):
+        return await self.submit(SendDocument(chat_id=chat_id, document=document, **kwargs), priority)
+
+    # ------------------------------------------------------------------
+    # фоновая задача
+    # ------------------------------------------------------------------
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="outbox")
+            logger.info(
+                "outbox: started (global=%s/s, chat=%s/s, group=%s/min)",
+                self._global.rate, self.chat_per_sec, self.group_per_min,
+            )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дождаться отправки очереди (не дольше timeout) и остановиться."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (sum(self._depth.values()) or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for chat in self._chats.values():
+            for queue in chat.queues.values():
+                while queue:
+                    queue.popleft().future.cancel()
+        self._depth = {HIGH: 0, NORMAL: 0, LOW: 0}
+        logger.info("outbox: stopped %s", self.stats())
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch()
+            self._maybe_log_stats()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Запустить отправку всего, что разрешают лимиты, за один проход по чатам.
+
+        Проход прерывается только глобальным лимитом или max_in_flight,
+        поэтому пачка напоминаний N водителям стоит O(N), а не O(N²).
+
+        Returns:
+            Сколько спать до следующей возможности или None — ждать новых
+            сообщений либо завершения отправки.
+        """
+        now = time.monotonic()
+        wait: Optional[float] = None
+
+        def later(seconds: float) -> None:
+            nonlocal wait
+            wait = seconds if wait is None else min(wait, seconds)
+
+        for priority in (HIGH, NORMAL, LOW):
+            if not self._depth[priority]:
+                continue
+            for chat_id, chat in list(self._chats.items()):
+                queue = chat.queues[priority]
+                if not queue or chat.in_flight:
+                    continue
+                # более приоритетные сообщения этого чата идут первыми
+                if any(chat.queues[p] for p in range(priority)):
+                    continue
+                if chat.blocked_until > now:
+                    later(chat.blocked_until - now)
+                    continue
+                chat_wait = chat.bucket.wait_time(now)
+                if chat_wait:
+                    later(chat_wait)
+                    continue
+                if self._in_flight >= self.max_in_flight:
+                    return None  # разбудит завершение отправки
+                global_wait = self._global.wait_time(now)
+                if global_wait:
+                    later(global_wait)
+                    return wait
+
+                job = queue.popleft()
+                self._depth[priority] -= 1
+                chat.bucket.take(now)
+                self._global.take(now)
+                chat.in_flight = True
+                self._in_flight += 1
+                # честная очередь: обслуженный чат уходит в конец
+                self._chats.move_to_end(chat_id)
+                task = asyncio.create_task(self._send(chat_id, chat, job))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+
+        self._forget_idle_chats(now)
+        return wait
+
+    def _forget_idle_chats(self, now: float) -> None:
+        """Не держать в памяти пустые чаты с полным ведром токенов."""
+        if len(self._chats) < 1000:
+            return
+        for chat_id, chat in list(self._chats.items()):
+            if (
+                not chat.in_flight
+                and chat.blocked_until <= now
+                and not any(chat.queues.values())
+                and chat.bucket.wait_time(now) == 0
+            ):
+                del self._chats[chat_id]
+
+    async def _send(self, chat_id: int | str, chat: _Chat, job: _Job) -> None:
+        try:
+            job.attempts += 1
+            result = await self._bot(job.method)
+        except TelegramRetryAfter as e:
+            self.retry_after += 1
+            chat.blocked_until = time.monotonic() + e.retry_after
+            if job.attempts <= MAX_RETRIES:
+                logger.warning(
+                    "outbox: flood limit for chat %s, retry in %s s", chat_id, e.retry_after
+                )
+                chat.queues[job.priority].appendleft(job)
+                self._depth[job.priority] += 1
+            else:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - job.enqueued)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            chat.in_flight = False
+            self._in_flight -= 1
+            self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # метрики
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        p50 = statistics.median(latencies) if latencies else 0.0
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else 0.0
+        return {
+            "depth": {_PRIORITY_NAMES[p]: n for p, n in self._depth.items()},
+            "in_flight": self._in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_after": self.retry_after,
+            "latency_p50_ms": round(p50 * 1000, 1),
+            "latency_p99_ms": round(p99 * 1000, 1),
+        }
+
+    def _maybe_log_stats(self) -> None:
+        now = time.monotonic()
+        if now - self._stats_logged >= STATS_INTERVAL_S:
+            self._stats_logged = now
+            logger.info("outbox: %s", self.stats())
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    """Ошибка отправки через post() попадает в лог, а не теряется."""
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        logger.warning("outbox: send failed: %s", exc)
+
+
+outbox = Outbox()
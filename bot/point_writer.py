@@ -0,0 +1,186 @@
+"""
+Пакетная запись точек (group commit).
+
+Хендлер локации кладёт точку в ограниченную очередь и ждёт, пока пачка с
+этой точкой будет закоммичена. Фоновая задача сбрасывает очередь одной
+транзакцией каждые POINT_BATCH_SIZE точек или каждые POINT_FLUSH_MS мс —
+один fsync на пачку вместо одного на точку. Та же транзакция проверяет
+флаг active и достаёт телефон водителя (db.ingest_points), так что
+хендлеру больше не нужны отдельные запросы is_active/get_phone.
+
+Перед постановкой в очередь точка проходит gps_filter; отбракованные
+точки пишутся той же пачкой в rejected_points, а принятые фильтр
+запоминает только после коммита.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import db
+from gps_filter import gps_filter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("POINT_BATCH_SIZE", "50"))
+FLUSH_MS = int(os.getenv("POINT_FLUSH_MS", "100"))
+QUEUE_MAX = int(os.getenv("POINT_QUEUE_MAX", "1000"))
+
+_STOP = object()  # маркер остановки в очереди
+
+
+class Ingested(NamedTuple):
+    """Итог записи точки для хендлера."""
+
+    stored: bool  # точка записана в points
+    phone: Optional[str]  # телефон водителя (None, если точка отбракована)
+    rejected: Optional[str]  # причина отбраковки gps_filter или None
+    tracked: bool = False  # водитель есть в drivers и active — ему нужны напоминания
+
+
+class PointWriter:
+    """Фоновый писатель точек с очередью и групповым коммитом."""
+
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        flush_ms: int = FLUSH_MS,
+        queue_max: int = QUEUE_MAX,
+    ):
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_ms / 1000
+        self.queue_max = queue_max
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self) -> None:
+        """Запустить фоновую задачу записи (из bot.main)."""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._batch_ready = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._run(), name="point-writer")
+        logger.info(
+            "point-writer: started (batch=%s, flush=%sms, queue=%s)",
+            self.batch_size, int(self.flush_interval * 1000), self.queue_max,
+        )
+
+    async def ingest(self, user_id: int, lat: float, lon: float, ts: datetime) -> Ingested:
+        """
+        Проверить точку фильтром, поставить в очередь и дождаться коммита пачки.
+
+        stored=False — водитель выключил отслеживание или точка отбракована
+        (причина в rejected). Если очередь заполнена, вызов ждёт свободного
+        места (backpressure). Ошибка записи пачки пробрасывается каждому
+        ожидающему.
+        """
+        point = (user_id, lat, lon, ts)
+        reason = gps_filter.classify(user_id, lat, lon, ts)
+        if self._task is None or self._closing:
+            # писатель не запущен (скрипты) или уже останавливается
+            result = (await self._write([(point, reason)]))[0]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((point, reason, future))
+            if self._queue.qsize() >= self.batch_size:
+                self._batch_ready.set()
+            result = await future
+        # фильтр запоминает точку только после коммита: при сбое пачки
+        # повторная отправка не будет отвергнута как duplicate
+        if result.stored and reason is None:
+            gps_filter.accept(user_id, lat, lon, ts)
+        return result
+
+    @staticmethod
+    async def _write(items: list) -> list:
+        """Записать пачку (point, reason) одной транзакцией."""
+        points, rejected, index = [], [], []
+        for point, reason in items:
+            store = reason is None or gps_filter.stores_rejected
+            if reason is not None:
+                rejected.append((*point, reason, store))
+            index.append(len(points) if store else None)
+            if store:
+                points.append(point)
+        results = await db.ingest_points(points, rejected)
+        out = []
+        for (_, reason), i in zip(items, index):
+            if i is None:
+                out.append(Ingested(False, None, reason))
+            else:
+                stored, phone, tracked = results[i]
+                out.append(Ingested(stored, phone, reason, tracked))
+        return out
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+
+            # ждём либо заполнения пачки, либо истечения окна; при остановке
+            # не ждём — clear() стёр бы сигнал, выставленный stop()
+            if not self._closing and self._queue.qsize() < self.batch_size - 1:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            results = await self._write([(point, reason) for point, reason, _ in batch])
+        except Exception as e:
+            logger.exception("point-writer: failed to save batch of %s points", len(batch))
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug("point-writer: committed %s points", len(batch))
+        for (*_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def stop(self) -> None:
+        """Дописать всё, что в очереди, и остановить фоновую задачу."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        self._batch_ready.set()
+        try:
+            await self._task
+        finally:
+            # точки, попавшие в очередь после маркера остановки
+            leftover = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    leftover.append(item)
+            if leftover:
+                await self._flush(leftover)
+            self._task = None
+        logger.info("point-writer: stopped")
+
+
+point_writer = PointWriter()
@@ -0,0 +1,281 @@
+"""
+Планировщик напоминаний и эскалаций по дедлайнам.
+
+Вместо опроса всех водителей каждые POLL_MINUTES держим min-heap дедлайнов
+«пора напомнить» и «пора эскалировать» для каждого водителя:
+
+* при старте куча заполняется одним запросом (db.get_overdue_drivers:
+  последняя точка, телефон и флаги просрочки активных водителей);
+* каждая сохранённая точка зарегистрированного активного водителя
+  переносит его дедлайны (on_point);
+* перед отправкой флаг active перечитывается из БД: водитель, выключенный
+  или удалённый другим процессом, снимается с учёта;
+* фоновая задача спит ровно до ближайшего дедлайна, поэтому работа за
+  один тик пропорциональна числу «просроченных» водителей, а не размеру
+  парка, и напоминание приходит вовремя, а не с опозданием до интервала
+  опроса.
+
+Поведение прежнего цикла сохранено: пока водитель молчит дольше
+REMIND_HOURS, личное напоминание повторяется каждые POLL_MINUTES;
+эскалация в группу уходит один раз и повторяется не чаще раза в 12 часов.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.methods import SendMessage
+
+import db
+import driver_cache
+from bot.outbox import outbox
+from bot.utils import get_curator_ids
+
+logger = logging.getLogger(__name__)
+
+# === intervals (in hours) ===
+REMIND_HOURS = float(os.getenv("REMIND_HOURS", "0.2"))  # default 0.2 h ≈ 12 min
+
+# FIX: GROUP_CHAT_ID может быть отрицательным (группы в Telegram)
+GROUP_CHAT_ID_STR = os.getenv("GROUP_CHAT_ID")
+GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR) if GROUP_CHAT_ID_STR else None
+ESCALATE_DELAY = timedelta(hours=REMIND_HOURS + 2)  # reminder + 2 h
+ESCALATE_REPEAT = timedelta(hours=12)  # повторная эскалация не чаще
+
+# minutes between repeated reminders and before retrying a failed seed
+POLL_MINUTES = max(int(REMIND_HOURS * 60), 2)
+
+REMIND = "remind"
+ESCALATE = "escalate"
+
+REMINDER_TEXT = "Напоминание! Пожалуйста, нажмите «Поделиться местоположением»."
+
+# (дедлайн в секундах эпохи, порядковый номер, user_id, вид, поколение)
+_Entry = Tuple[float, int, int, str, int]
+
+
+class ReminderScheduler:
+    """Min-heap дедлайнов напоминаний/эскалаций с ленивым удалением."""
+
+    def __init__(self):
+        self._heap: List[_Entry] = []
+        self._seq = itertools.count()
+        # user_id → время последней точки (UTC)
+        self._last_ts: Dict[int, datetime] = {}
+        # user_id → поколение; записи кучи старых поколений игнорируются
+        self._generation: Dict[int, int] = {}
+        # user_id → когда отправили эскалацию
+        self.escalation_sent: Dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------------
+    # управление дедлайнами
+    # ------------------------------------------------------------------
+
+    def _push(self, due: datetime, user_id: int, kind: str) -> None:
+        entry = (due.timestamp(), next(self._seq), user_id, kind, self._generation[user_id])
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # новый ближайший дедлайн — будим цикл, чтобы он пересчитал сон
+            self._wakeup.set()
+
+    def _schedule(self, user_id: int, last_ts: datetime) -> None:
+        """Поставить дедлайны водителя от времени его последней точки."""
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        self._last_ts[user_id] = last_ts
+        self._push(last_ts + timedelta(hours=REMIND_HOURS), user_id, REMIND)
+        if GROUP_CHAT_ID:
+            last_escalation = self.escalation_sent.get(user_id)
+            due = last_ts + ESCALATE_DELAY
+            if last_escalation is not None:
+                due = max(due, last_escalation + ESCALATE_REPEAT)
+            self._push(due, user_id, ESCALATE)
+        self._compact()
+
+    def _compact(self) -> None:
+        """Перестроить кучу, если в ней накопилось много устаревших записей."""
+        if len(self._heap) <= 4 * len(self._last_ts) + 64:
+            return
+        self._heap = [entry for entry in self._heap if self._is_current(entry)]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, entry: _Entry) -> bool:
+        _, _, user_id, _, generation = entry
+        return user_id in self._last_ts and self._generation.get(user_id) == generation
+
+    def on_point(self, user_id: int, ts: datetime) -> None:
+        """Водитель прислал точку: перенести его дедлайны."""
+        if user_id in get_curator_ids():  # без INFO-лога is_curator на каждую точку
+            return
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        # FIX: Очищаем эскалацию при получении локации
+        self.escalation_sent.pop(user_id, None)
+        previous = self._last_ts.get(user_id)
+        if previous is not None and ts < previous:
+            return  # запоздавшая точка не сдвигает дедлайны назад
+        self._schedule(user_id, ts)
+
+    def forget(self, user_id: int) -> None:
+        """Водитель выключил отслеживание: больше не напоминаем."""
+        # поколение растёт монотонно, иначе старые записи кучи «оживут»
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        self._last_ts.pop(user_id, None)
+        self.escalation_sent.pop(user_id, None)
+
+    async def track(self, user_id: int) -> None:
+        """Водитель снова активен: поставить дедлайны от последней точки в БД."""
+        if user_id in get_curator_ids():
+            return
+        point = await db.get_last_point(user_id)
+        if point is not None:
+            self._schedule(user_id, point["ts"])
+
+    async def seed(self) -> int:
+        """Заполнить кучу одним запросом по последним точкам активных водителей."""
+        # FIX: Пропускаем кураторов - им не нужны напоминания о местоположении
+        drivers = await db.get_overdue_drivers(
+            timedelta(hours=REMIND_HOURS), ESCALATE_DELAY, get_curator_ids()
+        )
+        overdue = 0
+        for row in drivers:
+            user_id = row["user_id"]
+            # телефон пришёл тем же запросом — эскалации не пойдут в БД
+            driver_cache.profiles.set(user_id, (row["phone"], True))
+            known = self._last_ts.get(user_id)
+            if known is not None and known >= row["last_ts"]:
+                continue  # точка пришла, пока выполнялся запрос
+            self._schedule(user_id, row["last_ts"])
+            overdue += row["remind"]
+        logger.info(
+            "reminder-scheduler: %s drivers, %s already overdue", len(drivers), overdue
+        )
+        return len(drivers)
+
+    # ------------------------------------------------------------------
+    # фоновая задача
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="reminder-scheduler")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        logger.info("reminder-scheduler: started (REMIND_HOURS=%s)", REMIND_HOURS)
+        while True:
+            try:
+                await self.seed()
+                break
+            except Exception as err:
+                logger.exception("Failed to seed reminder deadlines: %s", err)
+                await asyncio.sleep(POLL_MINUTES * 60)
+
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0][0] - time.time(), 0)
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            await self._fire_due()
+
+    async def _fire_due(self) -> None:
+        now_s = time.time()
+        while self._heap and self._heap[0][0] <= now_s:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue  # дедлайн устарел: пришла точка или трекинг выключен
+            _, _, user_id, kind, _ = entry
+            try:
+                if kind == REMIND:
+                    await self._remind(entry)
+                else:
+                    await self._escalate(entry)
+            except Exception:
+                logger.exception("reminder-scheduler: %s for %s failed", kind, user_id)
+                self._reschedule(entry, datetime.now(timezone.utc) + timedelta(minutes=POLL_MINUTES))
+
+    def _reschedule(self, fired: _Entry, due: datetime) -> None:
+        """Повторить сработавший дедлайн, если за время отправки ничего не изменилось."""
+        if self._is_current(fired):
+            self._push(due, fired[2], fired[3])
+
+    async def _still_tracked(self, entry: _Entry) -> Optional[Tuple[Optional[str], bool]]:
+        """
+        Профиль (phone, active) водителя, если ему всё ещё нужно напоминать.
+
+        Водителя могли выключить или удалить из другого процесса (веб,
+        cleanup_old_drivers*.py) — перед отправкой читаем drivers из БД,
+        а не из кэша, и снимаем такого водителя с учёта.
+        """
+        user_id = entry[2]
+        profile = await db.get_driver(user_id)
+        if not self._is_current(entry):
+            return None  # пока ждали БД, пришла точка или трекинг выключен
+        if profile is None or not profile[1]:
+            logger.info("reminder-scheduler: %s is no longer tracked, dropping deadlines", user_id)
+            self.forget(user_id)
+            return None
+        return profile
+
+    async def _remind(self, entry: _Entry) -> None:
+        user_id = entry[2]
+        if await self._still_tracked(entry) is None:
+            return
+        now = datetime.now(timezone.utc)
+        logger.info("Sending %.2f‑hour reminder to %s", REMIND_HOURS, user_id)
+        # через outbox без ожидания: сотни напоминаний разом не упрутся в лимиты
+        outbox.post(SendMessage(chat_id=user_id, text=REMINDER_TEXT))
+        # пока водитель молчит — повторяем раз в POLL_MINUTES, как прежний цикл
+        self._reschedule(entry, now + timedelta(minutes=POLL_MINUTES))
+
+    async def _escalate(self, entry: _Entry) -> None:
+        user_id = entry[2]
+        profile = await self._still_tracked(entry)
+        if profile is None:
+            return
+        phone = profile[0]
+        last_ts = self._last_ts[user_id]
+        logger.info("Escalating: no coords from %s since %s", user_id, last_ts)
+        caption = (
+            f"⚠️ Нет координат от водителя 📞 {phone} с {last_ts:%d.%m %H:%M} UTC"
+            if phone
+            else f"⚠️ Нет координат от водителя {user_id} с {last_ts:%d.%m %H:%M} UTC"
+        )
+        future = outbox.submit(SendMessage(chat_id=GROUP_CHAT_ID, text=caption))
+        future.add_done_callback(lambda f: self._escalation_done(entry, f))
+
+    def _escalation_done(self, entry: _Entry, future: asyncio.Future) -> None:
+        """Итог отправки эскалации: запомнить её или повторить позже."""
+        now = datetime.now(timezone.utc)
+        if not future.cancelled() and future.exception() is None:
+            if self._is_current(entry):
+                self.escalation_sent[entry[2]] = now  # Запоминаем время эскалации
+            self._reschedule(entry, now + ESCALATE_REPEAT)
+        else:
+            if not future.cancelled():
+                logger.warning("Не удалось отправить эскалацию: %s", future.exception())
+            self._reschedule(entry, now + timedelta(minutes=POLL_MINUTES))
+
+
+reminder_scheduler = ReminderScheduler()
@@ -0,0 +1,238 @@
+"""
+Пробег, скорость и ETA рейса — инкрементально, по мере поступления точек.
+
+Раньше карточке рейса, сводке и карте для таких цифр пришлось бы
+перечитывать весь трек. Здесь на каждую сохранённую точку за O(1)
+обновляются накопительные метрики активного рейса водителя:
+
+* distance_m    — пробег по отрезкам (haversine); сдвиги короче
+                  TRIP_JITTER_M копятся от последней «опорной» точки, чтобы
+                  дрожание GPS на стоянке не наматывало километры;
+* moving_s      — время в движении: отрезки быстрее TRIP_MIN_MOVING_KMH;
+                  отрезок — от опорной точки до новой, и по расстоянию, и
+                  по времени (иначе медленная езда даёт отрезки 0 и 2×);
+* avg_speed_kmh — средняя скорость в движении (distance_m / moving_s);
+* speed_kmh     — экспоненциальное скользящее среднее скорости отрезков;
+* remaining_m   — до центра геозоны выгрузки: по прямой × TRIP_ROUTE_FACTOR;
+* eta_at        — время последней точки + remaining_m / средняя скорость
+                  (пока движения мало — TRIP_ETA_DEFAULT_KMH).
+
+Состояние рейса живёт в памяти; при первой точке после перезапуска оно
+поднимается из trip_metrics. Изменённые рейсы пишутся в БД одной пачкой
+раз в TRIP_METRICS_FLUSH_S секунд и при остановке бота.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import db_documents
+import db_trips
+from bot.fleet_snapshot import MOSCOW_TZ
+from bot.geofences import geofence_engine
+from geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+FLUSH_S = float(os.getenv("TRIP_METRICS_FLUSH_S", "30"))
+JITTER_M = float(os.getenv("TRIP_JITTER_M", "30"))
+MIN_MOVING_KMH = float(os.getenv("TRIP_MIN_MOVING_KMH", "5"))
+ROUTE_FACTOR = float(os.getenv("TRIP_ROUTE_FACTOR", "1.25"))
+ETA_DEFAULT_KMH = float(os.getenv("TRIP_ETA_DEFAULT_KMH", "60"))
+# меньше этого времени в движении средняя скорость ещё случайна
+ETA_MIN_MOVING_S = 600
+SPEED_EMA_ALPHA = 0.3
+
+
+def _new_metrics(trip_id: int, user_id: int) -> dict:
+    return {
+        "trip_id": trip_id,
+        "user_id": user_id,
+        "distance_m": 0.0,
+        "moving_s": 0.0,
+        "avg_speed_kmh": None,
+        "speed_kmh": None,
+        "last_lat": None,
+        "last_lon": None,
+        "last_ts": None,
+        "anchor_ts": None,
+        "remaining_m": None,
+        "eta_at": None,
+        "points": 0,
+        "updated_at": None,
+    }
+
+
+def advance(metrics: dict, lat: float, lon: float, ts: datetime, target=None) -> bool:
+    """
+    Учесть точку в метриках рейса (на месте).
+
+    Args:
+        metrics: Состояние рейса (строка trip_metrics)
+        lat, lon, ts: Новая точка (ts — aware datetime)
+        target: (lat, lon, radius_m) геозоны выгрузки или None
+
+    Returns:
+        bool: False, если точка не новее уже учтённой
+    """
+    last_ts = datetime.fromisoformat(metrics["last_ts"]) if metrics["last_ts"] else None
+    if last_ts is not None and ts <= last_ts:
+        return False
+
+    if last_ts is None:
+        metrics["last_lat"], metrics["last_lon"] = lat, lon
+        metrics["anchor_ts"] = ts.isoformat()
+    else:
+        # метрики до появления anchor_ts: опорной считаем последнюю точку
+        anchor_ts = datetime.fromisoformat(metrics["anchor_ts"] or metrics["last_ts"])
+        elapsed_s = (ts - anchor_ts).total_seconds()
+        step_m = haversine_m(metrics["last_lat"], metrics["last_lon"], lat, lon)
+        if step_m >= JITTER_M:
+            speed_kmh = step_m / elapsed_s * 3.6
+            metrics["distance_m"] += step_m
+            if speed_kmh >= MIN_MOVING_KMH:
+                metrics["moving_s"] += elapsed_s
+            metrics["last_lat"], metrics["last_lon"] = lat, lon
+            metrics["anchor_ts"] = ts.isoformat()
+        elif JITTER_M / elapsed_s * 3.6 < MIN_MOVING_KMH:
+            # даже сдвиг на JITTER_M за это время медленнее «движения» —
+            # стоим: опорная точка остаётся, её время догоняет текущее
+            speed_kmh = 0.0
+            metrics["anchor_ts"] = ts.isoformat()
+        else:
+            speed_kmh = None  # отрезок ещё копится от опорной точки
+        if speed_kmh is not None:
+            prev = metrics["speed_kmh"]
+            metrics["speed_kmh"] = (
+                speed_kmh if prev is None else SPEED_EMA_ALPHA * speed_kmh + (1 - SPEED_EMA_ALPHA) * prev
+            )
+        if metrics["moving_s"] > 0:
+            metrics["avg_speed_kmh"] = metrics["distance_m"] / metrics["moving_s"] * 3.6
+
+    metrics["last_ts"] = ts.isoformat()
+    metrics["points"] += 1
+
+    if target is None:
+        metrics["remaining_m"] = metrics["eta_at"] = None
+    else:
+        target_lat, target_lon, radius_m = target
+        distance_m = haversine_m(lat, lon, target_lat, target_lon)
+        remaining_m = 0.0 if distance_m <= radius_m else distance_m * ROUTE_FACTOR
+        speed_kmh = (
+            metrics["avg_speed_kmh"]
+            if metrics["moving_s"] >= ETA_MIN_MOVING_S and metrics["avg_speed_kmh"]
+            else ETA_DEFAULT_KMH
+        )
+        metrics["remaining_m"] = remaining_m
+        metrics["eta_at"] = (ts + timedelta(hours=remaining_m / 1000 / speed_kmh)).isoformat()
+    return True
+
+
+class TripMetricsTracker:
+    """Метрики активных рейсов в памяти с периодической записью в trips.db."""
+
+    def __init__(self, flush_s: float = FLUSH_S):
+        self.flush_s = flush_s
+        # trip_id → метрики
+        self._trips: Dict[int, dict] = {}
+        # user_id → trip_id, по которому водитель присылал точки
+        self._current: Dict[int, int] = {}
+        self._dirty: Dict[int, dict] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def on_point(self, user_id: int, lat: float, lon: float, ts: datetime) -> None:
+        """Сохранённая точка водителя: обновить метрики его активного рейса."""
+        try:
+            trip_id = await db_documents.get_active_trip(user_id)
+            if trip_id is None:
+                return
+            metrics = await self._metrics(user_id, trip_id)
+            fence = geofence_engine.fence(trip_id, "unloading")
+            target = (fence.lat, fence.lon, fence.radius_m) if fence else None
+            if advance(metrics, lat, lon, ts, target):
+                metrics["updated_at"] = datetime.now().isoformat()
+                self._dirty[trip_id] = dict(metrics)
+        except Exception:
+            logger.exception("trip-metrics: failed to update for %s", user_id)
+
+    async def _metrics(self, user_id: int, trip_id: int) -> dict:
+        previous = self._current.get(user_id)
+        if previous is not None and previous != trip_id:
+            # рейс сменился — прежний уже не пополнится
+            self._trips.pop(previous, None)
+        self._current[user_id] = trip_id
+
+        metrics = self._trips.get(trip_id)
+        if metrics is None:
+            metrics = await db_trips.get_trip_metrics(trip_id) or _new_metrics(trip_id, user_id)
+            metrics["user_id"] = user_id
+            metrics = self._trips.setdefault(trip_id, metrics)
+        return metrics
+
+    async def get(self, trip_id: int) -> Optional[dict]:
+        """Метрики рейса: из памяти, если рейс отслеживается, иначе из БД."""
+        metrics = self._trips.get(trip_id)
+        if metrics is not None:
+            return dict(metrics)
+        return await db_trips.get_trip_metrics(trip_id)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            rows, self._dirty = list(self._dirty.values()), {}
+            if not rows:
+                return
+            try:
+                await db_trips.save_trip_metrics(rows)
+            except Exception:
+                # вернём в очередь, если за это время рейс не обновился снова
+                for row in rows:
+                    self._dirty.setdefault(row["trip_id"], row)
+                raise
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="trip-metrics")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_s)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("trip-metrics: flush failed")
+
+    def stats(self) -> Dict[str, int]:
+        return {"trips": len(self._trips), "dirty": len(self._dirty)}
+
+
+def format_metrics(metrics: Optional[dict]) -> str:
+    """Строки для карточки рейса (пусто, если метрик нет)."""
+    if not metrics or not metrics["points"]:
+        return ""
+    lines = [f"🛣 Пробег: {metrics['distance_m'] / 1000:.1f} км"]
+    if metrics["avg_speed_kmh"]:
+        lines.append(f"⏱ Средняя скорость: {metrics['avg_speed_kmh']:.0f} км/ч")
+    if metrics["eta_at"]:
+        eta = datetime.fromisoformat(metrics["eta_at"]).astimezone(MOSCOW_TZ)
+        remaining_km = metrics["remaining_m"] / 1000
+        if remaining_km:
+            lines.append(f"🏁 До выгрузки ≈{remaining_km:.0f} км, ETA {eta:%d.%m %H:%M} (МСК)")
+        else:
+            lines.append("🏁 На выгрузке")
+    return "\n".join(lines) + "\n"
+
+
+trip_metrics = TripMetricsTracker()
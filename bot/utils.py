@@ -7,6 +7,12 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def get_curator_ids() -> list[int]:
+    """Список Telegram ID кураторов из CURATOR_IDS (через запятую)."""
+    curator_ids_str = os.getenv("CURATOR_IDS", "")
+    return [int(x.strip()) for x in curator_ids_str.split(",") if x.strip()]
+
+
 def is_curator(user_id: int) -> bool:
     """
     Проверяет, является ли пользователь куратором рейсов.
@@ -18,7 +24,7 @@ def is_curator(user_id: int) -> bool:
         bool: True если пользователь куратор, False если водитель
     """
     curator_ids_str = os.getenv("CURATOR_IDS", "")
-    curator_ids = [int(x.strip()) for x in curator_ids_str.split(",") if x.strip()]
+    curator_ids = get_curator_ids()
     result = user_id in curator_ids
 
     logger.info(
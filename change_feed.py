@@ -0,0 +1,368 @@
+"""
+Лента изменений между процессами бота и веба через SQLite.
+
+У контейнеров bot и web общий только том ./data, поэтому лента живёт
+прямо в файлах БД: триггеры на points, drivers, trips, trip_events,
+trip_metrics и documents дописывают строку в таблицу changes той же БД
+(см. db_migrations.create_changes_table) в транзакции самой записи.
+Изменение попадает в ленту тогда и только тогда, когда закоммичено, кто
+бы его ни записал — бот, веб или скрипт очистки.
+
+Читатель (ChangeFeed) держит отдельное соединение и раз в
+CHANGE_FEED_INTERVAL_S секунд спрашивает PRAGMA data_version — счётчик
+коммитов других соединений, который SQLite отдаёт без чтения страниц
+БД. Только если он изменился, читаются строки с seq больше последнего
+прочитанного, и они раздаются подписчикам. Один читатель на файл БД на
+весь процесс, сколько бы ни было подписчиков, — запросов на каждый
+HTTP-запрос нет.
+
+Подписчик получает асинхронный итератор:
+
+    async for change in trips_feed.changes(kinds={"trip"}):
+        ...
+
+с after=<seq> итератор сначала отдаёт сохранённые изменения после seq
+(за последние CHANGE_FEED_RETENTION_H часов), затем — новые.
+
+Старые строки удаляют и читатели в вебе, и change_pruner в боте: таблица
+не растёт, даже пока веб не запущен.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import aclosing
+from pathlib import Path
+from typing import AsyncIterator, Callable, Collection, Dict, NamedTuple, Optional, Set
+
+import aiosqlite
+
+import db
+import db_documents
+import db_trips
+from db_pool import BUSY_TIMEOUT_MS, connection
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_S = float(os.getenv("CHANGE_FEED_INTERVAL_S", "0.2"))
+RETENTION_H = float(os.getenv("CHANGE_FEED_RETENTION_H", "24"))
+QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE", "10000"))
+PRUNE_EVERY_S = 600
+BATCH = 1000
+
+_COLUMNS = "seq, kind, entity_id, user_id, data, created_at"
+
+
+class Change(NamedTuple):
+    """Одна строка таблицы changes."""
+
+    source: str                 # points | trips | documents
+    seq: int
+    kind: str                   # point, driver, trip, trip_event, trip_metrics, document
+    entity_id: Optional[int]
+    user_id: Optional[int]
+    data: Optional[dict]
+    created_at: int             # epoch milliseconds, UTC
+
+
+class ChangeFeedOverflow(Exception):
+    """Подписчик отстал больше чем на CHANGE_FEED_QUEUE изменений."""
+
+    def __init__(self, seq: int):
+        super().__init__(f"change feed subscriber fell behind after seq {seq}")
+        # последнее отданное подписчику: продолжить с changes(after=seq)
+        self.seq = seq
+
+
+class _Subscription:
+    __slots__ = ("queue", "kinds")
+
+    def __init__(self, kinds: Optional[Collection[str]]):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.kinds = frozenset(kinds) if kinds else None
+
+
+# метки в очереди подписчика вместо изменения
+_OVERFLOW = object()
+_CLOSED = object()
+
+
+class ChangeFeed:
+    """Читатель таблицы changes одного файла БД с раздачей подписчикам."""
+
+    def __init__(self, source: str, path: Callable[[], Path], interval_s: float = INTERVAL_S):
+        self.source = source
+        # путь берётся при старте: тесты и бенчмарки подменяют DB_PATH
+        self._path = path
+        self.interval_s = interval_s
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._subscribers: Set[_Subscription] = set()
+        self._version: Optional[int] = None
+        self._pruned_at = 0.0
+        self.last_seq = 0
+        self.delivered = 0
+        self.reads = 0
+        self.overflows = 0
+
+    @property
+    def path(self) -> Path:
+        return Path(self._path())
+
+    async def start(self) -> None:
+        """Открыть соединение читателя и начать с текущего конца ленты."""
+        if self._task is not None:
+            return
+        self._conn = await aiosqlite.connect(self.path)
+        await self._conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        async with self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes") as cur:
+            self.last_seq = (await cur.fetchone())[0]
+        self._version = None
+        self._task = asyncio.create_task(self._run(), name=f"change-feed-{self.source}")
+        logger.info("Change feed %s started at seq %s", self.source, self.last_seq)
+
+    async def stop(self) -> None:
+        """Остановить читателя; итераторы подписчиков завершаются."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        for sub in self._subscribers:
+            sub.queue.put_nowait(_CLOSED)
+        self._subscribers.clear()
+
+    async def _poll(self) -> int:
+        """Прочитать новые строки, если с прошлого раза были коммиты; их число."""
+        async with self._conn.execute("PRAGMA data_version") as cur:
+            version = (await cur.fetchone())[0]
+        if version == self._version:
+            return 0
+        self._version = version
+        async with self._conn.execute(
+            f"SELECT {_COLUMNS} FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (self.last_seq, BATCH),
+        ) as cur:
+            rows = await cur.fetchall()
+        self.reads += 1
+        for row in rows:
+            self._dispatch(self._change(row))
+        if len(rows) == BATCH:
+            # дочитать остаток без ожидания нового коммита
+            self._version = None
+        return len(rows)
+
+    def _change(self, row) -> Change:
+        seq, kind, entity_id, user_id, data, created_at = row
+        return Change(self.source, seq, kind, entity_id, user_id, json.loads(data) if data else None, created_at)
+
+    def _dispatch(self, change: Change) -> None:
+        self.last_seq = change.seq
+        for sub in list(self._subscribers):
+            if sub.kinds is not None and change.kind not in sub.kinds:
+                continue
+            if sub.queue.qsize() >= QUEUE_SIZE:
+                # не копим бесконечно: подписчик дочитает из таблицы сам
+                self._subscribers.discard(sub)
+                sub.queue.put_nowait(_OVERFLOW)
+                self.overflows += 1
+                continue
+            sub.queue.put_nowait(change)
+            self.delivered += 1
+
+    async def _run(self) -> None:
+        while True:
+            read = 0
+            try:
+                read = await self._poll()
+                if time.monotonic() - self._pruned_at >= PRUNE_EVERY_S:
+                    self._pruned_at = time.monotonic()
+                    await self.prune()
+            except Exception:
+                logger.exception("Change feed %s: read failed", self.source)
+            if read < BATCH:
+                await asyncio.sleep(self.interval_s)
+
+    async def _history(
+        self, after: int, upto: int, kinds: Optional[frozenset]
+    ) -> AsyncIterator[Change]:
+        """Сохранённые изменения after < seq <= upto, страницами по BATCH."""
+        while after < upto:
+            async with connection(self.path) as conn:
+                async with conn.execute(
+                    f"SELECT {_COLUMNS} FROM changes WHERE seq > ? AND seq <= ? ORDER BY seq LIMIT ?",
+                    (after, upto, BATCH),
+                ) as cur:
+                    rows = await cur.fetchall()
+            if not rows:
+                return
+            for row in rows:
+                change = self._change(row)
+                if kinds is None or change.kind in kinds:
+                    yield change
+            after = rows[-1][0]
+
+    async def changes(
+        self, after: Optional[int] = None, kinds: Optional[Collection[str]] = None
+    ) -> AsyncIterator[Change]:
+        """
+        Асинхронный итератор изменений по возрастанию seq.
+
+        Args:
+            after: Отдать сначала сохранённые изменения с seq > after;
+                None — только новые, начиная с момента подписки
+            kinds: Только изменения этих видов (None — все)
+
+        Raises:
+            ChangeFeedOverflow: Подписчик не успевал читать; продолжить
+                можно с changes(after=exc.seq)
+        """
+        if self._task is None:
+            await self.start()
+        sub = _Subscription(kinds)
+        # подписка раньше чтения истории: новое не теряется между ними
+        self._subscribers.add(sub)
+        last = self.last_seq
+        try:
+            if after is not None and after < last:
+                async for change in self._history(after, last, sub.kinds):
+                    yield change
+            while True:
+                change = await sub.queue.get()
+                if change is _CLOSED:
+                    return
+                if change is _OVERFLOW:
+                    raise ChangeFeedOverflow(last)
+                if change.seq <= last:
+                    continue
+                last = change.seq
+                yield change
+        finally:
+            self._subscribers.discard(sub)
+
+    async def prune(self, retention_h: float = RETENTION_H) -> int:
+        """Удалить изменения старше retention_h часов; число удалённых строк."""
+        cutoff_ms = int((time.time() - retention_h * 3600) * 1000)
+        async with connection(self.path) as conn:
+            # seq и created_at растут вместе: граница — первая свежая строка
+            # (просмотр от старого конца, индекс по created_at не нужен)
+            cur = await conn.execute(
+                """
+                DELETE FROM changes
+                 WHERE seq < COALESCE(
+                       (SELECT seq FROM changes WHERE created_at >= ? ORDER BY seq LIMIT 1),
+                       (SELECT MAX(seq) + 1 FROM changes))
+                """,
+                (cutoff_ms,),
+            )
+            await conn.commit()
+            deleted = cur.rowcount
+        if deleted:
+            logger.info("Change feed %s: pruned %s old changes", self.source, deleted)
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "last_seq": self.last_seq,
+            "subscribers": len(self._subscribers),
+            "reads": self.reads,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+async def follow(
+    feed: ChangeFeed,
+    handler: Callable[[Change], None],
+    kinds: Optional[Collection[str]] = None,
+) -> None:
+    """
+    Вызывать handler на каждое изменение, пока лента не остановлена.
+
+    При переполнении очереди подписка возобновляется с последнего
+    обработанного seq — пропущенное дочитывается из таблицы.
+    """
+    after: Optional[int] = None
+    while True:
+        try:
+            async with aclosing(feed.changes(after, kinds)) as changes:
+                async for change in changes:
+                    after = change.seq
+                    try:
+                        handler(change)
+                    except Exception:
+                        logger.exception("Change feed %s: handler failed on seq %s", feed.source, change.seq)
+            return
+        except ChangeFeedOverflow as exc:
+            logger.warning("Change feed %s: subscriber fell behind, replaying", feed.source)
+            after = exc.seq
+
+
+points_feed = ChangeFeed("points", lambda: db.DB_PATH)
+trips_feed = ChangeFeed("trips", lambda: db_trips.DB_PATH)
+documents_feed = ChangeFeed("documents", lambda: db_documents.DB_PATH)
+FEEDS = (points_feed, trips_feed, documents_feed)
+
+
+async def prune_all(retention_h: float = RETENTION_H) -> int:
+    """Очистить changes во всех БД; число удалённых строк."""
+    deleted = 0
+    for feed in FEEDS:
+        try:
+            deleted += await feed.prune(retention_h)
+        except Exception:
+            logger.exception("Change feed %s: prune failed", feed.source)
+    return deleted
+
+
+class ChangePruner:
+    """
+    Очистка changes на стороне бота.
+
+    Строка в changes появляется на каждую точку, а читатели ленты (и их
+    prune) живут только в вебе: пока веб лежит или перезапускается,
+    таблица росла бы без ограничений. Бот пишет точки — бот и чистит,
+    раз в PRUNE_EVERY_S, не читая саму ленту.
+    """
+
+    def __init__(self, interval_s: float = PRUNE_EVERY_S):
+        self.interval_s = interval_s
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="change-pruner")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await prune_all()
+            await asyncio.sleep(self.interval_s)
+
+
+change_pruner = ChangePruner()
+
+
+async def start_all() -> None:
+    for feed in FEEDS:
+        await feed.start()
+
+
+async def stop_all() -> None:
+    for feed in FEEDS:
+        await feed.stop()
@@ -21,12 +21,13 @@ async def cleanup_old_data():
     """
     
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=DAYS_THRESHOLD)
+    # points.ts хранится в миллисекундах эпохи — сравниваем целые числа
+    cutoff_ms = db.to_epoch_ms(cutoff_date)
     print(f"🧹 Очистка данных старше {cutoff_date.strftime('%Y-%m-%d %H:%M')} UTC")
     print("=" * 60)
     
     async with aiosqlite.connect(db.DB_PATH) as conn:
-        await db._ensure_schema(conn)
-        await db._ensure_driver_schema(conn)
+        await db.migrate(conn)
         
         # 1. Статистика ДО очистки
         async with conn.execute("SELECT COUNT(*) FROM points") as cur:
@@ -42,12 +43,11 @@ async def cleanup_old_data():
         
         # 2. Найти водителей со старыми точками
         query_old = """
-            SELECT DISTINCT user_id, MAX(ts) as last_ts
-            FROM points
-            GROUP BY user_id
-            HAVING MAX(ts) < ?
+            SELECT user_id, ts as last_ts
+            FROM driver_last_position
+            WHERE ts < ?
         """
-        async with conn.execute(query_old, (cutoff_date.isoformat(),)) as cur:
+        async with conn.execute(query_old, (cutoff_ms,)) as cur:
             old_drivers = await cur.fetchall()
         
         if old_drivers:
@@ -60,7 +60,7 @@ async def cleanup_old_data():
                     phone_row = await cur.fetchone()
                     phone = phone_row[0] if phone_row else "неизвестен"
                 
-                print(f"   • ID {user_id} (📞 {phone}), последняя точка: {last_ts}")
+                print(f"   • ID {user_id} (📞 {phone}), последняя точка: {db.from_epoch_ms(last_ts):%Y-%m-%d %H:%M} UTC")
         else:
             print("✅ Старых данных не найдено!")
             return
@@ -75,14 +75,16 @@ async def cleanup_old_data():
         # 3. Удаление старых точек
         await conn.execute(
             "DELETE FROM points WHERE ts < ?",
-            (cutoff_date.isoformat(),)
+            (cutoff_ms,)
         )
         deleted_points = conn.total_changes
+        # аудит отбракованных GPS-точек старше той же даты
+        await conn.execute("DELETE FROM rejected_points WHERE ts < ?", (cutoff_ms,))
         
         # 4. Удаление водителей без точек
         await conn.execute("""
             DELETE FROM drivers
-            WHERE user_id NOT IN (SELECT DISTINCT user_id FROM points)
+            WHERE user_id NOT IN (SELECT user_id FROM driver_last_position)
         """)
         deleted_drivers = conn.total_changes
         
@@ -110,18 +112,16 @@ async def list_all_drivers():
     print("=" * 60)
     
     async with aiosqlite.connect(db.DB_PATH) as conn:
-        await db._ensure_schema(conn)
-        await db._ensure_driver_schema(conn)
+        await db.migrate(conn)
         
         query = """
             SELECT 
                 d.user_id,
                 d.phone,
                 d.active,
-                MAX(p.ts) as last_point_ts
+                p.ts as last_point_ts
             FROM drivers d
-            LEFT JOIN points p ON d.user_id = p.user_id
-            GROUP BY d.user_id
+            LEFT JOIN driver_last_position p ON d.user_id = p.user_id
             ORDER BY last_point_ts DESC NULLS LAST
         """
         
@@ -135,7 +135,7 @@ async def list_all_drivers():
         for user_id, phone, active, last_ts in rows:
             status = "🟢 активен" if active else "🔴 неактивен"
             phone_str = phone or "нет номера"
-            last_str = last_ts or "нет точек"
+            last_str = f"{db.from_epoch_ms(last_ts):%Y-%m-%d %H:%M} UTC" if last_ts else "нет точек"
             
             print(f"ID {user_id:10} | 📞 {phone_str:15} | {status:12} | последняя точка: {last_str}")
 
@@ -62,13 +62,14 @@ async def cleanup_old_data() -> None:
     #. Prints statistics about points and drivers after the cleanup.
     """
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=DAYS_THRESHOLD)
+    # points.ts хранится в миллисекундах эпохи — сравниваем целые числа
+    cutoff_ms = db.to_epoch_ms(cutoff_date)
     print(f" Очистка данных старше {cutoff_date.strftime('%Y-%m-%d %H:%M')} UTC")
     print("=" * 60)
 
     async with aiosqlite.connect(db.DB_PATH) as conn:
         # Ensure both points and drivers tables exist
-        await db._ensure_schema(conn)
-        await db._ensure_driver_schema(conn)
+        await db.migrate(conn)
 
         # 1. Statistics before cleanup
         async with conn.execute("SELECT COUNT(*) FROM points") as cur:
@@ -84,12 +85,11 @@ async def cleanup_old_data() -> None:
         # This query returns driver IDs and their most recent timestamp if it
         # falls before the cutoff.  Exempt drivers are filtered out later.
         query_old = """
-            SELECT DISTINCT user_id, MAX(ts) as last_ts
-            FROM points
-            GROUP BY user_id
-            HAVING MAX(ts) < ?
+            SELECT user_id, ts as last_ts
+            FROM driver_last_position
+            WHERE ts < ?
         """
-        async with conn.execute(query_old, (cutoff_date.isoformat(),)) as cur:
+        async with conn.execute(query_old, (cutoff_ms,)) as cur:
             rows = await cur.fetchall()
 
         # Filter out exempt drivers from the old drivers list
@@ -107,7 +107,7 @@ async def cleanup_old_data() -> None:
                 ) as cur:
                     phone_row = await cur.fetchone()
                     phone = phone_row[0] if phone_row else "неизвестен"
-                print(f"   • ID {user_id} ({phone}), последняя точка: {last_ts}")
+                print(f"   • ID {user_id} ({phone}), последняя точка: {db.from_epoch_ms(last_ts):%Y-%m-%d %H:%M} UTC")
         else:
             print("✅ Старых данных не найдено!")
             return
@@ -126,24 +126,26 @@ async def cleanup_old_data() -> None:
             sql_del_points = (
                 f"DELETE FROM points WHERE ts < ? AND user_id NOT IN ({placeholders})"
             )
-            params: list = [cutoff_date.isoformat(), *EXEMPT_USER_IDS]
+            params: list = [cutoff_ms, *EXEMPT_USER_IDS]
         else:
             sql_del_points = "DELETE FROM points WHERE ts < ?"
-            params = [cutoff_date.isoformat()]
+            params = [cutoff_ms]
         await conn.execute(sql_del_points, params)
         deleted_points = conn.total_changes
+        # аудит отбракованных GPS-точек старше той же даты
+        await conn.execute("DELETE FROM rejected_points WHERE ts < ?", (cutoff_ms,))
 
         # 4. Delete drivers without remaining points (excluding exempt drivers)
         if EXEMPT_USER_IDS:
             placeholders = ", ".join(["?"] * len(EXEMPT_USER_IDS))
             sql_del_drivers = (
                 "DELETE FROM drivers "
-                "WHERE user_id NOT IN (SELECT DISTINCT user_id FROM points) "
+                "WHERE user_id NOT IN (SELECT user_id FROM driver_last_position) "
                 f"AND user_id NOT IN ({placeholders})"
             )
             params_drivers = [*EXEMPT_USER_IDS]
         else:
-            sql_del_drivers = "DELETE FROM drivers WHERE user_id NOT IN (SELECT DISTINCT user_id FROM points)"
+            sql_del_drivers = "DELETE FROM drivers WHERE user_id NOT IN (SELECT user_id FROM driver_last_position)"
             params_drivers = []
         await conn.execute(sql_del_drivers, params_drivers)
         deleted_drivers = conn.total_changes
@@ -169,17 +171,15 @@ async def list_all_drivers() -> None:
     print(" Список всех водителей:")
     print("=" * 60)
     async with aiosqlite.connect(db.DB_PATH) as conn:
-        await db._ensure_schema(conn)
-        await db._ensure_driver_schema(conn)
+        await db.migrate(conn)
         query = """
             SELECT
                 d.user_id,
                 d.phone,
                 d.active,
-                MAX(p.ts) as last_point_ts
+                p.ts as last_point_ts
             FROM drivers d
-            LEFT JOIN points p ON d.user_id = p.user_id
-            GROUP BY d.user_id
+            LEFT JOIN driver_last_position p ON d.user_id = p.user_id
             ORDER BY last_point_ts DESC NULLS LAST
         """
         async with conn.execute(query) as cur:
@@ -190,7 +190,7 @@ async def list_all_drivers() -> None:
         for user_id, phone, active, last_ts in rows:
             status = " активен" if active else " неактивен"
             phone_str = phone or "нет номера"
-            last_str = last_ts or "нет точек"
+            last_str = f"{db.from_epoch_ms(last_ts):%Y-%m-%d %H:%M} UTC" if last_ts else "нет точек"
             print(
                 f"ID {user_id:10} |  {phone_str:15} | {status:12} | последняя точка: {last_str}"
             )
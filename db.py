@@ -1,25 +1,42 @@
+import asyncio
+import json
 import logging
-from datetime import datetime, timezone
+import math
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Iterable, Optional
 
 import aiosqlite
 
+import db_migrations
+import driver_cache
+import geo
+from db_pool import connection, open_pool
+
 logger = logging.getLogger(__name__)
 
 DB_PATH = Path("/app/data/points.db")
 
 
 async def init() -> None:
-    """Initialize database and create missing tables."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-        await _ensure_driver_schema(db)
+    """Open the connection pool and apply pending schema migrations."""
+    await open_pool(DB_PATH)
+    async with connection(DB_PATH) as db:
+        await backfill_points_epoch_ms(db)
+        await migrate(db)
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Apply pending points.db migrations on the given connection."""
+    return await db_migrations.migrate(db, MIGRATIONS, "points.db")
 
 
-async def _ensure_schema(db: aiosqlite.Connection) -> None:
-    """Create table and index if they do not exist."""
+# ---------------------------------------------------------------------------
+# schema migrations (PRAGMA user_version)
+# ---------------------------------------------------------------------------
+
+async def _m001_base_schema(db: aiosqlite.Connection) -> None:
+    """Create points and drivers tables in their original shape."""
     await db.execute(
         """
         CREATE TABLE IF NOT EXISTS points (
@@ -37,80 +54,602 @@ async def _ensure_schema(db: aiosqlite.Connection) -> None:
             ON points(user_id, ts DESC)
         """
     )
-    await db.commit()
-
-
-async def _ensure_driver_schema(db: aiosqlite.Connection) -> None:
-    """Create drivers table and `active` column if they do not exist."""
-    # base table
     await db.execute(
         """
         CREATE TABLE IF NOT EXISTS drivers (
             user_id INTEGER PRIMARY KEY,
-            phone   TEXT,
-            active  INTEGER NOT NULL DEFAULT 1   -- 1 = tracking on
+            phone   TEXT
         )
         """
     )
-    # add column to old installations (SQLite allows IF NOT EXISTS only from 3.35)
-    try:
+
+
+async def _m002_drivers_active(db: aiosqlite.Connection) -> None:
+    """Add `active` column to drivers (1 = tracking on)."""
+    # older installations already have it from the former ad-hoc ALTER
+    if not await db_migrations.column_exists(db, "drivers", "active"):
         await db.execute("ALTER TABLE drivers ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
-    except aiosqlite.OperationalError:
-        # column already exists
-        pass
-    await db.commit()
+
+
+# ISO TEXT ts → epoch ms; naive strings are UTC, as the accessors assumed
+_TS_TO_MS_SQL = """
+    CASE WHEN typeof(ts) = 'integer' THEN ts
+         ELSE CAST(ROUND((julianday(ts) - 2440587.5) * 86400000) AS INTEGER)
+    END
+"""
+_TS_PARSABLE_SQL = "(typeof(ts) = 'integer' OR julianday(ts) IS NOT NULL)"
+POINTS_BACKFILL_BATCH = 50_000
+
+
+async def _prepare_points_epoch_ms(db: aiosqlite.Connection) -> int:
+    """Create points_new/points_ts_quarantine and return the last copied id.
+
+    While the copy is in progress a trigger mirrors deletes from points
+    (cleanup scripts, an older bot still running) into the copy. Inserts
+    need no trigger: rows above the last copied id are picked up later.
+    """
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS points_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            ts INTEGER NOT NULL          -- epoch milliseconds, UTC
+        )
+        """
+    )
+    # rows whose ts does not parse are kept here instead of being dropped
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS points_ts_quarantine (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            ts TEXT
+        )
+        """
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_points_epoch_ms_backfill_delete AFTER DELETE ON points
+        BEGIN
+            DELETE FROM points_new WHERE id = OLD.id;
+            DELETE FROM points_ts_quarantine WHERE id = OLD.id;
+        END
+        """
+    )
+    async with db.execute(
+        """
+        SELECT MAX(COALESCE((SELECT MAX(id) FROM points_new), 0),
+                   COALESCE((SELECT MAX(id) FROM points_ts_quarantine), 0))
+        """
+    ) as cur:
+        return (await cur.fetchone())[0]
+
+
+async def _copy_points_epoch_ms(db: aiosqlite.Connection, after_id: int, upto_id: int) -> None:
+    """Convert points with after_id < id <= upto_id into points_new (or quarantine).
+
+    OR IGNORE: the bot and the web may backfill the same range concurrently.
+    """
+    await db.execute(
+        f"""
+        INSERT OR IGNORE INTO points_new(id, user_id, lat, lon, ts)
+        SELECT id, user_id, lat, lon, {_TS_TO_MS_SQL}
+          FROM points
+         WHERE id > ? AND id <= ? AND {_TS_PARSABLE_SQL}
+        """,
+        (after_id, upto_id),
+    )
+    await db.execute(
+        f"""
+        INSERT OR IGNORE INTO points_ts_quarantine(id, user_id, lat, lon, ts)
+        SELECT id, user_id, lat, lon, ts
+          FROM points
+         WHERE id > ? AND id <= ? AND NOT {_TS_PARSABLE_SQL}
+        """,
+        (after_id, upto_id),
+    )
+
+
+async def backfill_points_epoch_ms(db: aiosqlite.Connection, batch: int = POINTS_BACKFILL_BATCH) -> int:
+    """Online part of migration 3: copy points to points_new in short batches.
+
+    Runs before migrate() while points.ts is still TEXT. Each batch is its
+    own IMMEDIATE transaction over an id range, so the other process keeps
+    writing between batches; migration 3 then only copies the rows added
+    since the last batch and swaps the tables under the migration lock.
+    Safe to interrupt and to run from the bot and the web at once.
+
+    Returns:
+        int: Number of rows copied (0 when there is nothing to backfill)
+    """
+    if await db_migrations.get_version(db) >= 3:
+        return 0
+    async with db.execute(
+        "SELECT type FROM pragma_table_info('points') WHERE name = 'ts'"
+    ) as cur:
+        row = await cur.fetchone()
+    if row is None or row[0].upper() != "TEXT":
+        return 0  # new database: migration 1 creates an empty points
+
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        done = await _prepare_points_epoch_ms(db)
+        async with db.execute("SELECT COALESCE(MAX(id), 0) FROM points") as cur:
+            target = (await cur.fetchone())[0]
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+    copied = 0
+    logger.info("points.ts backfill: ids %s..%s", done, target)
+    while done < target:
+        upto = min(done + batch, target)
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if await db_migrations.get_version(db) >= 3:
+                await db.rollback()
+                break  # another process finished the migration meanwhile
+            await _copy_points_epoch_ms(db, done, upto)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        copied += upto - done
+        done = upto
+        # let the other process's writes in between batches
+        await asyncio.sleep(0)
+    logger.info("points.ts backfill: done up to id %s", done)
+    return copied
+
+
+async def _m003_points_epoch_ms(db: aiosqlite.Connection) -> None:
+    """Convert points.ts from ISO TEXT to INTEGER epoch milliseconds (UTC).
+
+    SQLite cannot change a column type in place, so the table is rebuilt.
+    The bulk of the copy is done beforehand by backfill_points_epoch_ms();
+    here, under the migration lock, only rows added since the last batch
+    are converted before the swap. Without a backfill (e.g. migrate()
+    called directly) the whole table is copied here. Rows with an
+    unparsable ts are moved to points_ts_quarantine.
+    """
+    done = await _prepare_points_epoch_ms(db)
+    async with db.execute("SELECT COALESCE(MAX(id), 0) FROM points") as cur:
+        target = (await cur.fetchone())[0]
+    await _copy_points_epoch_ms(db, done, target)
+    async with db.execute("SELECT COUNT(*) FROM points_ts_quarantine") as cur:
+        quarantined = (await cur.fetchone())[0]
+    if quarantined:
+        logger.warning("points.ts: %s rows with unparsable ts moved to points_ts_quarantine", quarantined)
+    # drops trg_points_epoch_ms_backfill_delete together with the table
+    await db.execute("DROP TABLE points")
+    await db.execute("ALTER TABLE points_new RENAME TO points")
+    await db.execute("CREATE INDEX idx_points_user_ts ON points(user_id, ts)")
+
+
+async def _m004_driver_last_position(db: aiosqlite.Connection) -> None:
+    """Materialize each driver's newest point in driver_last_position.
+
+    Triggers on points keep it current inside the inserting/deleting
+    transaction, so "latest" queries read one row per driver instead of
+    aggregating the whole points table.
+    """
+    await db.execute(
+        """
+        CREATE TABLE driver_last_position (
+            user_id  INTEGER PRIMARY KEY,
+            point_id INTEGER NOT NULL,
+            lat      REAL NOT NULL,
+            lon      REAL NOT NULL,
+            ts       INTEGER NOT NULL     -- epoch milliseconds, UTC
+        )
+        """
+    )
+    # newer ts wins; equal ts → the later insert wins
+    await db.execute(
+        """
+        CREATE TRIGGER trg_points_last_position_insert AFTER INSERT ON points
+        BEGIN
+            INSERT INTO driver_last_position(user_id, point_id, lat, lon, ts)
+            VALUES (NEW.user_id, NEW.id, NEW.lat, NEW.lon, NEW.ts)
+            ON CONFLICT(user_id) DO UPDATE SET
+                point_id = excluded.point_id,
+                lat      = excluded.lat,
+                lon      = excluded.lon,
+                ts       = excluded.ts
+            WHERE excluded.ts >= driver_last_position.ts;
+        END
+        """
+    )
+    # only deleting the current latest point costs a lookup in points
+    await db.execute(
+        """
+        CREATE TRIGGER trg_points_last_position_delete AFTER DELETE ON points
+        WHEN OLD.id = (SELECT point_id FROM driver_last_position WHERE user_id = OLD.user_id)
+        BEGIN
+            DELETE FROM driver_last_position WHERE user_id = OLD.user_id;
+            INSERT INTO driver_last_position(user_id, point_id, lat, lon, ts)
+            SELECT user_id, id, lat, lon, ts
+              FROM points
+             WHERE user_id = OLD.user_id
+             ORDER BY ts DESC, id DESC
+             LIMIT 1;
+        END
+        """
+    )
+    await db.execute(
+        """
+        INSERT INTO driver_last_position(user_id, point_id, lat, lon, ts)
+        SELECT p.user_id, p.id, p.lat, p.lon, p.ts
+          FROM (SELECT DISTINCT user_id FROM points) AS u
+          JOIN points AS p
+            ON p.id = (SELECT id FROM points
+                        WHERE user_id = u.user_id
+                        ORDER BY ts DESC, id DESC
+                        LIMIT 1)
+        """
+    )
+
+
+async def _m005_bot_state(db: aiosqlite.Connection) -> None:
+    """Small key/value table for bot state that must survive restarts."""
+    await db.execute(
+        """
+        CREATE TABLE bot_state (
+            key   TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """
+    )
+
+
+async def _m006_rejected_points(db: aiosqlite.Connection) -> None:
+    """Audit table for points turned down (or flagged) by gps_filter."""
+    await db.execute(
+        """
+        CREATE TABLE rejected_points (
+            id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            lat     REAL NOT NULL,
+            lon     REAL NOT NULL,
+            ts      INTEGER NOT NULL,    -- epoch milliseconds, UTC
+            reason  TEXT NOT NULL,       -- invalid | duplicate | stale | jump
+            stored  INTEGER NOT NULL DEFAULT 0  -- 1 = kept in points (flag mode)
+        )
+        """
+    )
+    await db.execute("CREATE INDEX idx_rejected_points_user_ts ON rejected_points(user_id, ts)")
+
+
+async def _m007_driver_position_rtree(db: aiosqlite.Connection) -> None:
+    """R*Tree over driver_last_position for radius / bounding-box lookups.
+
+    One entry per driver (id = user_id), kept in sync by triggers on
+    driver_last_position, which itself follows the points triggers. The
+    triggers avoid INSERT OR REPLACE: they run inside the UPSERT of the
+    points trigger, whose conflict handling would override the REPLACE.
+    """
+    await db.execute(
+        """
+        CREATE VIRTUAL TABLE driver_position_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        """
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER trg_last_position_rtree_insert AFTER INSERT ON driver_last_position
+        BEGIN
+            DELETE FROM driver_position_rtree WHERE id = NEW.user_id;
+            INSERT INTO driver_position_rtree(id, min_lat, max_lat, min_lon, max_lon)
+            VALUES (NEW.user_id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+        END
+        """
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER trg_last_position_rtree_update AFTER UPDATE OF lat, lon ON driver_last_position
+        BEGIN
+            UPDATE driver_position_rtree
+               SET min_lat = NEW.lat, max_lat = NEW.lat, min_lon = NEW.lon, max_lon = NEW.lon
+             WHERE id = NEW.user_id;
+        END
+        """
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER trg_last_position_rtree_delete AFTER DELETE ON driver_last_position
+        BEGIN
+            DELETE FROM driver_position_rtree WHERE id = OLD.user_id;
+        END
+        """
+    )
+    await db.execute(
+        """
+        INSERT INTO driver_position_rtree(id, min_lat, max_lat, min_lon, max_lon)
+        SELECT user_id, lat, lat, lon, lon FROM driver_last_position
+        """
+    )
+
+
+async def _m008_changes(db: aiosqlite.Connection) -> None:
+    """Change feed (see change_feed.py): new points and driver profile changes.
+
+    Rows are written by triggers, so every writer (bot, web, cleanup
+    scripts) feeds the log without code changes.
+    """
+    await db_migrations.create_changes_table(db)
+    await db.execute(
+        f"""
+        CREATE TRIGGER trg_points_changes AFTER INSERT ON points
+        BEGIN
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('point', NEW.id, NEW.user_id,
+                    json_object('lat', NEW.lat, 'lon', NEW.lon, 'ts', NEW.ts),
+                    {db_migrations.NOW_MS_SQL});
+        END
+        """
+    )
+    driver_change = f"""
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('driver', NEW.user_id, NEW.user_id,
+                    json_object('active', NEW.active),
+                    {db_migrations.NOW_MS_SQL});
+    """
+    await db.execute(
+        f"""
+        CREATE TRIGGER trg_drivers_insert_changes AFTER INSERT ON drivers
+        BEGIN {driver_change} END
+        """
+    )
+    # the phone itself stays out of the log: consumers re-read the profile
+    await db.execute(
+        f"""
+        CREATE TRIGGER trg_drivers_update_changes AFTER UPDATE OF phone, active ON drivers
+        WHEN OLD.phone IS NOT NEW.phone OR OLD.active IS NOT NEW.active
+        BEGIN {driver_change} END
+        """
+    )
+
+
+async def _m009_driver_delete_changes(db: aiosqlite.Connection) -> None:
+    """Log driver deletions (cleanup scripts) in the change feed as well.
+
+    With this every change to the fleet list — new point, profile change,
+    removed driver — bumps changes.seq, which /api/drivers uses as ETag.
+    """
+    await db.execute(
+        f"""
+        CREATE TRIGGER trg_drivers_delete_changes AFTER DELETE ON drivers
+        BEGIN
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('driver', OLD.user_id, OLD.user_id,
+                    json_object('deleted', 1),
+                    {db_migrations.NOW_MS_SQL});
+        END
+        """
+    )
+
+
+MIGRATIONS: list[db_migrations.Migration] = [
+    (1, "points and drivers tables", _m001_base_schema),
+    (2, "drivers.active column", _m002_drivers_active),
+    (3, "points.ts as INTEGER epoch ms", _m003_points_epoch_ms),
+    (4, "driver_last_position table", _m004_driver_last_position),
+    (5, "bot_state table", _m005_bot_state),
+    (6, "rejected_points table", _m006_rejected_points),
+    (7, "driver_position_rtree spatial index", _m007_driver_position_rtree),
+    (8, "changes table for the change feed", _m008_changes),
+    (9, "driver deletions in the change feed", _m009_driver_delete_changes),
+]
+
+
+# ---------------------------------------------------------------------------
+# timestamp conversion (points.ts is epoch milliseconds, UTC)
+# ---------------------------------------------------------------------------
+
+def to_epoch_ms(ts: datetime) -> int:
+    """Convert a datetime to epoch milliseconds; naive values are taken as UTC."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(round(ts.timestamp() * 1000))
+
+
+def from_epoch_ms(ms: int) -> datetime:
+    """Convert epoch milliseconds to an aware UTC datetime."""
+    return datetime.fromtimestamp(ms / 1000, timezone.utc)
 
 
 async def save_point(user_id: int, lat: float, lon: float, ts: datetime) -> None:
     """Persist a location in SQLite."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-        await db.execute(
+    await save_points([(user_id, lat, lon, ts)])
+    logger.info("Saved point for %s", user_id)
+
+
+async def save_points(points: list[tuple[int, float, float, datetime]]) -> None:
+    """Persist a batch of (user_id, lat, lon, ts) locations in one transaction."""
+    async with connection(DB_PATH) as db:
+        await db.executemany(
             "INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)",
-            (user_id, lat, lon, ts.isoformat()),
+            [(uid, lat, lon, to_epoch_ms(ts)) for uid, lat, lon, ts in points],
         )
         await db.commit()
-    logger.info("Saved point for %s", user_id)
+
+
+async def ingest_points(
+    points: list[tuple[int, float, float, datetime]],
+    rejected: Iterable[tuple[int, float, float, datetime, str, bool]] = (),
+) -> list[tuple[bool, str | None, bool]]:
+    """Store the points of active drivers and return (stored, phone, tracked) per point.
+
+    The drivers lookup and the inserts run in one transaction on one pooled
+    connection, so the location handler needs no separate is_active() and
+    get_phone() round trips. Points of drivers who stopped tracking are
+    skipped; unknown drivers count as active, as in is_active(). ``tracked``
+    is true only for drivers with an active row in drivers: the reminder
+    scheduler follows them and nobody else. The fresh profiles are put into
+    driver_cache for the other handlers.
+
+    ``rejected`` holds (user_id, lat, lon, ts, reason, stored) audit rows
+    from gps_filter; they go to rejected_points in the same transaction.
+    """
+    rejected = list(rejected)
+    user_ids = sorted({uid for uid, *_ in points})
+    async with connection(DB_PATH) as db:
+        # IMMEDIATE: set_active() from another process cannot slip between
+        # the active check and the insert
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute(
+            """
+            SELECT user_id, phone, active FROM drivers
+             WHERE user_id IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(user_ids),),
+        ) as cur:
+            profiles = {uid: (phone, bool(active)) for uid, phone, active in await cur.fetchall()}
+        tracked = {uid for uid, (_, active) in profiles.items() if active}
+        for uid in user_ids:
+            profiles.setdefault(uid, (None, True))
+        await db.executemany(
+            "INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)",
+            [
+                (uid, lat, lon, to_epoch_ms(ts))
+                for uid, lat, lon, ts in points
+                if profiles[uid][1]
+            ],
+        )
+        if rejected:
+            await db.executemany(
+                """
+                INSERT INTO rejected_points(user_id, lat, lon, ts, reason, stored)
+                VALUES(?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (uid, lat, lon, to_epoch_ms(ts), reason, int(stored))
+                    for uid, lat, lon, ts, reason, stored in rejected
+                ],
+            )
+        await db.commit()
+    for uid, profile in profiles.items():
+        driver_cache.profiles.set(uid, profile)
+    return [(profiles[uid][1], profiles[uid][0], uid in tracked) for uid, *_ in points]
 
 
 async def get_last_point(user_id: int):
     """Retrieve the most recent point for a user."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
+    async with connection(DB_PATH) as db:
         async with db.execute(
             """
-            SELECT id, user_id, lat, lon, ts
-              FROM points
+            SELECT point_id, user_id, lat, lon, ts
+              FROM driver_last_position
              WHERE user_id = ?
-             ORDER BY ts DESC
-             LIMIT 1
             """,
             (user_id,),
         ) as cursor:
             row = await cursor.fetchone()
         if row is None:
             return None
-        id_, uid, lat, lon, ts_str = row
-        # Убеждаемся, что datetime всегда aware (с timezone)
-        dt = datetime.fromisoformat(ts_str)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
+        id_, uid, lat, lon, ts_ms = row
         return {
             "id": id_,
             "user_id": uid,
             "lat": lat,
             "lon": lon,
-            "ts": dt,
+            "ts": from_epoch_ms(ts_ms),
         }
 
 
+async def get_points(
+    user_id: int, since: datetime, until: Optional[datetime] = None
+) -> list[dict]:
+    """Return a driver's points with since <= ts < until, oldest first."""
+    until_ms = to_epoch_ms(until) if until is not None else 2**63 - 1
+    async with connection(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT id, lat, lon, ts
+              FROM points
+             WHERE user_id = ? AND ts >= ? AND ts < ?
+             ORDER BY ts
+            """,
+            (user_id, to_epoch_ms(since), until_ms),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {"id": id_, "user_id": user_id, "lat": lat, "lon": lon, "ts": from_epoch_ms(ts_ms)}
+        for id_, lat, lon, ts_ms in rows
+    ]
+
+
+async def get_track(
+    user_id: int, since: datetime, until: Optional[datetime] = None
+) -> list[tuple[float, float, int]]:
+    """Return a driver's (lat, lon, ts_ms) rows with since <= ts < until, oldest first.
+
+    Unlike get_points() the rows are not turned into dicts and datetimes:
+    analytics load them straight into arrays.
+    """
+    until_ms = to_epoch_ms(until) if until is not None else 2**63 - 1
+    async with connection(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT lat, lon, ts
+              FROM points
+             WHERE user_id = ? AND ts >= ? AND ts < ?
+             ORDER BY ts
+            """,
+            (user_id, to_epoch_ms(since), until_ms),
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def iter_track(
+    user_id: int,
+    since: datetime,
+    until: Optional[datetime] = None,
+    after: Optional[tuple[int, int]] = None,
+    page_size: int = 5000,
+    first_page: int = 500,
+) -> AsyncIterator[list[tuple[int, float, float, int]]]:
+    """Yield a driver's (id, lat, lon, ts_ms) rows page by page, oldest first.
+
+    Pages are keyset queries on (ts, id) over the (user_id, ts) index, so
+    no connection is held between pages and a reader can resume from the
+    last row it saw by passing it as ``after=(ts_ms, id)``. The first page
+    is small to get the first rows out quickly.
+    """
+    since_ms = to_epoch_ms(since)
+    until_ms = to_epoch_ms(until) if until is not None else 2**63 - 1
+    key = max(after, (since_ms, -1)) if after is not None else (since_ms, -1)
+    limit = first_page
+    while True:
+        async with connection(DB_PATH) as db:
+            async with db.execute(
+                """
+                SELECT id, lat, lon, ts
+                  FROM points
+                 WHERE user_id = ? AND ts >= ? AND (ts, id) > (?, ?) AND ts < ?
+                 ORDER BY ts, id
+                 LIMIT ?
+                """,
+                (user_id, key[0], key[0], key[1], until_ms, limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        if rows:
+            yield rows
+        if len(rows) < limit:
+            return
+        key = (rows[-1][3], rows[-1][0])
+        limit = page_size
+
+
 async def save_phone(user_id: int, phone: str) -> None:
     """Persist a phone number in SQLite."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_driver_schema(db)
+    async with connection(DB_PATH) as db:
         await db.execute(
             """
             INSERT INTO drivers(user_id, phone, active) VALUES(?, ?, 1)
@@ -119,20 +658,51 @@ async def save_phone(user_id: int, phone: str) -> None:
             (user_id, phone),
         )
         await db.commit()
+    driver_cache.invalidate(user_id)
     logger.info("Saved phone for %s", user_id)
 
 
-async def get_phone(user_id: int) -> str | None:
-    """Fetch a driver's phone by Telegram user id."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_driver_schema(db)
+async def _get_profile(user_id: int) -> tuple[str | None, bool]:
+    """Return (phone, active) for a driver, served from driver_cache when fresh."""
+    profile = driver_cache.profiles.get(user_id)
+    if driver_cache.is_missing(profile):
+        async with connection(DB_PATH) as db:
+            async with db.execute(
+                "SELECT phone, active FROM drivers WHERE user_id = ?",
+                (user_id,),
+            ) as cursor:
+                row = await cursor.fetchone()
+        # unknown drivers default to active, as is_active() always did
+        profile = (row[0], bool(row[1])) if row else (None, True)
+        driver_cache.profiles.set(user_id, profile)
+    return profile
+
+
+async def get_driver(user_id: int) -> tuple[str | None, bool] | None:
+    """Return (phone, active) straight from drivers, or None if there is no row.
+
+    Unlike _get_profile() this bypasses driver_cache and does not treat
+    unknown users as active: the reminder scheduler uses it to notice drivers
+    deactivated or deleted by another process before it messages anyone.
+    """
+    async with connection(DB_PATH) as db:
         async with db.execute(
-            "SELECT phone FROM drivers WHERE user_id = ?",
+            "SELECT phone, active FROM drivers WHERE user_id = ?",
             (user_id,),
         ) as cursor:
             row = await cursor.fetchone()
-        return row[0] if row else None
+    if row is None:
+        driver_cache.profiles.invalidate(user_id)
+        return None
+    profile = (row[0], bool(row[1]))
+    driver_cache.profiles.set(user_id, profile)
+    return profile
+
+
+async def get_phone(user_id: int) -> str | None:
+    """Fetch a driver's phone by Telegram user id."""
+    phone, _ = await _get_profile(user_id)
+    return phone
 
 
 async def get_user_id_by_phone(phone: str) -> Optional[int]:
@@ -145,9 +715,7 @@ async def get_user_id_by_phone(phone: str) -> Optional[int]:
     Returns:
         int | None: Telegram user_id или None если не найден
     """
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_driver_schema(db)
+    async with connection(DB_PATH) as db:
         async with db.execute("""
             SELECT user_id FROM drivers WHERE phone = ?
         """, (phone,)) as cursor:
@@ -157,27 +725,255 @@ async def get_user_id_by_phone(phone: str) -> Optional[int]:
 
 
 
-async def get_last_points() -> list[tuple[int, datetime]]:
-    """Return list of (user_id, ts) where ts is the latest point timestamp per driver."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
+async def get_last_points(active_only: bool = False) -> list[tuple[int, datetime]]:
+    """Return list of (user_id, ts) where ts is the latest point timestamp per driver.
+
+    With active_only=True, drivers who stopped tracking (drivers.active = 0)
+    are left out; drivers without a drivers row are skipped as well.
+    """
+    if active_only:
         query = """
-            SELECT user_id, MAX(ts)
-              FROM points
-          GROUP BY user_id
+            SELECT lp.user_id, lp.ts
+              FROM driver_last_position AS lp
+              JOIN drivers AS d ON d.user_id = lp.user_id
+             WHERE d.active = 1
         """
+    else:
+        query = "SELECT user_id, ts FROM driver_last_position"
+    async with connection(DB_PATH) as db:
         async with db.execute(query) as cur:
             rows = await cur.fetchall()
-        # rows: list[(uid, ts_str)]
-        result = []
-        for uid, ts_str in rows:
-            if ts_str is not None:
-                dt = datetime.fromisoformat(ts_str)
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=timezone.utc)
-                result.append((uid, dt))
-        return result
+    return [(uid, from_epoch_ms(ts_ms)) for uid, ts_ms in rows]
+
+
+async def get_overdue_drivers(
+    remind_after: timedelta,
+    escalate_after: timedelta,
+    exclude_user_ids: Iterable[int] = (),
+    now: Optional[datetime] = None,
+) -> list[dict]:
+    """Return every active driver with last ts, phone and overdue flags in one query.
+
+    `remind` / `escalate` are true when the driver has been silent for longer
+    than remind_after / escalate_after; the comparison runs in SQL against
+    driver_last_position. exclude_user_ids (curators) are filtered out in SQL.
+    """
+    now_ms = to_epoch_ms(now or datetime.now(timezone.utc))
+    async with connection(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT lp.user_id,
+                   lp.ts,
+                   d.phone,
+                   (:now - lp.ts) > :remind   AS remind,
+                   (:now - lp.ts) > :escalate AS escalate
+              FROM driver_last_position AS lp
+              JOIN drivers AS d ON d.user_id = lp.user_id
+             WHERE d.active = 1
+               AND lp.user_id NOT IN (SELECT value FROM json_each(:exclude))
+            """,
+            {
+                "now": now_ms,
+                "remind": int(remind_after.total_seconds() * 1000),
+                "escalate": int(escalate_after.total_seconds() * 1000),
+                "exclude": json.dumps(list(exclude_user_ids)),
+            },
+        ) as cur:
+            rows = await cur.fetchall()
+    return [
+        {
+            "user_id": uid,
+            "last_ts": from_epoch_ms(ts_ms),
+            "phone": phone,
+            "remind": bool(remind),
+            "escalate": bool(escalate),
+        }
+        for uid, ts_ms, phone, remind, escalate in rows
+    ]
+
+
+async def get_fleet_positions() -> list[dict]:
+    """Return the latest position and phone of every active driver, newest first."""
+    async with connection(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT lp.user_id, d.phone, lp.lat, lp.lon, lp.ts
+              FROM driver_last_position AS lp
+              JOIN drivers AS d ON d.user_id = lp.user_id
+             WHERE d.active = 1
+             ORDER BY lp.ts DESC
+            """
+        ) as cur:
+            rows = await cur.fetchall()
+    return [
+        {"user_id": uid, "phone": phone, "lat": lat, "lon": lon, "ts": from_epoch_ms(ts_ms)}
+        for uid, phone, lat, lon, ts_ms in rows
+    ]
+
+
+async def get_change_seq() -> int:
+    """Return the newest seq ever issued by the points.db change feed (0 when none).
+
+    Every new point and every driver insert/update/delete bumps it, so it
+    versions anything derived from drivers + driver_last_position. Read from
+    sqlite_sequence rather than MAX(seq): pruning may empty the journal, and
+    the version must never go back.
+    """
+    async with connection(DB_PATH) as db:
+        async with db.execute(
+            "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changes'), 0)"
+        ) as cur:
+            return (await cur.fetchone())[0]
+
+
+async def list_drivers(
+    *,
+    active_only: bool = False,
+    stale_before: Optional[datetime] = None,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> list[dict]:
+    """Return drivers with their latest position in one query, by user_id.
+
+    Args:
+        active_only: skip drivers with tracking off (and without a drivers row)
+        stale_before: only drivers whose last point is older than this
+        bbox: (min_lat, min_lon, max_lat, max_lon); min_lon > max_lon crosses
+            the antimeridian. Served by driver_position_rtree.
+        after: keyset cursor — only user_id > after
+        limit: page size
+
+    Rows carry "active" (None without a drivers row) and "ts" as datetime.
+    """
+    where = ["lp.user_id > :after"]
+    params: dict = {"after": after if after is not None else -(2 ** 63), "limit": limit or -1}
+    rtree_join = ""
+    if active_only:
+        where.append("d.active = 1")
+    if stale_before is not None:
+        where.append("lp.ts < :stale")
+        params["stale"] = to_epoch_ms(stale_before)
+    if bbox is not None:
+        params.update(zip(("min_lat", "min_lon", "max_lat", "max_lon"), bbox))
+        rtree_join = "JOIN driver_position_rtree AS r ON r.id = lp.user_id"
+        # the R*Tree narrows the search, the exact coordinates decide
+        # (its float32 boxes may be a hair larger than the real point)
+        where.append("r.min_lat <= :max_lat AND r.max_lat >= :min_lat")
+        where.append("lp.lat BETWEEN :min_lat AND :max_lat")
+        if bbox[1] <= bbox[3]:
+            where.append("r.min_lon <= :max_lon AND r.max_lon >= :min_lon")
+            where.append("lp.lon BETWEEN :min_lon AND :max_lon")
+        else:
+            where.append("(r.max_lon >= :min_lon OR r.min_lon <= :max_lon)")
+            where.append("(lp.lon >= :min_lon OR lp.lon <= :max_lon)")
+    query = f"""
+        SELECT lp.user_id, d.phone, d.active, lp.lat, lp.lon, lp.ts
+          FROM driver_last_position AS lp
+          {rtree_join}
+          LEFT JOIN drivers AS d ON d.user_id = lp.user_id
+         WHERE {" AND ".join(where)}
+         ORDER BY lp.user_id
+         LIMIT :limit
+    """
+    async with connection(DB_PATH) as db:
+        async with db.execute(query, params) as cur:
+            rows = await cur.fetchall()
+    return [
+        {
+            "user_id": uid,
+            "phone": phone,
+            "active": None if active is None else bool(active),
+            "lat": lat,
+            "lon": lon,
+            "ts": from_epoch_ms(ts_ms),
+        }
+        for uid, phone, active, lat, lon, ts_ms in rows
+    ]
+
+
+async def get_last_positions(user_ids: Iterable[int]) -> list[dict]:
+    """Return the latest position of each of the given drivers (one query)."""
+    async with connection(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT user_id, lat, lon, ts
+              FROM driver_last_position
+             WHERE user_id IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(sorted(set(user_ids))),),
+        ) as cur:
+            rows = await cur.fetchall()
+    return [
+        {"user_id": uid, "lat": lat, "lon": lon, "ts": from_epoch_ms(ts_ms)}
+        for uid, lat, lon, ts_ms in rows
+    ]
+
+
+async def drivers_in_bbox(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    active_only: bool = True,
+) -> list[dict]:
+    """Return drivers whose latest position lies in the bounding box.
+
+    Served by the driver_position_rtree index. A box with min_lon > max_lon
+    is taken to cross the antimeridian.
+    """
+    if min_lon <= max_lon:
+        lon_filter = "r.min_lon <= :max_lon AND r.max_lon >= :min_lon"
+    else:
+        lon_filter = "(r.max_lon >= :min_lon OR r.min_lon <= :max_lon)"
+    query = f"""
+        SELECT lp.user_id, d.phone, lp.lat, lp.lon, lp.ts
+          FROM driver_position_rtree AS r
+          JOIN driver_last_position AS lp ON lp.user_id = r.id
+          {"JOIN" if active_only else "LEFT JOIN"} drivers AS d ON d.user_id = lp.user_id
+         WHERE r.min_lat <= :max_lat AND r.max_lat >= :min_lat
+           AND {lon_filter}
+           {"AND d.active = 1" if active_only else ""}
+    """
+    params = {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}
+    async with connection(DB_PATH) as db:
+        async with db.execute(query, params) as cur:
+            rows = await cur.fetchall()
+    # the R*Tree stores float32 boxes, so re-check the exact coordinates
+    return [
+        {"user_id": uid, "phone": phone, "lat": lat, "lon": lon, "ts": from_epoch_ms(ts_ms)}
+        for uid, phone, lat, lon, ts_ms in rows
+        if min_lat <= lat <= max_lat
+        and (min_lon <= lon <= max_lon if min_lon <= max_lon else lon >= min_lon or lon <= max_lon)
+    ]
+
+
+async def drivers_within(
+    lat: float, lon: float, radius_km: float, active_only: bool = True
+) -> list[dict]:
+    """Return drivers whose latest position is within radius_km, nearest first.
+
+    The R*Tree narrows the search to the bounding box of the circle; the
+    exact great-circle distance is added as "distance_km".
+    """
+    dlat = math.degrees(radius_km / geo.EARTH_RADIUS_KM)
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if cos_lat <= 1e-9 or dlat / cos_lat >= 180:
+        min_lon, max_lon = -180.0, 180.0  # the circle covers a pole
+    else:
+        dlon = dlat / cos_lat
+        min_lon = (lon - dlon + 180) % 360 - 180
+        max_lon = (lon + dlon + 180) % 360 - 180
+    result = []
+    for row in await drivers_in_bbox(min_lat, min_lon, max_lat, max_lon, active_only):
+        distance_km = geo.haversine_m(lat, lon, row["lat"], row["lon"]) / 1000
+        if distance_km <= radius_km:
+            row["distance_km"] = distance_km
+            result.append(row)
+    result.sort(key=lambda row: row["distance_km"])
+    return result
+
 
 # ---------------------------------------------------------------------------
 # tracking control helpers
@@ -189,9 +985,7 @@ async def set_active(user_id: int, flag: bool) -> None:
     When flag=True (водитель снова активен) – удаляем его старые точки,
     чтобы счётчик 12‑часовых напоминаний начинался «с чистого листа».
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_driver_schema(db)
-
+    async with connection(DB_PATH) as db:
         # 1) Обновляем флаг в таблице drivers
         await db.execute(
             """
@@ -203,28 +997,48 @@ async def set_active(user_id: int, flag: bool) -> None:
 
         # FIX: Не удаляем историю - она важна для аналитики
         await db.commit()
+    driver_cache.profiles.invalidate(user_id)
 
     logger.info("Set active=%s for %s (history preserved)", flag, user_id)
 
 
 async def is_active(user_id: int) -> bool:
     """Return True if driver is active (default=True)."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_driver_schema(db)
-        async with db.execute(
-            "SELECT active FROM drivers WHERE user_id = ?", (user_id,)
-        ) as cur:
+    _, active = await _get_profile(user_id)
+    return active
+
+
+async def get_state(key: str) -> Optional[str]:
+    """Read a value from bot_state."""
+    async with connection(DB_PATH) as db:
+        async with db.execute("SELECT value FROM bot_state WHERE key = ?", (key,)) as cur:
             row = await cur.fetchone()
-    return bool(row[0]) if row else True
+    return row[0] if row else None
+
+
+async def set_state(key: str, value: Optional[str]) -> None:
+    """Store a value in bot_state (None deletes the key)."""
+    async with connection(DB_PATH) as db:
+        if value is None:
+            await db.execute("DELETE FROM bot_state WHERE key = ?", (key,))
+        else:
+            await db.execute(
+                """
+                INSERT INTO bot_state(key, value) VALUES(?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """,
+                (key, value),
+            )
+        await db.commit()
 
 
 async def clear_all() -> None:
     """Remove all stored drivers and location points."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-        await _ensure_driver_schema(db)
+    async with connection(DB_PATH) as db:
         await db.execute("DELETE FROM points")
+        await db.execute("DELETE FROM driver_last_position")
+        await db.execute("DELETE FROM rejected_points")
         await db.execute("DELETE FROM drivers")
         await db.commit()
+    driver_cache.clear()
     logger.info("Database cleared")
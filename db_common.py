@@ -5,9 +5,10 @@
 чтобы избежать циркулярных импортов.
 """
 
-import aiosqlite
 from pathlib import Path
 
+from db_pool import connection
+
 
 async def get_user_id_by_phone_from_db(phone: str, db_path: Path) -> int | None:
     """
@@ -20,8 +21,7 @@ async def get_user_id_by_phone_from_db(phone: str, db_path: Path) -> int | None:
     Returns:
         int | None: Telegram user_id или None если не найден
     """
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(db_path) as conn:
+    async with connection(db_path) as conn:
         async with conn.execute("""
             SELECT user_id FROM drivers WHERE phone = ?
         """, (phone,)) as cursor:
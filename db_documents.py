@@ -10,6 +10,10 @@ from datetime import datetime
 from typing import Optional, List, Dict, Any
 import logging
 
+import db_migrations
+import driver_cache
+from db_pool import connection, open_pool
+
 logger = logging.getLogger(__name__)
 DB_PATH = Path("/app/data/documents.db")
 
@@ -26,40 +30,68 @@ DOC_TYPES = {
 
 
 async def init_documents_db() -> None:
-    """Инициализация БД документов. Создает таблицы и индексы."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Создать таблицу documents
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                trip_id INTEGER,
-                doc_type TEXT NOT NULL,
-                file_id TEXT NOT NULL,
-                file_path TEXT,
-                telegram_msg_id INTEGER,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (trip_id) REFERENCES trips(trip_id)
-            )
-        """)
-
-        # Создать индексы
-        await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_documents_user ON documents(user_id)
-        """)
-        await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_documents_trip ON documents(trip_id)
-        """)
-        await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_documents_type ON documents(doc_type)
-        """)
-
-        await db.commit()
+    """Инициализация БД документов: пул соединений и миграции схемы."""
+    await open_pool(DB_PATH)
+    async with connection(DB_PATH) as db:
+        await migrate(db)
 
     logger.info("Documents database initialized")
 
 
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Применить недостающие миграции documents.db."""
+    return await db_migrations.migrate(db, MIGRATIONS, "documents.db")
+
+
+async def _m001_base_schema(db: aiosqlite.Connection) -> None:
+    """Таблица documents и индексы."""
+    # Создать таблицу documents
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            trip_id INTEGER,
+            doc_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_path TEXT,
+            telegram_msg_id INTEGER,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (trip_id) REFERENCES trips(trip_id)
+        )
+    """)
+
+    # Создать индексы
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_user ON documents(user_id)
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_trip ON documents(trip_id)
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_type ON documents(doc_type)
+    """)
+
+
+async def _m002_changes(db: aiosqlite.Connection) -> None:
+    """Журнал изменений для change_feed: новые документы."""
+    await db_migrations.create_changes_table(db)
+    await db.execute(f"""
+        CREATE TRIGGER trg_documents_changes AFTER INSERT ON documents
+        BEGIN
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('document', NEW.id, NEW.user_id,
+                    json_object('trip_id', NEW.trip_id, 'doc_type', NEW.doc_type),
+                    {db_migrations.NOW_MS_SQL});
+        END
+    """)
+
+
+MIGRATIONS: list[db_migrations.Migration] = [
+    (1, "documents table", _m001_base_schema),
+    (2, "changes table for the change feed", _m002_changes),
+]
+
+
 async def save_document(
     user_id: int,
     doc_type: str,
@@ -82,9 +114,7 @@ async def save_document(
     Returns:
         int: ID созданного документа
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-
+    async with connection(DB_PATH) as db:
         # Если trip_id не указан, пытаемся получить активный рейс
         if trip_id is None:
             trip_id = await get_active_trip(user_id)
@@ -130,8 +160,7 @@ async def get_document(doc_id: int) -> Optional[Dict[str, Any]]:
     Returns:
         Dict | None: Словарь с информацией о документе или None если не найден
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
+    async with connection(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
 
         async with db.execute("""
@@ -160,8 +189,7 @@ async def get_user_documents(
     Returns:
         List[Dict]: Список документов
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
+    async with connection(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
 
         query = "SELECT * FROM documents WHERE user_id = ?"
@@ -182,6 +210,23 @@ async def get_user_documents(
             return [dict(row) for row in rows]
 
 
+async def get_trip_documents_version(trip_id: int) -> str:
+    """
+    Отпечаток набора документов рейса для ETag: число, максимальный и суммарный id.
+
+    Документы не меняются, а только добавляются, удаляются и
+    перепривязываются к другому рейсу — каждое такое действие меняет отпечаток.
+    """
+    async with connection(DB_PATH) as db:
+        async with db.execute("""
+            SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(id), 0)
+            FROM documents
+            WHERE trip_id = ?
+        """, (trip_id,)) as cursor:
+            count, max_id, sum_id = await cursor.fetchone()
+    return f"{count}.{max_id}.{sum_id}"
+
+
 async def get_trip_documents(trip_id: int) -> List[Dict[str, Any]]:
     """
     Получить все документы по рейсу.
@@ -192,8 +237,7 @@ async def get_trip_documents(trip_id: int) -> List[Dict[str, Any]]:
     Returns:
         List[Dict]: Список документов рейса
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
+    async with connection(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
 
         async with db.execute("""
@@ -218,17 +262,23 @@ async def get_active_trip(user_id: int) -> Optional[int]:
     Returns:
         int | None: ID активного рейса или None
     """
+    cached = driver_cache.active_trips.get(user_id)
+    if not driver_cache.is_missing(cached):
+        return cached
+
     try:
         import db_trips
 
         trips = await db_trips.get_user_active_trips(user_id)
-        if trips:
-            # Возвращаем первый активный рейс
-            return trips[0]['trip_id']
     except Exception as e:
+        # ошибку не кэшируем — следующий вызов попробует снова
         logger.warning(f"Failed to get active trip for user {user_id}: {e}")
+        return None
 
-    return None
+    # Возвращаем первый активный рейс
+    trip_id = trips[0]['trip_id'] if trips else None
+    driver_cache.active_trips.set(user_id, trip_id)
+    return trip_id
 
 
 async def update_document_trip(doc_id: int, trip_id: int) -> None:
@@ -239,9 +289,7 @@ async def update_document_trip(doc_id: int, trip_id: int) -> None:
         doc_id: ID документа
         trip_id: ID рейса
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-
+    async with connection(DB_PATH) as db:
         await db.execute("""
             UPDATE documents SET trip_id = ? WHERE id = ?
         """, (trip_id, doc_id))
@@ -260,9 +308,7 @@ async def delete_document(doc_id: int) -> bool:
     Returns:
         bool: True если документ был удален, False если не найден
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-
+    async with connection(DB_PATH) as db:
         cursor = await db.execute("""
             DELETE FROM documents WHERE id = ?
         """, (doc_id,))
@@ -271,21 +317,6 @@ async def delete_document(doc_id: int) -> bool:
         return cursor.rowcount > 0
 
 
-async def _ensure_schema(db: aiosqlite.Connection) -> None:
-    """Вспомогательная функция для обеспечения наличия схемы БД."""
-    # Проверить, что таблица существует
-    cursor = await db.execute("""
-        SELECT name FROM sqlite_master
-        WHERE type='table' AND name='documents'
-    """)
-    tables = await cursor.fetchall()
-
-    if len(tables) == 0:
-        # Пере-инициализируем БД если таблицы нет
-        logger.warning("Documents database table not found, re-initializing...")
-        await init_documents_db()
-
-
 async def check_loading_documents(trip_id: int) -> Dict[str, Any]:
     """
     Проверить наличие всех документов погрузки.
@@ -305,9 +336,7 @@ async def check_loading_documents(trip_id: int) -> Dict[str, Any]:
             - acceptance_act_count: int
             - ready_for_transit: bool (все документы есть)
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-
+    async with connection(DB_PATH) as db:
         # Считаем фото погрузки
         async with db.execute("""
             SELECT COUNT(*) FROM documents
@@ -356,9 +385,7 @@ async def check_unloading_documents(trip_id: int) -> Dict[str, Any]:
             - invoice_count: int
             - ready_for_delivery: bool (все документы есть)
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
-
+    async with connection(DB_PATH) as db:
         # Считаем фото выгрузки
         async with db.execute("""
             SELECT COUNT(*) FROM documents
@@ -0,0 +1,92 @@
+"""
+Версионированные миграции схемы SQLite.
+
+Версия схемы хранится в `PRAGMA user_version` каждого файла БД. Миграции
+описываются в модулях db*.py упорядоченным списком (версия, описание,
+функция) и применяются один раз при init(), а не перед каждым запросом.
+"""
+
+import logging
+from typing import Awaitable, Callable, Sequence, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+Migration = Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+# текущее время в epoch-миллисекундах внутри SQL (для триггеров)
+NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+async def get_version(db: aiosqlite.Connection) -> int:
+    """Текущая версия схемы (0 для новой или старой БД без миграций)."""
+    async with db.execute("PRAGMA user_version") as cur:
+        row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+async def column_exists(db: aiosqlite.Connection, table: str, column: str) -> bool:
+    """Проверить наличие колонки (для миграций поверх старых установок)."""
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        rows = await cur.fetchall()
+    return any(row[1] == column for row in rows)
+
+
+async def create_changes_table(db: aiosqlite.Connection) -> None:
+    """
+    Журнал изменений changes для ленты change_feed.
+
+    Строки добавляют триггеры на таблицах той же БД в транзакции самой
+    записи; seq (AUTOINCREMENT) только растёт и не переиспользуется даже
+    после удаления старых строк, поэтому читатель ленты продолжает с
+    последнего прочитанного seq.
+    """
+    await db.execute("""
+        CREATE TABLE changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            entity_id INTEGER,
+            user_id INTEGER,
+            data TEXT,                       -- JSON
+            created_at INTEGER NOT NULL      -- epoch milliseconds, UTC
+        )
+    """)
+
+
+async def migrate(db: aiosqlite.Connection, migrations: Sequence[Migration], name: str) -> int:
+    """
+    Применить недостающие миграции в одной транзакции.
+
+    BEGIN IMMEDIATE берёт блокировку записи до чтения user_version, поэтому
+    бот и веб, стартующие одновременно, не применят одну миграцию дважды.
+
+    Args:
+        db: Соединение с БД
+        migrations: Список (версия, описание, функция) по возрастанию версий
+        name: Имя БД для логов
+
+    Returns:
+        int: Версия схемы после миграций
+    """
+    versions = [version for version, _, _ in migrations]
+    if versions != sorted(set(versions)):
+        raise ValueError(f"Migrations for {name} must have unique increasing versions")
+
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        current = await get_version(db)
+        for version, description, apply in migrations:
+            if version <= current:
+                continue
+            logger.info("Migrating %s to v%s: %s", name, version, description)
+            await apply(db)
+            # PRAGMA не поддерживает параметры, версия — наш собственный int
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            current = version
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+    return current
@@ -0,0 +1,122 @@
+"""
+Пул долгоживущих соединений SQLite.
+
+Каждый файл БД (points.db, trips.db, documents.db) получает небольшой набор
+соединений, которые открываются один раз при старте бота/веба и
+настраиваются PRAGMA-ми (WAL, synchronous=NORMAL, busy_timeout, cache_size).
+Модули db*.py берут соединение через `async with connection(DB_PATH)`
+вместо `aiosqlite.connect()` на каждый вызов.
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Настройки пула (можно переопределить через .env)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+
+
+class ConnectionPool:
+    """Набор заранее открытых соединений к одному файлу БД."""
+
+    def __init__(self, path: Path, size: int = POOL_SIZE):
+        self.path = Path(path)
+        self.size = max(size, 1)
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._connections: list[aiosqlite.Connection] = []
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открыть и один раз настроить соединение."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = await aiosqlite.connect(self.path)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        # отрицательное значение = размер в KiB, а не в страницах
+        await conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        return conn
+
+    async def open(self) -> None:
+        """Открыть недостающие соединения (идемпотентно)."""
+        async with self._lock:
+            while len(self._connections) < self.size:
+                conn = await self._connect()
+                self._connections.append(conn)
+                self._idle.put_nowait(conn)
+        logger.debug("Pool for %s: %s connections", self.path, self.size)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдать свободное соединение и вернуть его в пул после использования."""
+        if not self._connections:
+            await self.open()
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            try:
+                # незакоммиченная транзакция не должна «протечь» к следующему вызову
+                if conn.in_transaction:
+                    await conn.rollback()
+                conn.row_factory = None
+            finally:
+                self._idle.put_nowait(conn)
+
+    async def close(self) -> None:
+        """Закрыть все соединения пула."""
+        async with self._lock:
+            for conn in self._connections:
+                try:
+                    await conn.close()
+                except Exception as e:
+                    logger.warning("Failed to close connection to %s: %s", self.path, e)
+            self._connections.clear()
+            self._idle = asyncio.Queue()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+
+
+def get_pool(path: Path) -> ConnectionPool:
+    """Получить (или создать) пул для файла БД."""
+    key = str(Path(path).resolve())
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = ConnectionPool(Path(path))
+    return pool
+
+
+async def open_pool(path: Path) -> ConnectionPool:
+    """Открыть соединения пула заранее (вызывается из init() модулей БД)."""
+    pool = get_pool(path)
+    await pool.open()
+    return pool
+
+
+def connection(path: Path):
+    """
+    Взять соединение из пула.
+
+    Использование:
+        async with connection(DB_PATH) as conn:
+            ...
+    """
+    return get_pool(path).acquire()
+
+
+async def close_all() -> None:
+    """Закрыть все пулы (при остановке бота/веба)."""
+    for pool in list(_pools.values()):
+        await pool.close()
+    _pools.clear()
+    logger.info("Database pools closed")
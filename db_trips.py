@@ -7,6 +7,7 @@
 - Статусы: assigned, active, loading, in_transit, unloading, completed
 """
 
+import json
 import logging
 from datetime import datetime
 from pathlib import Path
@@ -14,20 +15,32 @@ from typing import Optional, List, Dict, Any
 
 import aiosqlite
 
+import db_migrations
+import driver_cache
+from db_pool import connection, open_pool
+
 logger = logging.getLogger(__name__)
 
 DB_PATH = Path("/app/data/trips.db")
 
 
 async def init() -> None:
-    """Инициализация БД рейсов."""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await _ensure_schema(db)
+    """Инициализация БД рейсов: пул соединений и миграции схемы."""
+    await open_pool(DB_PATH)
+    async with connection(DB_PATH) as db:
+        await migrate(db)
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Применить недостающие миграции trips.db."""
+    return await db_migrations.migrate(db, MIGRATIONS, "trips.db")
+
+
+# ========== Миграции схемы (PRAGMA user_version) ==========
 
 
-async def _ensure_schema(db: aiosqlite.Connection) -> None:
-    """Создать/обновить схему БД рейсов."""
+async def _m001_base_schema(db: aiosqlite.Connection) -> None:
+    """Таблицы trips и trip_events с индексами."""
 
     # Создать таблицу trips с полем phone
     await db.execute("""
@@ -46,18 +59,10 @@ async def _ensure_schema(db: aiosqlite.Connection) -> None:
             loading_confirmed_at TEXT,
             unloading_confirmed_at TEXT,
             completed_at TEXT,
-            curator_id INTEGER,
-            sdek_tracking TEXT
+            curator_id INTEGER
         )
     """)
 
-    # Добавляем поле sdek_tracking если его нет (миграция)
-    try:
-        await db.execute("SELECT sdek_tracking FROM trips LIMIT 1")
-    except:
-        logger.info("Adding sdek_tracking column to trips table")
-        await db.execute("ALTER TABLE trips ADD COLUMN sdek_tracking TEXT")
-
     # Создать индекс по телефону
     await db.execute("""
         CREATE INDEX IF NOT EXISTS idx_trips_phone ON trips(phone)
@@ -78,7 +83,6 @@ async def _ensure_schema(db: aiosqlite.Connection) -> None:
         CREATE INDEX IF NOT EXISTS idx_trips_number ON trips(trip_number)
     """)
 
-    # Таблица trip_events остается без изменений
     await db.execute("""
         CREATE TABLE IF NOT EXISTS trip_events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -97,7 +101,156 @@ async def _ensure_schema(db: aiosqlite.Connection) -> None:
         ON trip_events(trip_id, created_at DESC)
     """)
 
-    await db.commit()
+
+async def _m002_sdek_tracking(db: aiosqlite.Connection) -> None:
+    """Поле sdek_tracking (трек-номер СДЭК для оригиналов документов)."""
+    # на старых установках колонка уже добавлена прежним ad-hoc ALTER
+    if not await db_migrations.column_exists(db, "trips", "sdek_tracking"):
+        logger.info("Adding sdek_tracking column to trips table")
+        await db.execute("ALTER TABLE trips ADD COLUMN sdek_tracking TEXT")
+
+
+async def _m003_trip_geofences(db: aiosqlite.Connection) -> None:
+    """Геозоны погрузки/выгрузки рейса (центр + радиус) и флаг «водитель внутри»."""
+    await db.execute("""
+        CREATE TABLE trip_geofences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,              -- loading | unloading
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            radius_m REAL NOT NULL,
+            source TEXT NOT NULL,            -- curator | geocoder
+            inside INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            UNIQUE (trip_id, kind),
+            FOREIGN KEY (trip_id) REFERENCES trips(trip_id)
+        )
+    """)
+
+
+async def _m004_geocode_cache(db: aiosqlite.Connection) -> None:
+    """Кэш геокодирования: нормализованный адрес → координаты."""
+    await db.execute("""
+        CREATE TABLE geocode_cache (
+            address_norm TEXT PRIMARY KEY,
+            address TEXT NOT NULL,           -- адрес, каким его увидели впервые
+            lat REAL,                        -- NULL: провайдер адрес не нашёл
+            lon REAL,
+            provider TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+
+async def _m005_trip_metrics(db: aiosqlite.Connection) -> None:
+    """Накопительные метрики рейса: пробег, скорость, ETA."""
+    await db.execute("""
+        CREATE TABLE trip_metrics (
+            trip_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            distance_m REAL NOT NULL DEFAULT 0,
+            moving_s REAL NOT NULL DEFAULT 0,
+            avg_speed_kmh REAL,              -- средняя скорость в движении
+            speed_kmh REAL,                  -- скользящее среднее последних отрезков
+            last_lat REAL,
+            last_lon REAL,
+            last_ts TEXT,
+            remaining_m REAL,                -- до выгрузки (по прямой × коэффициент)
+            eta_at TEXT,
+            points INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (trip_id) REFERENCES trips(trip_id)
+        )
+    """)
+
+
+async def _m006_changes(db: aiosqlite.Connection) -> None:
+    """Журнал изменений для change_feed: рейсы, события рейсов, метрики."""
+    await db_migrations.create_changes_table(db)
+    now_ms = db_migrations.NOW_MS_SQL
+    trip_change = f"""
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('trip', NEW.trip_id, NEW.user_id,
+                    json_object('status', NEW.status, 'trip_number', NEW.trip_number),
+                    {now_ms});
+    """
+    await db.execute(f"""
+        CREATE TRIGGER trg_trips_insert_changes AFTER INSERT ON trips
+        BEGIN {trip_change} END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER trg_trips_update_changes AFTER UPDATE OF status, user_id ON trips
+        WHEN OLD.status IS NOT NEW.status OR OLD.user_id IS NOT NEW.user_id
+        BEGIN {trip_change} END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER trg_trip_events_changes AFTER INSERT ON trip_events
+        BEGIN
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('trip_event', NEW.trip_id,
+                    (SELECT user_id FROM trips WHERE trip_id = NEW.trip_id),
+                    json_object('event_type', NEW.event_type, 'event_id', NEW.id),
+                    {now_ms});
+        END
+    """)
+    # метрики пишутся пачкой раз в TRIP_METRICS_FLUSH_S — по строке на рейс
+    for event in ("INSERT", "UPDATE"):
+        await db.execute(f"""
+            CREATE TRIGGER trg_trip_metrics_{event.lower()}_changes AFTER {event} ON trip_metrics
+            BEGIN
+                INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+                VALUES ('trip_metrics', NEW.trip_id, NEW.user_id, NULL, {now_ms});
+            END
+        """)
+
+
+async def _m007_trip_versions(db: aiosqlite.Connection) -> None:
+    """
+    Версия рейса для условных GET: любое изменение рейса — строка в changes.
+
+    Все строки changes этой БД имеют entity_id = trip_id, поэтому индекс
+    (entity_id, seq) отдаёт последнюю версию рейса одним поиском.
+    """
+    now_ms = db_migrations.NOW_MS_SQL
+    # раньше триггер срабатывал только на status/user_id
+    await db.execute("DROP TRIGGER trg_trips_update_changes")
+    await db.execute(f"""
+        CREATE TRIGGER trg_trips_update_changes AFTER UPDATE ON trips
+        BEGIN
+            INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+            VALUES ('trip', NEW.trip_id, NEW.user_id,
+                    json_object('status', NEW.status, 'trip_number', NEW.trip_number),
+                    {now_ms});
+        END
+    """)
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        await db.execute(f"""
+            CREATE TRIGGER trg_trip_geofences_{event.lower()}_changes AFTER {event} ON trip_geofences
+            BEGIN
+                INSERT INTO changes(kind, entity_id, user_id, data, created_at)
+                VALUES ('trip_geofence', {row}.trip_id, NULL,
+                        json_object('kind', {row}.kind), {now_ms});
+            END
+        """)
+    await db.execute("CREATE INDEX idx_changes_entity ON changes(entity_id, seq)")
+
+
+async def _m008_trip_metrics_anchor_ts(db: aiosqlite.Connection) -> None:
+    """Время опорной точки: скорость и время в движении считаются от неё."""
+    await db.execute("ALTER TABLE trip_metrics ADD COLUMN anchor_ts TEXT")
+
+
+MIGRATIONS: list[db_migrations.Migration] = [
+    (1, "trips and trip_events tables", _m001_base_schema),
+    (2, "trips.sdek_tracking column", _m002_sdek_tracking),
+    (3, "trip_geofences table", _m003_trip_geofences),
+    (4, "geocode_cache table", _m004_geocode_cache),
+    (5, "trip_metrics table", _m005_trip_metrics),
+    (6, "changes table for the change feed", _m006_changes),
+    (7, "trip versions for conditional GET", _m007_trip_versions),
+    (8, "trip_metrics.anchor_ts column", _m008_trip_metrics_anchor_ts),
+]
 
 
 async def _generate_trip_number() -> str:
@@ -107,9 +260,7 @@ async def _generate_trip_number() -> str:
     Returns:
         str: Номер рейса (например: ТЛ-0001, ТЛ-0042)
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
-
+    async with connection(DB_PATH) as conn:
         # Найти максимальный номер
         async with conn.execute("""
             SELECT trip_number FROM trips
@@ -128,6 +279,13 @@ async def _generate_trip_number() -> str:
         return f"ТЛ-{new_num:04d}"  # ТЛ-0001, ТЛ-0002, ...
 
 
+async def _trip_user_id(conn: aiosqlite.Connection, trip_id: int) -> Optional[int]:
+    """user_id водителя рейса (для сброса кэша активного рейса)."""
+    async with conn.execute("SELECT user_id FROM trips WHERE trip_id = ?", (trip_id,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
 async def create_trip_by_curator(
     phone: str,
     loading_address: str,
@@ -162,9 +320,7 @@ async def create_trip_by_curator(
     # FIX: Если водитель не найден, ставим NULL (обновится при регистрации)
     # NULL лучше чем 0, т.к. 0 не валидный Telegram user_id
 
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
-
+    async with connection(DB_PATH) as conn:
         cursor = await conn.execute("""
             INSERT INTO trips (
                 trip_number, user_id, phone,
@@ -181,14 +337,15 @@ async def create_trip_by_curator(
 
         trip_id = cursor.lastrowid
         await conn.commit()
+    driver_cache.invalidate_trip(user_id)
 
-        # Логируем событие создания
-        await log_trip_event(
-            trip_id=trip_id,
-            event_type="created",
-            description=f"Рейс создан куратором",
-            created_by=curator_id
-        )
+    # Логируем событие создания (после возврата соединения в пул)
+    await log_trip_event(
+        trip_id=trip_id,
+        event_type="created",
+        description=f"Рейс создан куратором",
+        created_by=curator_id
+    )
 
     logger.info(f"Created trip #{trip_number} for phone {phone}")
     return trip_id, trip_number
@@ -205,8 +362,7 @@ async def get_trips_by_phone(phone: str, status: Optional[str] = None) -> List[D
     Returns:
         List[Dict]: Список рейсов
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
+    async with connection(DB_PATH) as conn:
         conn.row_factory = aiosqlite.Row
 
         if status:
@@ -239,8 +395,7 @@ async def get_trip(trip_id: int) -> Optional[Dict[str, Any]]:
     Returns:
         Dict | None: Данные рейса или None
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
+    async with connection(DB_PATH) as conn:
         conn.row_factory = aiosqlite.Row
 
         async with conn.execute("""
@@ -250,6 +405,26 @@ async def get_trip(trip_id: int) -> Optional[Dict[str, Any]]:
             return dict(row) if row else None
 
 
+async def get_trip_by_number(trip_number: str) -> Optional[Dict[str, Any]]:
+    """
+    Получить рейс по номеру (ТЛ-0001).
+
+    Args:
+        trip_number: Номер рейса
+
+    Returns:
+        Dict | None: Данные рейса или None
+    """
+    async with connection(DB_PATH) as conn:
+        conn.row_factory = aiosqlite.Row
+
+        async with conn.execute("""
+            SELECT * FROM trips WHERE trip_number = ?
+        """, (trip_number,)) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
 async def get_user_active_trips(user_id: int) -> List[Dict[str, Any]]:
     """
     Получить активные рейсы водителя.
@@ -260,8 +435,7 @@ async def get_user_active_trips(user_id: int) -> List[Dict[str, Any]]:
     Returns:
         List[Dict]: Список активных рейсов
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
+    async with connection(DB_PATH) as conn:
         conn.row_factory = aiosqlite.Row
 
         async with conn.execute("""
@@ -281,14 +455,15 @@ async def update_trip_user_id(trip_id: int, user_id: int) -> None:
         trip_id: ID рейса
         user_id: Telegram user_id водителя
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
-
+    async with connection(DB_PATH) as conn:
+        previous_user_id = await _trip_user_id(conn, trip_id)
         await conn.execute("""
             UPDATE trips SET user_id = ? WHERE trip_id = ?
         """, (user_id, trip_id))
 
         await conn.commit()
+    driver_cache.invalidate_trip(previous_user_id)
+    driver_cache.invalidate_trip(user_id)
 
     logger.info(f"Updated trip {trip_id} user_id to {user_id}")
 
@@ -333,9 +508,7 @@ async def update_trip_status(
     if new_status not in valid_statuses:
         raise ValueError(f"Invalid status: {new_status}. Must be one of: {', '.join(valid_statuses)}")
 
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
-
+    async with connection(DB_PATH) as conn:
         # Обновляем статус
         await conn.execute("""
             UPDATE trips SET status = ? WHERE trip_id = ?
@@ -360,7 +533,9 @@ async def update_trip_status(
                 UPDATE trips SET completed_at = ? WHERE trip_id = ?
             """, (now, trip_id))
 
+        user_id = await _trip_user_id(conn, trip_id)
         await conn.commit()
+    driver_cache.invalidate_trip(user_id)
 
     # Логируем событие
     description = comment if comment else f"Статус изменен на: {new_status}"
@@ -391,9 +566,7 @@ async def log_trip_event(
         created_by: Кто создал событие (user_id)
         metadata: Дополнительные данные (JSON)
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
-
+    async with connection(DB_PATH) as conn:
         await conn.execute("""
             INSERT INTO trip_events (
                 trip_id, event_type, description, created_at, created_by, metadata
@@ -419,8 +592,7 @@ async def get_trip_events(trip_id: int, limit: int = 100) -> List[Dict[str, Any]
     Returns:
         List[Dict]: Список событий
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
+    async with connection(DB_PATH) as conn:
         conn.row_factory = aiosqlite.Row
 
         async with conn.execute("""
@@ -449,8 +621,7 @@ async def get_all_trips(
     Returns:
         List[Dict]: Список рейсов
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
+    async with connection(DB_PATH) as conn:
         conn.row_factory = aiosqlite.Row
 
         query = "SELECT * FROM trips WHERE 1=1"
@@ -485,9 +656,7 @@ async def complete_trip_with_tracking(
         sdek_tracking: Трек-номер СДЭК для оригиналов документов
         completed_by: Кто завершил рейс (user_id)
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await _ensure_schema(conn)
-
+    async with connection(DB_PATH) as conn:
         now = datetime.now().isoformat()
 
         # Обновляем статус, трек-номер и время завершения
@@ -499,7 +668,9 @@ async def complete_trip_with_tracking(
             WHERE trip_id = ?
         """, (sdek_tracking, now, trip_id))
 
+        user_id = await _trip_user_id(conn, trip_id)
         await conn.commit()
+    driver_cache.invalidate_trip(user_id)
 
     # Логируем событие
     await log_trip_event(
@@ -511,3 +682,219 @@ async def complete_trip_with_tracking(
     )
 
     logger.info(f"Trip {trip_id} completed with SDEK tracking: {sdek_tracking}")
+
+
+# ========== Геозоны рейсов ==========
+
+GEOFENCE_KINDS = ('loading', 'unloading')
+
+
+async def set_trip_geofence(
+    trip_id: int,
+    kind: str,
+    lat: float,
+    lon: float,
+    radius_m: float,
+    source: str = 'curator'
+) -> None:
+    """
+    Задать (или заменить) геозону погрузки/выгрузки рейса.
+
+    Args:
+        trip_id: ID рейса
+        kind: 'loading' или 'unloading'
+        lat, lon: Центр геозоны
+        radius_m: Радиус в метрах
+        source: Откуда координаты ('curator' или 'geocoder')
+    """
+    if kind not in GEOFENCE_KINDS:
+        raise ValueError(f"Invalid geofence kind: {kind}. Must be one of: {', '.join(GEOFENCE_KINDS)}")
+
+    async with connection(DB_PATH) as conn:
+        # новые координаты — водитель считается снаружи до следующей точки
+        await conn.execute("""
+            INSERT INTO trip_geofences (trip_id, kind, lat, lon, radius_m, source, inside, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+            ON CONFLICT(trip_id, kind) DO UPDATE SET
+                lat = excluded.lat,
+                lon = excluded.lon,
+                radius_m = excluded.radius_m,
+                source = excluded.source,
+                inside = 0,
+                updated_at = excluded.updated_at
+        """, (trip_id, kind, lat, lon, radius_m, source, datetime.now().isoformat()))
+
+        await conn.commit()
+
+    logger.info(f"Trip {trip_id} {kind} geofence set to {lat:.5f},{lon:.5f} r={radius_m:.0f}m ({source})")
+
+
+async def get_trip_geofences(trip_id: int) -> List[Dict[str, Any]]:
+    """Геозоны рейса."""
+    async with connection(DB_PATH) as conn:
+        conn.row_factory = aiosqlite.Row
+
+        async with conn.execute("""
+            SELECT * FROM trip_geofences WHERE trip_id = ? ORDER BY kind
+        """, (trip_id,)) as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+
+async def get_active_geofences() -> List[Dict[str, Any]]:
+    """
+    Геозоны незавершённых рейсов, у которых известен водитель.
+
+    Returns:
+        List[Dict]: id, trip_id, user_id, status, kind, lat, lon, radius_m, inside
+    """
+    async with connection(DB_PATH) as conn:
+        conn.row_factory = aiosqlite.Row
+
+        async with conn.execute("""
+            SELECT g.id, g.trip_id, t.user_id, t.status, g.kind,
+                   g.lat, g.lon, g.radius_m, g.inside
+            FROM trip_geofences g
+            JOIN trips t ON t.trip_id = g.trip_id
+            WHERE t.user_id IS NOT NULL
+              AND t.status NOT IN ('completed', 'cancelled')
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+
+async def set_geofence_inside(geofence_id: int, inside: bool) -> None:
+    """Запомнить, находится ли водитель внутри геозоны (переживает рестарт)."""
+    async with connection(DB_PATH) as conn:
+        await conn.execute("""
+            UPDATE trip_geofences SET inside = ? WHERE id = ?
+        """, (int(inside), geofence_id))
+
+        await conn.commit()
+
+
+# ========== Кэш геокодирования ==========
+
+
+async def get_geocodes(addresses_norm: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Записи кэша геокодирования для списка нормализованных адресов.
+
+    Returns:
+        Dict: address_norm → {lat, lon, provider, created_at}
+    """
+    if not addresses_norm:
+        return {}
+
+    async with connection(DB_PATH) as conn:
+        conn.row_factory = aiosqlite.Row
+
+        async with conn.execute("""
+            SELECT address_norm, lat, lon, provider, created_at FROM geocode_cache
+            WHERE address_norm IN (SELECT value FROM json_each(?))
+        """, (json.dumps(addresses_norm, ensure_ascii=False),)) as cursor:
+            rows = await cursor.fetchall()
+            return {row['address_norm']: dict(row) for row in rows}
+
+
+async def save_geocode(
+    address_norm: str,
+    address: str,
+    coords: Optional[tuple[float, float]],
+    provider: str
+) -> None:
+    """
+    Сохранить результат геокодирования (coords=None — адрес не найден).
+    """
+    lat, lon = coords if coords else (None, None)
+
+    async with connection(DB_PATH) as conn:
+        await conn.execute("""
+            INSERT INTO geocode_cache (address_norm, address, lat, lon, provider, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(address_norm) DO UPDATE SET
+                lat = excluded.lat,
+                lon = excluded.lon,
+                provider = excluded.provider,
+                created_at = excluded.created_at
+        """, (address_norm, address, lat, lon, provider, datetime.now().isoformat()))
+
+        await conn.commit()
+
+
+# ========== Метрики рейса ==========
+
+TRIP_METRICS_COLUMNS = (
+    'trip_id', 'user_id', 'distance_m', 'moving_s', 'avg_speed_kmh', 'speed_kmh',
+    'last_lat', 'last_lon', 'last_ts', 'anchor_ts', 'remaining_m', 'eta_at', 'points', 'updated_at',
+)
+
+
+async def get_trip_metrics(trip_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Метрики рейса (пробег, скорость, ETA) или None, если точек ещё не было.
+    """
+    async with connection(DB_PATH) as conn:
+        conn.row_factory = aiosqlite.Row
+
+        async with conn.execute("""
+            SELECT * FROM trip_metrics WHERE trip_id = ?
+        """, (trip_id,)) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
+async def get_trip_version(trip_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Версия рейса для ETag: меняется с рейсом, его событиями, геозонами и метриками.
+
+    Версия — последний seq рейса в журнале changes. Если его строки уже
+    удалены по сроку хранения, берётся граница удаления: она не меньше
+    удалённого seq, поэтому старый ETag с новой версией не совпадёт.
+
+    Returns:
+        dict {version, user_id} или None, если рейса нет
+    """
+    async with connection(DB_PATH) as conn:
+        async with conn.execute("""
+            SELECT t.user_id,
+                   COALESCE(
+                       (SELECT MAX(seq) FROM changes WHERE entity_id = t.trip_id),
+                       (SELECT MIN(seq) - 1 FROM changes),
+                       (SELECT seq FROM sqlite_sequence WHERE name = 'changes'),
+                       0)
+              FROM trips AS t
+             WHERE t.trip_id = ?
+        """, (trip_id,)) as cursor:
+            row = await cursor.fetchone()
+    return {"user_id": row[0], "version": row[1]} if row else None
+
+
+async def get_trip_events_version(trip_id: int) -> Dict[str, Any]:
+    """Число и последний id событий рейса (для ETag)."""
+    async with connection(DB_PATH) as conn:
+        async with conn.execute("""
+            SELECT COUNT(*), MAX(id) FROM trip_events WHERE trip_id = ?
+        """, (trip_id,)) as cursor:
+            count, max_id = await cursor.fetchone()
+    return {"count": count, "max_id": max_id or 0}
+
+
+async def save_trip_metrics(rows: List[Dict[str, Any]]) -> None:
+    """Сохранить метрики нескольких рейсов одной транзакцией."""
+    if not rows:
+        return
+
+    columns = ", ".join(TRIP_METRICS_COLUMNS)
+    placeholders = ", ".join("?" * len(TRIP_METRICS_COLUMNS))
+    updates = ", ".join(f"{c} = excluded.{c}" for c in TRIP_METRICS_COLUMNS[1:])
+    async with connection(DB_PATH) as conn:
+        await conn.executemany(
+            f"""
+            INSERT INTO trip_metrics ({columns}) VALUES ({placeholders})
+            ON CONFLICT(trip_id) DO UPDATE SET {updates}
+            """,
+            [tuple(row[c] for c in TRIP_METRICS_COLUMNS) for row in rows],
+        )
+
+        await conn.commit()
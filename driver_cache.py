@@ -0,0 +1,103 @@
+"""
+Кэш профилей водителей в памяти процесса.
+
+Хендлеры локации, документов и напоминаний постоянно спрашивают телефон,
+флаг active и активный рейс водителя. Профиль кэшируется с TTL и явно
+сбрасывается при изменениях из этого процесса (save_phone, set_active,
+назначение рейса и смена его статуса). TTL ограничивает устаревание для
+изменений из другого процесса (веб, скрипты очистки).
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+# Настройки кэша (можно переопределить через .env)
+TTL_S = float(os.getenv("DRIVER_CACHE_TTL_S", "60"))
+MAX_SIZE = int(os.getenv("DRIVER_CACHE_MAX", "10000"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Ограниченный LRU-словарь с временем жизни записей и счётчиками."""
+
+    def __init__(self, name: str, ttl: float = TTL_S, maxsize: int = MAX_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = max(maxsize, 1)
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """Значение из кэша или default (по умолчанию _MISSING) при промахе."""
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# user_id → (phone, active) из points.db/drivers
+profiles = TTLCache("profiles")
+# user_id → trip_id активного рейса (или None) из trips.db
+active_trips = TTLCache("active_trips")
+
+
+def is_missing(value: Any) -> bool:
+    """True, если TTLCache.get() вернул промах."""
+    return value is _MISSING
+
+
+def invalidate(user_id: int) -> None:
+    """Сбросить весь профиль водителя."""
+    profiles.invalidate(user_id)
+    active_trips.invalidate(user_id)
+
+
+def invalidate_trip(user_id: int | None) -> None:
+    """Сбросить активный рейс водителя (назначение, смена статуса)."""
+    if user_id is not None:
+        active_trips.invalidate(user_id)
+
+
+def clear() -> None:
+    profiles.clear()
+    active_trips.clear()
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Счётчики попаданий/промахов по каждой части профиля."""
+    return {cache.name: cache.stats() for cache in (profiles, active_trips)}
@@ -0,0 +1,18 @@
+"""
+Геометрия на сфере для координат водителей (WGS84, градусы).
+"""
+
+import math
+
+EARTH_RADIUS_M = 6_371_008.8  # средний радиус Земли
+EARTH_RADIUS_KM = EARTH_RADIUS_M / 1000
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по большому кругу между двумя точками в метрах."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,260 @@
+"""
+Геокодирование адресов рейсов с постоянным кэшем.
+
+Адреса погрузки/выгрузки — свободный текст. Geocoder превращает их в
+координаты так, чтобы один и тот же адрес (типичный склад, терминал)
+никогда не уходил к провайдеру дважды:
+
+* адрес нормализуется (регистр, ё, пунктуация, «улица» → «ул» и т.п.);
+* результат — и найденный, и «не найдено» — хранится в trips.db
+  (geocode_cache); «не найдено» перепроверяется через GEOCODER_MISS_TTL_H
+  и сразу после смены провайдера;
+* одинаковые запросы, которые ждут ответа провайдера одновременно,
+  склеиваются в один вызов;
+* resolve_many() читает кэш для всех адресов одним запросом, а
+  промахи отправляет провайдеру параллельно (не больше
+  GEOCODER_CONCURRENCY одновременно).
+
+Провайдеры (GEOCODER_PROVIDER):
+    gazetteer — офлайн-справочник из CSV-файла (GEOCODER_GAZETTEER);
+    yandex    — HTTP Геокодер Яндекса (YANDEX_GEOCODER_API_KEY);
+    none      — только кэш.
+"""
+
+import asyncio
+import csv
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import db_trips
+from driver_cache import TTLCache, is_missing
+
+logger = logging.getLogger(__name__)
+
+PROVIDER = os.getenv("GEOCODER_PROVIDER", "gazetteer").strip().lower()
+GAZETTEER_PATH = Path(os.getenv("GEOCODER_GAZETTEER", Path(__file__).with_name("gazetteer.csv")))
+YANDEX_API_KEY = os.getenv("YANDEX_GEOCODER_API_KEY", "")
+CONCURRENCY = int(os.getenv("GEOCODER_CONCURRENCY", "4"))
+MISS_TTL = timedelta(hours=float(os.getenv("GEOCODER_MISS_TTL_H", "24")))
+
+Coords = Tuple[float, float]
+
+_ABBREVIATIONS = {
+    "город": "г",
+    "улица": "ул",
+    "дом": "д",
+    "проспект": "пр-кт",
+    "просп": "пр-кт",
+    "пр-т": "пр-кт",
+    "шоссе": "ш",
+    "переулок": "пер",
+    "область": "обл",
+    "район": "р-н",
+    "строение": "стр",
+    "корпус": "к",
+    "корп": "к",
+    "поселок": "п",
+    "пос": "п",
+    "деревня": "дер",  # не «д»: «д» — это дом
+    "село": "с",
+}
+_PUNCTUATION = re.compile(r"[.,;:\"'«»()№#/\\]+")
+
+
+def normalize_address(address: str) -> str:
+    """Ключ кэша: «Москва, ул. Ленина, д.1» и «москва улица ленина дом 1» совпадают."""
+    text = _PUNCTUATION.sub(" ", address.lower().replace("ё", "е"))
+    tokens = [_ABBREVIATIONS.get(token, token) for token in text.split()]
+    if tokens[:1] == ["россия"]:
+        tokens = tokens[1:]
+    return " ".join(tokens)
+
+
+# ----------------------------------------------------------------------
+# провайдеры
+# ----------------------------------------------------------------------
+
+
+class GeocodingProvider:
+    """Интерфейс провайдера: адрес → (lat, lon) или None, если не найден."""
+
+    name = "base"
+
+    async def geocode(self, address: str) -> Optional[Coords]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class GazetteerProvider(GeocodingProvider):
+    """
+    Офлайн-справочник из CSV «адрес;широта;долгота» (строки с # пропускаются).
+
+    Ищется только точное совпадение нормализованного адреса: подставлять
+    центр города вместо склада нельзя — по координатам ставятся геозоны.
+    """
+
+    name = "gazetteer"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries: Dict[str, Coords] = {}
+        if not self.path.exists():
+            logger.warning("geocoding: gazetteer %s not found", self.path)
+            return
+        with self.path.open(encoding="utf-8") as f:
+            for row in csv.reader(f, delimiter=";"):
+                if not row or row[0].lstrip().startswith("#"):
+                    continue
+                name, lat, lon = row[0], float(row[1]), float(row[2])
+                self._entries[normalize_address(name)] = (lat, lon)
+        logger.info("geocoding: %s gazetteer entries from %s", len(self._entries), self.path)
+
+    async def geocode(self, address: str) -> Optional[Coords]:
+        return self._entries.get(normalize_address(address))
+
+
+class YandexProvider(GeocodingProvider):
+    """HTTP Геокодер Яндекса (https://yandex.ru/dev/geocode/)."""
+
+    name = "yandex"
+    URL = "https://geocode-maps.yandex.ru/1.x/"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._session = None
+
+    async def geocode(self, address: str) -> Optional[Coords]:
+        import aiohttp  # ставится вместе с aiogram
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        params = {"apikey": self.api_key, "geocode": address, "format": "json", "results": "1"}
+        async with self._session.get(self.URL, params=params) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        members = data["response"]["GeoObjectCollection"]["featureMember"]
+        if not members:
+            return None
+        lon, lat = map(float, members[0]["GeoObject"]["Point"]["pos"].split())
+        return lat, lon
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def make_provider(name: str = PROVIDER) -> Optional[GeocodingProvider]:
+    if name == "gazetteer":
+        return GazetteerProvider(GAZETTEER_PATH)
+    if name == "yandex":
+        if not YANDEX_API_KEY:
+            logger.warning("geocoding: YANDEX_GEOCODER_API_KEY is not set, using cache only")
+            return None
+        return YandexProvider(YANDEX_API_KEY)
+    return None
+
+
+# ----------------------------------------------------------------------
+# кэш + склейка запросов
+# ----------------------------------------------------------------------
+
+
+class Geocoder:
+    """Кэширующий резолвер адресов поверх провайдера."""
+
+    def __init__(self, provider: Optional[GeocodingProvider], concurrency: int = CONCURRENCY):
+        self.provider = provider
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        # нормализованный адрес → задача запроса к провайдеру
+        self._pending: Dict[str, asyncio.Task] = {}
+        # свежие ответы провайдера: закрывают окно между чтением кэша в БД
+        # и записью ответа, в которое второй запрос ушёл бы к провайдеру
+        self._recent = TTLCache("geocodes", ttl=MISS_TTL.total_seconds())
+        self.hits = 0
+        self.lookups = 0
+        self.coalesced = 0
+
+    async def resolve(self, address: str) -> Optional[Coords]:
+        return (await self.resolve_many([address]))[address]
+
+    async def resolve_many(self, addresses: Iterable[str]) -> Dict[str, Optional[Coords]]:
+        """Координаты для каждого адреса (None — не найден или провайдер недоступен)."""
+        by_norm: Dict[str, str] = {}
+        norms = {}
+        for address in addresses:
+            norm = normalize_address(address)
+            norms[address] = norm
+            by_norm.setdefault(norm, address)
+
+        found: Dict[str, Optional[Coords]] = {}
+        cached = await db_trips.get_geocodes(list(by_norm))
+        misses = []
+        for norm, address in by_norm.items():
+            row = cached.get(norm)
+            if row is not None and (row["lat"] is not None or not self._miss_stale(row)):
+                self.hits += 1
+                found[norm] = (row["lat"], row["lon"]) if row["lat"] is not None else None
+            else:
+                misses.append((norm, address))
+
+        if misses:
+            results = await asyncio.gather(
+                *(self._lookup(norm, address) for norm, address in misses),
+                return_exceptions=True,
+            )
+            for (norm, address), result in zip(misses, results):
+                if isinstance(result, BaseException):
+                    logger.warning("geocoding: %r failed: %s", address, result)
+                    result = None
+                found[norm] = result
+
+        return {address: found[norm] for address, norm in norms.items()}
+
+    def _miss_stale(self, row: dict) -> bool:
+        """Перепроверить «не найдено»: истёк срок или ответил другой провайдер."""
+        # после смены GEOCODER_PROVIDER промахи прежнего не должны жить MISS_TTL
+        if self.provider is not None and row["provider"] != self.provider.name:
+            return True
+        return datetime.now() - datetime.fromisoformat(row["created_at"]) > MISS_TTL
+
+    async def _lookup(self, norm: str, address: str) -> Optional[Coords]:
+        recent = self._recent.get(norm)
+        if not is_missing(recent):
+            self.coalesced += 1
+            return recent
+        task = self._pending.get(norm)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+        if self.provider is None:
+            return None
+        task = asyncio.create_task(self._fetch(norm, address))
+        self._pending[norm] = task
+        task.add_done_callback(lambda _: self._pending.pop(norm, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, norm: str, address: str) -> Optional[Coords]:
+        async with self._semaphore:
+            self.lookups += 1
+            coords = await self.provider.geocode(address)
+        await db_trips.save_geocode(norm, address, coords, self.provider.name)
+        self._recent.set(norm, coords)
+        logger.info("geocoding: %r → %s (%s)", address, coords, self.provider.name)
+        return coords
+
+    async def close(self) -> None:
+        if self.provider is not None:
+            await self.provider.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"cache_hits": self.hits, "lookups": self.lookups, "coalesced": self.coalesced}
+
+
+geocoder = Geocoder(make_provider())
@@ -0,0 +1,139 @@
+"""
+Фильтр качества GPS-точек перед записью.
+
+Точки раньше писались как пришли: повторные отправки, нулевые координаты и
+«телепорты» (800 км за 2 минуты) портили последнюю позицию водителя, на
+которую смотрят карта, эскалации и карточки рейсов у кураторов.
+
+Для каждого водителя в памяти хранится последняя принятая точка; решение
+по новой точке (classify) принимается за O(1) без обращения к БД, а
+последней принятой точка становится только после записи (accept):
+
+    invalid   — координаты вне диапазона или ровно (0, 0);
+    duplicate — те же координаты и то же время, что у принятой точки;
+    stale     — время раньше принятой точки (или то же, но в другом месте);
+    jump      — скорость от принятой точки выше GPS_MAX_SPEED_KMH.
+
+Если «прыжок» подтверждается следующей точкой (она правдоподобна
+относительно отвергнутой), принятая точка считается выбросом и водитель
+продолжает с нового места.
+
+GPS_FILTER_MODE:
+    reject — отвергнутые точки не пишутся в points, только в rejected_points;
+    flag   — точки пишутся, а подозрительные дополнительно попадают в аудит;
+    off    — фильтр выключен.
+"""
+
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+MODE = os.getenv("GPS_FILTER_MODE", "reject").strip().lower()
+MAX_SPEED_KMH = float(os.getenv("GPS_MAX_SPEED_KMH", "200"))
+# ниже этого сдвига скорость не проверяем: дрожание GPS за пару секунд
+# даёт «сотни км/ч» на десятках метров
+JUMP_MIN_M = float(os.getenv("GPS_JUMP_MIN_M", "1000"))
+
+INVALID = "invalid"
+DUPLICATE = "duplicate"
+STALE = "stale"
+JUMP = "jump"
+
+# (lat, lon, ts)
+_Fix = Tuple[float, float, datetime]
+
+
+def _too_fast(a: _Fix, b: _Fix, max_speed_kmh: float) -> bool:
+    distance_m = haversine_m(a[0], a[1], b[0], b[1])
+    if distance_m < JUMP_MIN_M:
+        return False
+    elapsed_s = (b[2] - a[2]).total_seconds()
+    if elapsed_s <= 0:
+        return True
+    return distance_m / elapsed_s * 3.6 > max_speed_kmh
+
+
+class GpsFilter:
+    """Состояние «последней принятой точки» по водителям и правила отбраковки."""
+
+    def __init__(self, mode: str = MODE, max_speed_kmh: float = MAX_SPEED_KMH):
+        self.mode = mode
+        self.max_speed_kmh = max_speed_kmh
+        self._last: Dict[int, _Fix] = {}
+        # user_id → отвергнутый «прыжок», который может подтвердиться
+        self._pending_jump: Dict[int, _Fix] = {}
+        self.counters: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("reject", "flag")
+
+    @property
+    def stores_rejected(self) -> bool:
+        """Писать ли подозрительные точки в points (режим flag)."""
+        return self.mode == "flag"
+
+    def seed(self, fixes: Iterable[Tuple[int, float, float, datetime]]) -> None:
+        """Заполнить состояние последними позициями из БД (при старте)."""
+        for user_id, lat, lon, ts in fixes:
+            self._last.setdefault(user_id, (lat, lon, ts))
+
+    def forget(self, user_id: int) -> None:
+        self._last.pop(user_id, None)
+        self._pending_jump.pop(user_id, None)
+
+    def classify(self, user_id: int, lat: float, lon: float, ts: datetime) -> Optional[str]:
+        """
+        Причина отбраковки точки или None, если точка проходит фильтр.
+
+        Последняя принятая точка не меняется: её обновляет accept() после
+        того, как точка действительно записана. Иначе точка из пачки,
+        которая не закоммитилась, отвергла бы повторную отправку как
+        duplicate.
+        """
+        if not self.enabled:
+            return None
+        reason = self._classify(user_id, (lat, lon, ts))
+        self.counters[reason or "accepted"] = self.counters.get(reason or "accepted", 0) + 1
+        if reason is not None:
+            logger.info("gps-filter: %s point from %s (%.5f, %.5f @ %s)", reason, user_id, lat, lon, ts)
+        return reason
+
+    def accept(self, user_id: int, lat: float, lon: float, ts: datetime) -> None:
+        """Запомнить записанную точку как последнюю принятую."""
+        if not self.enabled:
+            return
+        last = self._last.get(user_id)
+        if last is None or ts >= last[2]:
+            self._last[user_id] = (lat, lon, ts)
+        self._pending_jump.pop(user_id, None)
+
+    def _classify(self, user_id: int, fix: _Fix) -> Optional[str]:
+        lat, lon, ts = fix
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (lat == 0 and lon == 0):
+            return INVALID
+
+        last = self._last.get(user_id)
+        if last is not None:
+            if fix == last:
+                return DUPLICATE
+            if ts <= last[2]:
+                return STALE
+            if _too_fast(last, fix, self.max_speed_kmh):
+                pending = self._pending_jump.get(user_id)
+                if pending is None or ts <= pending[2] or _too_fast(pending, fix, self.max_speed_kmh):
+                    self._pending_jump[user_id] = fix
+                    return JUMP
+                # две точки подряд согласованы между собой — выбросом была прежняя
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"drivers": len(self._last), **self.counters}
+
+
+gps_filter = GpsFilter()
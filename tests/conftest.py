@@ -0,0 +1,5 @@
+import os
+import sys
+
+# модули бота и веба лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,134 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import change_feed
+import db
+import db_documents
+import db_pool
+import db_trips
+from change_feed import ChangeFeed, ChangeFeedOverflow
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "points.db")
+    monkeypatch.setattr(db_trips, "DB_PATH", tmp_path / "trips.db")
+    monkeypatch.setattr(db_documents, "DB_PATH", tmp_path / "documents.db")
+
+
+def _run(scenario):
+    async def main():
+        await db.init()
+        await db_trips.init()
+        await db_documents.init_documents_db()
+        feed = ChangeFeed("points", lambda: db.DB_PATH, interval_s=0.01)
+        try:
+            return await scenario(feed)
+        finally:
+            await feed.stop()
+            await db_pool.close_all()
+
+    return asyncio.run(main())
+
+
+async def _points(user_ids, minute=0):
+    await db.save_points([(uid, 55.0, 37.0, T0 + timedelta(minutes=minute)) for uid in user_ids])
+
+
+async def _take(changes, n):
+    return [await asyncio.wait_for(changes.__anext__(), 2) for _ in range(n)]
+
+
+def test_replay_after_seq_then_live(databases):
+    async def scenario(feed):
+        await _points([1, 2, 3])
+        await feed.start()
+        changes = feed.changes(after=0, kinds={"point"})
+        replayed = await _take(changes, 3)
+        await _points([4], minute=1)
+        live = await _take(changes, 1)
+        await changes.aclose()
+        return replayed, live
+
+    replayed, live = _run(scenario)
+    assert [c.user_id for c in replayed] == [1, 2, 3]
+    assert [c.seq for c in replayed] == sorted(c.seq for c in replayed)
+    assert live[0].user_id == 4 and live[0].seq > replayed[-1].seq
+    assert live[0].data["ts"] == db.to_epoch_ms(T0 + timedelta(minutes=1))
+
+
+def test_replay_skips_other_kinds(databases):
+    async def scenario(feed):
+        await _points([1])
+        await db.set_active(1, False)
+        await _points([2])
+        await feed.start()
+        changes = feed.changes(after=0, kinds={"driver"})
+        got = await _take(changes, 1)
+        await changes.aclose()
+        return got
+
+    (change,) = _run(scenario)
+    assert change.kind == "driver" and change.user_id == 1
+
+
+def test_overflow_resumes_from_last_delivered(databases, monkeypatch):
+    monkeypatch.setattr(change_feed, "QUEUE_SIZE", 2)
+
+    async def scenario(feed):
+        await feed.start()
+        changes = feed.changes(kinds={"point"})
+        first = asyncio.ensure_future(changes.__anext__())
+        await asyncio.sleep(0)  # подписка оформлена
+        await _points([1])
+        delivered = [await asyncio.wait_for(first, 2)]
+        for uid in range(2, 8):
+            await _points([uid], minute=uid)
+        await asyncio.sleep(0.2)  # читатель раздал, подписчик не читал
+        with pytest.raises(ChangeFeedOverflow) as exc:
+            while True:
+                delivered.append(await asyncio.wait_for(changes.__anext__(), 2))
+        assert exc.value.seq == delivered[-1].seq
+        resumed = feed.changes(after=exc.value.seq, kinds={"point"})
+        delivered += await _take(resumed, 7 - len(delivered))
+        await resumed.aclose()
+        return delivered
+
+    delivered = _run(scenario)
+    assert [c.user_id for c in delivered] == list(range(1, 8))
+
+
+def test_prune_all_without_readers(databases):
+    async def scenario(feed):
+        await _points([1, 2])
+        async with db_pool.connection(db.DB_PATH) as conn:
+            await conn.execute("UPDATE changes SET created_at = created_at - 48 * 3600 * 1000 WHERE user_id = 1")
+            await conn.commit()
+        await _points([3], minute=1)
+        deleted = await change_feed.prune_all(retention_h=24)
+        async with db_pool.connection(db.DB_PATH) as conn:
+            async with conn.execute("SELECT user_id FROM changes WHERE kind = 'point' ORDER BY seq") as cur:
+                left = [row[0] for row in await cur.fetchall()]
+        return deleted, left
+
+    deleted, left = _run(scenario)
+    assert deleted >= 1
+    assert left == [2, 3]
+
+
+def test_change_seq_survives_pruning(databases):
+    async def scenario(feed):
+        empty = await db.get_change_seq()
+        await _points([1])
+        seq = await db.get_change_seq()
+        await feed.prune(retention_h=0)
+        return empty, seq, await db.get_change_seq(), len(await db.list_drivers())
+
+    empty, seq, after_prune, drivers = _run(scenario)
+    assert empty == 0 and seq > 0
+    assert after_prune == seq  # тот же ETag для /api/drivers, а не ложный 0
+    assert drivers == 1
@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, Response
+
+from web.conditional import CACHE_CONTROL, Conditional, etag_matches, make_etag
+
+
+def test_make_etag():
+    assert make_etag("trip", 5, 1042) == '"trip-5-1042"'
+
+
+@pytest.mark.parametrize(
+    "header, matches",
+    [
+        ('"trip-5-1042"', True),
+        ('W/"trip-5-1042"', True),
+        ('"trip-5-1041", "trip-5-1042"', True),
+        ("*", True),
+        ('"trip-5-1041"', False),
+        ("trip-5-1042", False),
+    ],
+)
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"trip-5-1042"') is matches
+
+
+def test_check_without_validator_sets_headers():
+    response = Response()
+    cond = Conditional(response, if_none_match=None)
+    assert cond.check("docs", 7, "2.15.30") is None
+    assert response.headers["etag"] == '"docs-7-2.15.30"'
+    assert response.headers["cache-control"] == CACHE_CONTROL
+
+
+def test_check_returns_304_for_matching_etag():
+    response = Response()
+    not_modified = Conditional(response, if_none_match='"docs-7-2.15.30"').check("docs", 7, "2.15.30")
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == '"docs-7-2.15.30"'
+    assert "etag" not in response.headers
+
+
+def test_new_version_is_served_in_full():
+    cond = Conditional(Response(), if_none_match='"events-7-3-41"')
+    assert cond.check("events", 7, 4, 42) is None
+
+
+def test_endpoint_round_trip():
+    app = FastAPI()
+    state = {"version": 1}
+
+    @app.get("/thing")
+    async def thing(cond: Conditional = Depends()):
+        not_modified = cond.check("thing", state["version"])
+        if not_modified:
+            return not_modified
+        return {"version": state["version"]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/thing")
+            etag = first.headers["etag"]
+            cached = await client.get("/thing", headers={"If-None-Match": etag})
+            # If-Modified-Since больше не даёт 304 сам по себе
+            dated = await client.get("/thing", headers={"If-Modified-Since": "Wed, 01 Jan 2100 00:00:00 GMT"})
+            state["version"] = 2
+            changed = await client.get("/thing", headers={"If-None-Match": etag})
+        return first, cached, dated, changed
+
+    first, cached, dated, changed = asyncio.run(scenario())
+    assert first.status_code == 200 and first.json() == {"version": 1}
+    assert cached.status_code == 304 and cached.content == b""
+    assert dated.status_code == 200
+    assert "last-modified" not in first.headers
+    assert changed.status_code == 200 and changed.json() == {"version": 2}
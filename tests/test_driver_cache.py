@@ -0,0 +1,30 @@
+from driver_cache import TTLCache, is_missing
+
+
+def test_hit_miss_and_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("driver_cache.time.monotonic", lambda: now[0])
+    cache = TTLCache("test", ttl=60, maxsize=10)
+    assert is_missing(cache.get(1))
+    cache.set(1, ("+79990000001", True))
+    assert cache.get(1) == ("+79990000001", True)
+    now[0] += 61
+    assert is_missing(cache.get(1))
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 2, "evictions": 0}
+
+
+def test_cached_none_is_a_hit():
+    cache = TTLCache("test")
+    cache.set(1, None)
+    assert cache.get(1) is None
+
+
+def test_lru_eviction():
+    cache = TTLCache("test", maxsize=2)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)  # 1 свежее, вытесняется 2
+    cache.set(3, "c")
+    assert cache.get(1) == "a"
+    assert is_missing(cache.get(2))
+    assert cache.stats()["evictions"] == 1
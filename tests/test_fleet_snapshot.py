@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import db
+from bot import fleet_snapshot
+from bot.fleet_snapshot import FleetSnapshot, render
+
+NOW = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _pos(user_id: int, minutes_ago: float) -> dict:
+    return {
+        "user_id": user_id,
+        "phone": f"+7999000000{user_id}",
+        "lat": 55.75,
+        "lon": 37.61,
+        "ts": NOW - timedelta(minutes=minutes_ago),
+    }
+
+
+def test_header_counts_only_fresh_drivers():
+    stale_min = fleet_snapshot.STALE_HOURS * 60 + 1
+    text = render([_pos(1, 1), _pos(2, 5), _pos(3, stale_min)], NOW)
+    assert "Водителей на связи: 2</b> · ⚠️ без связи: 1" in text
+    assert text.count("⚠️ +7999") == 1
+
+
+def test_driver_turns_stale_as_time_passes():
+    positions = [_pos(1, 0)]
+    later = NOW + timedelta(hours=fleet_snapshot.STALE_HOURS, minutes=1)
+    assert "📍 +79990000001" in render(positions, NOW)
+    assert "⚠️ +79990000001" in render(positions, later)
+
+
+def test_snapshot_refreshes_without_points_and_retries_failures(monkeypatch):
+    async def get_state(key):
+        return None
+
+    monkeypatch.setattr(db, "get_state", get_state)
+    calls = []
+
+    async def refresh():
+        calls.append(asyncio.get_running_loop().time())
+        if len(calls) == 1:
+            raise RuntimeError("Telegram is down")
+
+    async def scenario():
+        snapshot = FleetSnapshot(interval_s=0.01, max_period_s=0.2)
+        snapshot.refresh = refresh
+        task = asyncio.create_task(snapshot._run())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        return snapshot
+
+    asyncio.run(scenario())
+    # первая попытка упала, дальше — перерисовка по таймеру без mark_dirty()
+    assert len(calls) >= 3
+    assert calls[1] - calls[0] < 0.15
+
+
+def test_snapshot_retries_reading_pinned_message_id(monkeypatch):
+    states = iter([RuntimeError("database is locked"), "42"])
+
+    async def get_state(key):
+        state = next(states)
+        if isinstance(state, Exception):
+            raise state
+        return state
+
+    monkeypatch.setattr(db, "get_state", get_state)
+    seen = []
+
+    async def scenario():
+        snapshot = FleetSnapshot(interval_s=0.01, max_period_s=0.2)
+
+        async def refresh():
+            seen.append(snapshot._message_id)
+
+        snapshot.refresh = refresh
+        task = asyncio.create_task(snapshot._run())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    # задача пережила ошибку БД и не отправила новую сводку мимо закреплённой
+    assert seen and seen[0] == 42
@@ -0,0 +1,51 @@
+import asyncio
+
+import db_pool
+import db_trips
+from geocoding import Geocoder, GeocodingProvider, normalize_address
+
+
+class FakeProvider(GeocodingProvider):
+    def __init__(self, name, known=None):
+        self.name = name
+        self.known = known or {}
+        self.calls = []
+
+    async def geocode(self, address):
+        self.calls.append(address)
+        return self.known.get(address)
+
+
+def test_normalize_address_equivalent_spellings():
+    assert normalize_address("Россия, Москва, ул. Ленина, д.1") == normalize_address("москва улица ленина дом 1")
+
+
+def test_village_and_house_do_not_share_a_key():
+    assert normalize_address("Тверская обл, деревня Вязово") != normalize_address("Тверская обл, дом Вязово")
+
+
+def test_cached_miss_is_retried_after_provider_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_trips, "DB_PATH", tmp_path / "trips.db")
+    address = "Склад Север, Химки"
+
+    async def scenario():
+        await db_trips.init()
+        try:
+            gazetteer = FakeProvider("gazetteer")
+            assert await Geocoder(gazetteer).resolve(address) is None
+            # тот же провайдер: промах берётся из кэша
+            again = FakeProvider("gazetteer")
+            assert await Geocoder(again).resolve(address) is None
+            assert again.calls == []
+            # сменили провайдера — промах перепроверяется
+            yandex = FakeProvider("yandex", {address: (55.89, 37.44)})
+            assert await Geocoder(yandex).resolve(address) == (55.89, 37.44)
+            assert yandex.calls == [address]
+            # найденное кэшируется независимо от провайдера
+            back = FakeProvider("gazetteer")
+            assert await Geocoder(back).resolve(address) == (55.89, 37.44)
+            assert back.calls == []
+        finally:
+            await db_pool.close_all()
+
+    asyncio.run(scenario())
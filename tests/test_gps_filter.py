@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+from gps_filter import DUPLICATE, INVALID, JUMP, STALE, GpsFilter
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+MOSCOW = (55.7558, 37.6173)
+SPB = (59.9343, 30.3351)
+
+
+def _accepted(f: GpsFilter, user_id, lat, lon, ts) -> bool:
+    """classify + accept, как делает point_writer после коммита."""
+    if f.classify(user_id, lat, lon, ts) is not None:
+        return False
+    f.accept(user_id, lat, lon, ts)
+    return True
+
+
+def test_invalid_coordinates():
+    f = GpsFilter(mode="reject")
+    assert f.classify(1, 0, 0, T0) == INVALID
+    assert f.classify(1, 91, 10, T0) == INVALID
+    assert f.classify(1, 10, -181, T0) == INVALID
+
+
+def test_duplicate_only_after_accept():
+    f = GpsFilter(mode="reject")
+    assert f.classify(1, *MOSCOW, T0) is None
+    # пачка не закоммитилась — повторная отправка проходит
+    assert f.classify(1, *MOSCOW, T0) is None
+    f.accept(1, *MOSCOW, T0)
+    assert f.classify(1, *MOSCOW, T0) == DUPLICATE
+
+
+def test_stale_point():
+    f = GpsFilter(mode="reject")
+    assert _accepted(f, 1, *MOSCOW, T0)
+    assert f.classify(1, 55.76, 37.62, T0 - timedelta(minutes=1)) == STALE
+    assert f.classify(1, 55.76, 37.62, T0) == STALE
+
+
+def test_jump_rejected_then_confirmed():
+    f = GpsFilter(mode="reject", max_speed_kmh=200)
+    assert _accepted(f, 1, *MOSCOW, T0)
+    # 630 км за две минуты
+    assert f.classify(1, *SPB, T0 + timedelta(minutes=2)) == JUMP
+    # следующая точка согласована с отвергнутой — выбросом была Москва
+    assert _accepted(f, 1, 59.935, 30.336, T0 + timedelta(minutes=3))
+    assert f.classify(1, *MOSCOW, T0 + timedelta(minutes=4)) == JUMP
+
+
+def test_jump_not_confirmed_by_another_outlier():
+    f = GpsFilter(mode="reject", max_speed_kmh=200)
+    assert _accepted(f, 1, *MOSCOW, T0)
+    assert f.classify(1, *SPB, T0 + timedelta(minutes=2)) == JUMP
+    assert f.classify(1, 43.5855, 39.7231, T0 + timedelta(minutes=3)) == JUMP
+    # обычное движение от Москвы по-прежнему принимается
+    assert _accepted(f, 1, 55.76, 37.62, T0 + timedelta(minutes=4))
+
+
+def test_small_moves_are_not_jumps():
+    f = GpsFilter(mode="reject", max_speed_kmh=200)
+    assert _accepted(f, 1, *MOSCOW, T0)
+    # 300 м за секунду — дрожание GPS, а не прыжок
+    assert _accepted(f, 1, 55.7585, 37.6173, T0 + timedelta(seconds=1))
+
+
+def test_forget_drops_state():
+    f = GpsFilter(mode="reject")
+    assert _accepted(f, 1, *MOSCOW, T0)
+    assert f.classify(1, *SPB, T0 + timedelta(minutes=2)) == JUMP
+    f.forget(1)
+    assert f.classify(1, *SPB, T0 + timedelta(minutes=2)) is None
+
+
+def test_off_mode_accepts_everything():
+    f = GpsFilter(mode="off")
+    assert f.classify(1, 0, 0, T0) is None
+    f.accept(1, *MOSCOW, T0)
+    assert f.stats()["drivers"] == 0
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import db
+from bot import point_writer as point_writer_module
+from bot.point_writer import PointWriter
+from gps_filter import DUPLICATE, GpsFilter
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def gps(monkeypatch):
+    f = GpsFilter(mode="reject")
+    monkeypatch.setattr(point_writer_module, "gps_filter", f)
+    return f
+
+
+def test_failed_batch_does_not_mark_point_as_seen(monkeypatch, gps):
+    calls = []
+
+    async def ingest_points(points, rejected):
+        calls.append(points)
+        if len(calls) == 1:
+            raise RuntimeError("disk I/O error")
+        return [(True, "+79990000001", True) for _ in points]
+
+    monkeypatch.setattr(db, "ingest_points", ingest_points)
+
+    async def scenario():
+        writer = PointWriter(batch_size=10, flush_ms=5)
+        writer.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await writer.ingest(1, 55.75, 37.61, T0)
+            # водитель отправляет ту же точку ещё раз — она пишется
+            retry = await writer.ingest(1, 55.75, 37.61, T0)
+            duplicate = await writer.ingest(1, 55.75, 37.61, T0)
+        finally:
+            await writer.stop()
+        return retry, duplicate
+
+    retry, duplicate = asyncio.run(scenario())
+    assert retry.stored and retry.rejected is None
+    assert not duplicate.stored and duplicate.rejected == DUPLICATE
+
+
+def test_point_of_inactive_driver_is_not_accepted(monkeypatch, gps):
+    async def ingest_points(points, rejected):
+        return [(False, None, False) for _ in points]
+
+    monkeypatch.setattr(db, "ingest_points", ingest_points)
+
+    async def scenario():
+        writer = PointWriter()
+        # без start(): запись сразу, как из скриптов
+        return await writer.ingest(1, 55.75, 37.61, T0)
+
+    assert not asyncio.run(scenario()).stored
+    assert gps.stats()["drivers"] == 0
+
+
+def test_concurrent_points_share_one_commit(monkeypatch, gps):
+    batches = []
+
+    async def ingest_points(points, rejected):
+        batches.append((list(points), list(rejected)))
+        return [(True, f"+7999000000{uid}", True) for uid, *_ in points]
+
+    monkeypatch.setattr(db, "ingest_points", ingest_points)
+
+    async def scenario():
+        writer = PointWriter(batch_size=50, flush_ms=50)
+        writer.start()
+        try:
+            return await asyncio.gather(
+                *(writer.ingest(uid, 55.0 + uid / 100, 37.0, T0) for uid in range(1, 8)),
+                writer.ingest(9, 0, 0, T0),  # invalid — только в аудит
+            )
+        finally:
+            await writer.stop()
+
+    results = asyncio.run(scenario())
+    assert len(batches) == 1
+    points, rejected = batches[0]
+    assert [p[0] for p in points] == list(range(1, 8))
+    assert [r[0] for r in rejected] == [9]
+    assert [r.phone for r in results[:7]] == [f"+7999000000{uid}" for uid in range(1, 8)]
+    assert not results[7].stored and results[7].rejected == "invalid"
+
+
+def test_full_batch_flushes_before_the_window(monkeypatch, gps):
+    batches = []
+
+    async def ingest_points(points, rejected):
+        batches.append(len(points))
+        return [(True, None, True) for _ in points]
+
+    monkeypatch.setattr(db, "ingest_points", ingest_points)
+
+    async def scenario():
+        writer = PointWriter(batch_size=5, flush_ms=10_000)
+        writer.start()
+        try:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await asyncio.gather(*(writer.ingest(uid, 55.0, 37.0 + uid / 100, T0) for uid in range(1, 11)))
+            return loop.time() - started
+        finally:
+            await writer.stop()
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 1
+    assert sum(batches) == 10 and max(batches) <= 5
+
+
+def test_stop_drains_the_queue(monkeypatch, gps):
+    stored = []
+
+    async def ingest_points(points, rejected):
+        stored.extend(points)
+        return [(True, None, True) for _ in points]
+
+    monkeypatch.setattr(db, "ingest_points", ingest_points)
+
+    async def scenario():
+        writer = PointWriter(batch_size=100, flush_ms=10_000)
+        writer.start()
+        pending = [asyncio.ensure_future(writer.ingest(uid, 55.0, 37.0, T0)) for uid in range(1, 4)]
+        await asyncio.sleep(0)
+        await writer.stop()
+        return await asyncio.gather(*pending)
+
+    results = asyncio.run(scenario())
+    assert all(r.stored for r in results)
+    assert len(stored) == 3
@@ -0,0 +1,71 @@
+import asyncio
+import sqlite3
+
+import db
+import db_pool
+
+
+def _legacy_points_db(path, rows):
+    """points.db до миграций: ts — ISO TEXT."""
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE points(id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,"
+        " lat REAL NOT NULL, lon REAL NOT NULL, ts TEXT NOT NULL)"
+    )
+    conn.execute("CREATE TABLE drivers(user_id INTEGER PRIMARY KEY, phone TEXT)")
+    conn.executemany("INSERT INTO points(user_id, lat, lon, ts) VALUES(?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+async def _query(conn, sql):
+    async with conn.execute(sql) as cur:
+        return await cur.fetchall()
+
+
+def test_backfill_then_migrate_keeps_every_row(tmp_path):
+    path = tmp_path / "points.db"
+    rows = [(i % 7, 55.0, 37.0, "garbage" if i % 10 == 0 else "2024-05-01T12:00:00") for i in range(1, 101)]
+    _legacy_points_db(path, rows)
+
+    async def scenario():
+        await db_pool.open_pool(path)
+        try:
+            async with db_pool.connection(path) as conn:
+                assert await db.backfill_points_epoch_ms(conn, batch=30) == 100
+                # пока идёт переход, другой процесс пишет и удаляет старым кодом
+                await conn.execute(
+                    "INSERT INTO points(user_id, lat, lon, ts) VALUES(1, 1, 1, '2024-05-02T00:00:00+03:00')"
+                )
+                await conn.execute("DELETE FROM points WHERE id IN (3, 20)")
+                await conn.commit()
+                await db.migrate(conn)
+                return (
+                    await _query(conn, "SELECT id, ts FROM points ORDER BY id"),
+                    await _query(conn, "SELECT id, ts FROM points_ts_quarantine ORDER BY id"),
+                )
+        finally:
+            await db_pool.close_all()
+
+    points, quarantine = asyncio.run(scenario())
+    ids = [row[0] for row in points]
+    assert 3 not in ids and 101 in ids
+    assert len(points) == 100 - 10 - 1 + 1
+    assert dict(points)[1] == 1714564800000  # наивное время — UTC
+    assert dict(points)[101] == 1714597200000
+    assert [row[0] for row in quarantine] == [i for i in range(10, 101, 10) if i != 20]
+    assert all(row[1] == "garbage" for row in quarantine)
+
+
+def test_new_database_needs_no_backfill(tmp_path):
+    path = tmp_path / "points.db"
+
+    async def scenario():
+        await db_pool.open_pool(path)
+        try:
+            async with db_pool.connection(path) as conn:
+                return await db.backfill_points_epoch_ms(conn)
+        finally:
+            await db_pool.close_all()
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import db
+from bot import reminders
+from bot.reminders import REMIND, ReminderScheduler
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Сообщения, которые планировщик поставил в outbox."""
+    posted = []
+    monkeypatch.setattr(reminders.outbox, "post", lambda method, *args: posted.append(method))
+    return posted
+
+
+def _drivers(monkeypatch, profiles: dict):
+    async def get_driver(user_id):
+        return profiles.get(user_id)
+
+    monkeypatch.setattr(db, "get_driver", get_driver)
+
+
+def _silent_for(hours: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=hours)
+
+
+def test_point_supersedes_earlier_deadlines():
+    s = ReminderScheduler()
+    s.on_point(1, _silent_for(1))
+    first = list(s._heap)
+    s.on_point(1, _silent_for(0))
+    assert first and not any(s._is_current(entry) for entry in first)
+    assert sum(s._is_current(entry) for entry in s._heap) >= 1
+
+
+def test_late_point_does_not_move_deadline_back():
+    s = ReminderScheduler()
+    now = _silent_for(0)
+    s.on_point(1, now)
+    s.on_point(1, now - timedelta(hours=1))
+    assert s._last_ts[1] == now
+
+
+def test_forget_invalidates_heap_entries():
+    s = ReminderScheduler()
+    s.on_point(1, _silent_for(1))
+    entries = list(s._heap)
+    s.forget(1)
+    assert not any(s._is_current(entry) for entry in entries)
+
+
+def test_overdue_active_driver_is_reminded(monkeypatch, sent):
+    _drivers(monkeypatch, {1: ("+79990000001", True)})
+    s = ReminderScheduler()
+    s.on_point(1, _silent_for(reminders.REMIND_HOURS + 0.1))
+    asyncio.run(s._fire_due())
+    assert [m.chat_id for m in sent] == [1]
+    # повтор через POLL_MINUTES уже в куче
+    assert any(s._is_current(e) and e[3] == REMIND for e in s._heap)
+
+
+@pytest.mark.parametrize("profile", [None, ("+79990000001", False)])
+def test_deleted_or_deactivated_driver_is_dropped(monkeypatch, sent, profile):
+    _drivers(monkeypatch, {1: profile} if profile else {})
+    s = ReminderScheduler()
+    s.on_point(1, _silent_for(reminders.REMIND_HOURS + 0.1))
+    asyncio.run(s._fire_due())
+    assert sent == []
+    assert 1 not in s._last_ts
+    assert not any(s._is_current(e) for e in s._heap)
@@ -0,0 +1,88 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from bot import trip_metrics
+from bot.trip_metrics import _new_metrics, advance
+
+T0 = datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc)
+LAT0, LON0 = 55.0, 37.0
+M_PER_DEG_LAT = 111_195.0  # haversine с R = 6 371 км
+
+
+def _drive(metrics, speed_kmh: float, step_s: float, steps: int, start_m: float = 0.0, t0=T0):
+    """Точки каждые step_s секунд при движении на север с постоянной скоростью."""
+    for i in range(1, steps + 1):
+        north_m = start_m + speed_kmh / 3.6 * step_s * i
+        assert advance(metrics, LAT0 + north_m / M_PER_DEG_LAT, LON0, t0 + timedelta(seconds=step_s * i))
+    return metrics
+
+
+def _start():
+    metrics = _new_metrics(1, 1)
+    assert advance(metrics, LAT0, LON0, T0)
+    return metrics
+
+
+def test_highway_speed_and_moving_time():
+    metrics = _drive(_start(), 80, 30, 120)
+    assert metrics["distance_m"] == pytest.approx(80 / 3.6 * 3600, rel=1e-3)
+    assert metrics["moving_s"] == pytest.approx(3600)
+    assert metrics["avg_speed_kmh"] == pytest.approx(80, rel=1e-3)
+
+
+def test_slow_city_driving_is_not_inflated():
+    # 10 км/ч, точка каждые 10 с: 28 м за шаг — меньше TRIP_JITTER_M
+    metrics = _drive(_start(), 10, 10, 360)
+    assert metrics["avg_speed_kmh"] == pytest.approx(10, rel=0.02)
+    assert metrics["moving_s"] == pytest.approx(3600, abs=20)
+    assert metrics["speed_kmh"] == pytest.approx(10, rel=0.05)
+
+
+def test_parking_jitter_adds_no_distance_and_resets_speed():
+    metrics = _drive(_start(), 60, 30, 20)
+    parked_m = metrics["distance_m"]
+    lat, lon = metrics["last_lat"], metrics["last_lon"]
+    t = datetime.fromisoformat(metrics["last_ts"])
+    for i in range(1, 121):
+        jitter = 10 * math.sin(i) / M_PER_DEG_LAT
+        assert advance(metrics, lat + jitter, lon, t + timedelta(seconds=30 * i))
+    assert metrics["distance_m"] == parked_m
+    assert metrics["moving_s"] == pytest.approx(600)
+    assert metrics["speed_kmh"] < 1
+
+
+def test_departure_after_long_stop_counts_as_moving():
+    metrics = _drive(_start(), 60, 30, 20)
+    lat, lon = metrics["last_lat"], metrics["last_lon"]
+    t = datetime.fromisoformat(metrics["last_ts"])
+    # три часа стоянки с точками раз в 5 минут, затем снова 60 км/ч
+    for i in range(1, 37):
+        advance(metrics, lat, lon, t + timedelta(minutes=5 * i))
+    moving_before = metrics["moving_s"]
+    start_m = (lat - LAT0) * M_PER_DEG_LAT
+    _drive(metrics, 60, 30, 20, start_m=start_m, t0=t + timedelta(hours=3))
+    assert metrics["moving_s"] - moving_before == pytest.approx(600, abs=30)
+
+
+def test_older_point_is_ignored():
+    metrics = _drive(_start(), 60, 30, 2)
+    assert not advance(metrics, LAT0, LON0, T0 + timedelta(seconds=30))
+
+
+def test_metrics_without_anchor_ts_fall_back_to_last_ts():
+    metrics = _drive(_start(), 60, 30, 2)
+    metrics["anchor_ts"] = None  # строка trip_metrics до миграции
+    _drive(metrics, 60, 30, 2, start_m=1000, t0=T0 + timedelta(seconds=60))
+    assert metrics["avg_speed_kmh"] == pytest.approx(60, rel=0.01)
+
+
+def test_eta_uses_default_speed_until_enough_movement():
+    metrics = _start()
+    target = (LAT0 + 100_000 / M_PER_DEG_LAT, LON0, 500)
+    advance(metrics, LAT0, LON0, T0 + timedelta(seconds=1), target)
+    assert metrics["remaining_m"] == pytest.approx(100_000 * trip_metrics.ROUTE_FACTOR, rel=1e-3)
+    eta = datetime.fromisoformat(metrics["eta_at"])
+    hours = metrics["remaining_m"] / 1000 / trip_metrics.ETA_DEFAULT_KMH
+    assert eta - (T0 + timedelta(seconds=1)) == pytest.approx(timedelta(hours=hours), abs=timedelta(seconds=1))
@@ -0,0 +1,189 @@
+"""
+Аналитика трека водителя/рейса на массивах NumPy.
+
+Точки рейса читаются одним запросом (db.get_track) прямо в массивы, и
+все показатели считаются векторными операциями над отрезками между
+соседними точками — без цикла Python по точкам:
+
+* пробег и время в движении — по отрезкам быстрее ANALYTICS_STOP_SPEED_KMH;
+* средняя (в движении) и максимальная скорость;
+* стоянки — серии подряд идущих «медленных» отрезков длиннее
+  ANALYTICS_STOP_MIN_MIN минут; центр стоянки — среднее её точек;
+* простой на погрузке/выгрузке — стоянки внутри геозон рейса;
+* ночная езда — время в движении с ANALYTICS_NIGHT_FROM до ANALYTICS_NIGHT_TO
+  по местному времени (TIMEZONE).
+
+Месяц точек раз в 30 секунд (~86 тыс.) считается за миллисекунды;
+основное время — чтение из БД (см. benchmarks/bench_analytics.py).
+"""
+
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import db
+import db_trips
+from geo import EARTH_RADIUS_M
+
+logger = logging.getLogger(__name__)
+
+STOP_SPEED_KMH = float(os.getenv("ANALYTICS_STOP_SPEED_KMH", "5"))
+STOP_MIN_S = float(os.getenv("ANALYTICS_STOP_MIN_MIN", "10")) * 60
+NIGHT_FROM = int(os.getenv("ANALYTICS_NIGHT_FROM", "22"))
+NIGHT_TO = int(os.getenv("ANALYTICS_NIGHT_TO", "6"))
+TZ = ZoneInfo(os.getenv("TIMEZONE", "Europe/Moscow"))
+
+
+def haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Поэлементное расстояние по дуге большого круга, м."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(np.subtract(lon2, lon1)) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """Границы серий True в mask: массив пар [начало, конец) по индексам."""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.column_stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def _iso(ts_s: float) -> str:
+    return datetime.fromtimestamp(ts_s, timezone.utc).isoformat()
+
+
+def analyze(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    ts: np.ndarray,
+    fences: Iterable[dict] = (),
+) -> dict:
+    """
+    Показатели трека.
+
+    Args:
+        lat, lon: Координаты точек (по возрастанию времени)
+        ts: Время точек, секунды epoch UTC
+        fences: Геозоны рейса (строки trip_geofences: kind, lat, lon, radius_m)
+
+    Returns:
+        dict: Пробег, скорости, стоянки, простой в геозонах, ночная езда
+    """
+    fences = list(fences)
+    result = {
+        "points": int(len(ts)),
+        "start": _iso(ts[0]) if len(ts) else None,
+        "end": _iso(ts[-1]) if len(ts) else None,
+        "distance_km": 0.0,
+        "moving_hours": 0.0,
+        "avg_speed_kmh": None,
+        "max_speed_kmh": None,
+        "night_driving_hours": 0.0,
+        "stopped_hours": 0.0,
+        "stops": [],
+        "dwell_minutes": {fence["kind"]: 0.0 for fence in fences},
+    }
+    if len(ts) < 2:
+        return result
+
+    seg_m = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    dt = np.diff(ts)
+    valid = dt > 0
+    speed_kmh = np.zeros_like(seg_m)
+    np.divide(seg_m, dt, out=speed_kmh, where=valid)
+    speed_kmh *= 3.6
+    moving = valid & (speed_kmh >= STOP_SPEED_KMH)
+
+    moving_s = float(dt[moving].sum())
+    distance_m = float(seg_m[moving].sum())
+    result["distance_km"] = round(distance_m / 1000, 2)
+    result["moving_hours"] = round(moving_s / 3600, 2)
+    if moving_s > 0:
+        result["avg_speed_kmh"] = round(distance_m / moving_s * 3.6, 1)
+        result["max_speed_kmh"] = round(float(speed_kmh[moving].max()), 1)
+
+    # ночная езда: местный час середины отрезка
+    offset_s = datetime.fromtimestamp(ts[0], TZ).utcoffset().total_seconds()
+    hour = ((ts[:-1] + dt / 2 + offset_s) % 86400) / 3600
+    if NIGHT_FROM > NIGHT_TO:  # окно через полночь
+        night = (hour >= NIGHT_FROM) | (hour < NIGHT_TO)
+    else:
+        night = (hour >= NIGHT_FROM) & (hour < NIGHT_TO)
+    result["night_driving_hours"] = round(float(dt[moving & night].sum()) / 3600, 2)
+
+    # стоянки: серия медленных отрезков [i, j) охватывает точки i..j
+    runs = _runs(~moving)
+    first, last = runs[:, 0], runs[:, 1]
+    duration = ts[last] - ts[first]
+    long_enough = duration >= STOP_MIN_S
+    first, last, duration = first[long_enough], last[long_enough], duration[long_enough]
+    if len(first):
+        # центры стоянок: суммы точек серий через накопленные суммы
+        csum_lat = np.concatenate(([0.0], np.cumsum(lat)))
+        csum_lon = np.concatenate(([0.0], np.cumsum(lon)))
+        count = last - first + 1
+        c_lat = (csum_lat[last + 1] - csum_lat[first]) / count
+        c_lon = (csum_lon[last + 1] - csum_lon[first]) / count
+
+        # индекс геозоны, в которой стоянка (-1 — вне геозон)
+        at = np.full(len(first), -1)
+        for i, fence in enumerate(fences):
+            inside = haversine_m(fence["lat"], fence["lon"], c_lat, c_lon) <= fence["radius_m"]
+            at[inside & (at < 0)] = i
+            result["dwell_minutes"][fence["kind"]] = round(float(duration[inside].sum()) / 60, 1)
+
+        result["stopped_hours"] = round(float(duration.sum()) / 3600, 2)
+        result["stops"] = [
+            {
+                "lat": round(float(c_lat[i]), 6),
+                "lon": round(float(c_lon[i]), 6),
+                "start": _iso(ts[first[i]]),
+                "end": _iso(ts[last[i]]),
+                "minutes": round(float(duration[i]) / 60, 1),
+                "at": fences[at[i]]["kind"] if at[i] >= 0 else None,
+            }
+            for i in range(len(first))
+        ]
+    return result
+
+
+async def load_track(
+    user_id: int, since: datetime, until: Optional[datetime] = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Точки водителя за период одним запросом: (lat, lon, ts в секундах)."""
+    rows = await db.get_track(user_id, since, until)
+    if not rows:
+        empty = np.empty(0)
+        return empty, empty, empty
+    track = np.array(rows, dtype=np.float64)
+    return track[:, 0], track[:, 1], track[:, 2] / 1000
+
+
+def trip_window(trip: dict) -> tuple[datetime, Optional[datetime]]:
+    """Период рейса: от создания до подтверждения выгрузки (или завершения)."""
+    # метки trips.db — локальное время сервера без зоны
+    since = datetime.fromisoformat(trip["created_at"]).astimezone()
+    end = trip.get("unloading_confirmed_at") or trip.get("completed_at")
+    return since, datetime.fromisoformat(end).astimezone() if end else None
+
+
+async def trip_analytics(trip_id: int) -> Optional[dict]:
+    """Аналитика рейса по трекам его водителя; None — рейса нет."""
+    trip = await db_trips.get_trip(trip_id)
+    if not trip:
+        return None
+    since, until = trip_window(trip)
+    fences: List[dict] = await db_trips.get_trip_geofences(trip_id)
+    if not trip["user_id"]:
+        lat = lon = ts = np.empty(0)
+    else:
+        lat, lon, ts = await load_track(trip["user_id"], since, until)
+    result = analyze(lat, lon, ts, fences)
+    result["trip_id"] = trip_id
+    return result
@@ -0,0 +1,203 @@
+"""
+Упрощение трека рейса (Дуглас — Пекер) для карты и истории.
+
+Сырой трек рейса — десятки тысяч точек; браузеру на любом масштабе
+хватает вершин, которые отличаются хотя бы на пиксель. Допуск
+выбирается по уровню масштаба карты (веб-меркатор):
+
+    допуск, м = TRACK_SIMPLIFY_PX × 156543 × cos(широта) / 2^zoom
+
+Алгоритм работает на массивах NumPy: точки проецируются в локальную
+равнопромежуточную плоскость (метры), а расстояния до хорды на каждом
+шаге считаются одной векторной операцией.
+
+Результат кэшируется по (рейс, zoom). Для незавершённого рейса новые
+точки не сбрасывают кэш: дочитываются только точки новее последней
+учтённой и упрощаются от последней сохранённой вершины — конечные
+точки Дугласа — Пекера всегда остаются в треке, поэтому склейка
+даёт ту же гарантию отклонения не больше допуска.
+"""
+
+import logging
+import math
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+import db
+import db_trips
+from driver_cache import TTLCache, is_missing
+from geo import EARTH_RADIUS_M
+from track_analytics import load_track, trip_window
+
+logger = logging.getLogger(__name__)
+
+SIMPLIFY_PX = float(os.getenv("TRACK_SIMPLIFY_PX", "1.5"))
+CACHE_TTL_S = float(os.getenv("TRACK_CACHE_TTL_S", "3600"))
+CACHE_SIZE = int(os.getenv("TRACK_CACHE_SIZE", "512"))
+MAX_ZOOM = 20
+
+# метров на пиксель на экваторе при zoom 0 (тайлы 256 px)
+_M_PER_PX_Z0 = 2 * math.pi * 6378137 / 256
+
+
+def tolerance_m(zoom: int, lat: float) -> float:
+    """Допуск упрощения для масштаба карты: TRACK_SIMPLIFY_PX пикселей в метрах."""
+    return SIMPLIFY_PX * _M_PER_PX_Z0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def simplify(lat: np.ndarray, lon: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Индексы вершин, оставленных алгоритмом Дугласа — Пекера.
+
+    Args:
+        lat, lon: Координаты трека
+        tolerance: Допустимое отклонение, м
+
+    Returns:
+        np.ndarray: Возрастающие индексы; первая и последняя точки всегда входят
+    """
+    n = len(lat)
+    if n < 3:
+        return np.arange(n)
+
+    # локальная плоскость в метрах: на длине рейса ошибка проекции мала
+    k = math.cos(math.radians(float(lat.mean())))
+    x = np.radians(lon) * EARTH_RADIUS_M * k
+    y = np.radians(lat) * EARTH_RADIUS_M
+
+    # все интервалы между соседними оставленными вершинами обрабатываются
+    # разом: один проход по массиву на уровень рекурсии, а не на вершину
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    candidates = np.arange(1, n - 1)
+    tolerance2 = tolerance * tolerance
+    while len(candidates):
+        kept = np.flatnonzero(keep)
+        pos = np.searchsorted(kept, candidates)
+        first, last = kept[pos - 1], kept[pos]
+        px, py = x[candidates] - x[first], y[candidates] - y[first]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        length2 = dx * dx + dy * dy
+        # расстояние до отрезка (не до прямой): разворот назад не теряется
+        t = np.divide(px * dx + py * dy, length2, out=np.zeros_like(px), where=length2 > 0)
+        np.clip(t, 0.0, 1.0, out=t)
+        dist2 = (px - t * dx) ** 2 + (py - t * dy) ** 2
+
+        # интервалы идут подряд: максимум по каждому через reduceat
+        starts = np.flatnonzero(np.concatenate(([True], pos[1:] != pos[:-1])))
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(candidates))))
+        group_max = np.maximum.reduceat(dist2, starts)
+        split = (group_max > tolerance2)[group]
+        hits = np.flatnonzero(split & (dist2 == group_max[group]))
+        if not len(hits):
+            break
+        # первая точка с максимумом в интервале — как np.argmax в рекурсии
+        hits = hits[np.concatenate(([True], group[hits][1:] != group[hits][:-1]))]
+        keep[candidates[hits]] = True
+        split[hits] = False
+        candidates = candidates[split]
+    return np.flatnonzero(keep)
+
+
+class SimplifiedTrack(NamedTuple):
+    """Упрощённый трек и граница учтённых сырых точек."""
+
+    lat: np.ndarray
+    lon: np.ndarray
+    ts: np.ndarray          # секунды epoch UTC
+    tolerance_m: float
+    raw_points: int
+    until_ms: int           # время последней учтённой сырой точки
+
+
+def _simplified(lat, lon, ts, tolerance: float, raw_points: int) -> SimplifiedTrack:
+    keep = simplify(lat, lon, tolerance)
+    return SimplifiedTrack(
+        lat[keep], lon[keep], ts[keep], tolerance, raw_points,
+        int(round(ts[-1] * 1000)) if len(ts) else 0,
+    )
+
+
+def _extend(track: SimplifiedTrack, lat, lon, ts) -> SimplifiedTrack:
+    """Дописать новые сырые точки: упрощается только хвост от последней вершины."""
+    tail = _simplified(
+        np.concatenate((track.lat[-1:], lat)),
+        np.concatenate((track.lon[-1:], lon)),
+        np.concatenate((track.ts[-1:], ts)),
+        track.tolerance_m,
+        0,
+    )
+    return SimplifiedTrack(
+        np.concatenate((track.lat, tail.lat[1:])),
+        np.concatenate((track.lon, tail.lon[1:])),
+        np.concatenate((track.ts, tail.ts[1:])),
+        track.tolerance_m,
+        track.raw_points + len(ts),
+        tail.until_ms,
+    )
+
+
+class TrackCache:
+    """Упрощённые треки по (trip_id, zoom) с дочитыванием новых точек."""
+
+    def __init__(self, ttl: float = CACHE_TTL_S, maxsize: int = CACHE_SIZE):
+        # записи неизменяемые: параллельные запросы не портят друг другу трек
+        self._tracks = TTLCache("tracks", ttl=ttl, maxsize=maxsize)
+        self.extended = 0
+
+    async def get(self, trip_id: int, zoom: int) -> Optional[SimplifiedTrack]:
+        """Упрощённый трек рейса для масштаба zoom; None — рейса нет."""
+        zoom = min(max(int(zoom), 0), MAX_ZOOM)
+        trip = await db_trips.get_trip(trip_id)
+        if not trip:
+            return None
+        empty = np.empty(0)
+        if not trip["user_id"]:
+            return SimplifiedTrack(empty, empty, empty, 0.0, 0, 0)
+        since, until = trip_window(trip)
+        key = (trip_id, zoom)
+
+        track = self._tracks.get(key)
+        if is_missing(track):
+            lat, lon, ts = await load_track(trip["user_id"], since, until)
+            tolerance = tolerance_m(zoom, float(lat[0]) if len(lat) else 0.0)
+            track = _simplified(lat, lon, ts, tolerance, len(ts))
+            if not len(ts):
+                track = track._replace(until_ms=db.to_epoch_ms(since) - 1)
+            self._tracks.set(key, track)
+            return track
+
+        # новые точки: сверяемся с последней позицией водителя (одна строка)
+        last = await db.get_last_point(trip["user_id"])
+        if last is None:
+            return track
+        newest_ms = db.to_epoch_ms(last["ts"])
+        if until is not None:
+            newest_ms = min(newest_ms, db.to_epoch_ms(until) - 1)
+        if newest_ms <= track.until_ms:
+            return track
+        lat, lon, ts = await load_track(
+            trip["user_id"], db.from_epoch_ms(track.until_ms + 1), db.from_epoch_ms(newest_ms + 1)
+        )
+        if not len(ts):
+            # после конца рейса точек нет в окне — запомним, что проверили
+            track = track._replace(until_ms=newest_ms)
+        elif not track.raw_points:
+            track = _simplified(lat, lon, ts, tolerance_m(zoom, float(lat[0])), len(ts))
+        else:
+            track = _extend(track, lat, lon, ts)
+            self.extended += 1
+        self._tracks.set(key, track)
+        return track
+
+    def invalidate(self, trip_id: int) -> None:
+        for zoom in range(MAX_ZOOM + 1):
+            self._tracks.invalidate((trip_id, zoom))
+
+    def stats(self) -> dict:
+        return {**self._tracks.stats(), "extended": self.extended}
+
+
+track_cache = TrackCache()
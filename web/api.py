@@ -1,16 +1,23 @@
+import asyncio
 import os
 import secrets
-from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException, Request, Header, Depends, Cookie, Response
-from fastapi.responses import HTMLResponse
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, HTTPException, Request, Header, Depends, Cookie, Query
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from typing import Optional
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-from db import get_last_point, init, get_last_points, get_phone
-from web.api_trips import router as trips_router
+import change_feed
+import db_pool
+import db_trips
+import db_documents
+import driver_cache
+import db
+from db import get_last_point, init, drivers_within, drivers_in_bbox
+from web.conditional import Conditional
 
 # Хранилище активных сессий (в production использовать Redis)
 active_sessions = {}  # {session_id: {'expires': datetime, 'user_id': int}}
@@ -21,9 +28,6 @@ app = FastAPI()
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# Подключаем роутер для рейсов
-app.include_router(trips_router)
-
 # FIX: Добавляем секретный токен для доступа к API
 # Установите API_SECRET_TOKEN в .env файле
 API_SECRET_TOKEN = os.getenv("API_SECRET_TOKEN", "")
@@ -78,9 +82,54 @@ def verify_token(
     raise HTTPException(status_code=403, detail="Неверный токен или сессия истекла")
 
 
+# Подключаем роутер для рейсов (после verify_token: api_trips импортирует его отсюда)
+from web.api_trips import router as trips_router  # noqa: E402
+from web.api_track import router as track_router  # noqa: E402
+from web.api_live import live_hub, router as live_router  # noqa: E402
+from web.api_fleet import fleet_index, router as fleet_router  # noqa: E402
+
+app.include_router(trips_router)
+app.include_router(track_router)
+app.include_router(live_router)
+app.include_router(fleet_router)
+
+
+from track_simplify import track_cache  # noqa: E402
+
+# подписчики ленты изменений, сбрасывающие кэши этого процесса
+_followers: list[asyncio.Task] = []
+
+
+def _on_driver_change(change: change_feed.Change) -> None:
+    driver_cache.invalidate(change.user_id)
+
+
+def _on_trip_change(change: change_feed.Change) -> None:
+    # статус меняет окно трека рейса, переназначение — активный рейс водителя
+    driver_cache.invalidate_trip(change.user_id)
+    track_cache.invalidate(change.entity_id)
+
+
 @app.on_event("startup")
 async def startup() -> None:
     await init()
+    await db_trips.init()
+    await db_documents.init_documents_db()
+    await change_feed.start_all()
+    _followers.extend([
+        asyncio.create_task(change_feed.follow(change_feed.points_feed, _on_driver_change, {"driver"})),
+        asyncio.create_task(change_feed.follow(change_feed.trips_feed, _on_trip_change, {"trip"})),
+    ])
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await live_hub.stop()
+    await fleet_index.stop()
+    await change_feed.stop_all()
+    await asyncio.gather(*_followers)
+    _followers.clear()
+    await db_pool.close_all()
 
 
 templates = Jinja2Templates(directory="templates")
@@ -93,43 +142,48 @@ async def healthz():
 
 
 @app.get("/api/last/{user_id}")
-async def api_last(user_id: int, _: bool = Depends(verify_token)):
+async def api_last(
+    user_id: int,
+    cond: Conditional = Depends(),
+    _: bool = Depends(verify_token),
+):
     """
     Возвращает последнее местоположение водителя.
-    
+
+    Отдаёт ETag: повторный запрос с If-None-Match получает 304, если
+    позиция и рейс не менялись (резервный опрос карты, опрос партнёров).
+
     ТРЕБУЕТ АВТОРИЗАЦИИ!
     Добавьте заголовок: Authorization: Bearer <ваш_токен>
     """
     point = await get_last_point(user_id)
     if not point:
         raise HTTPException(status_code=404, detail="Point not found")
+    # метрики активного рейса для подписи на карте
+    trip_id = await db_documents.get_active_trip(user_id)
+    trip = await db_trips.get_trip_version(trip_id) if trip_id else None
+    not_modified = cond.check(point["id"], trip_id or 0, trip["version"] if trip else 0)
+    if not_modified:
+        return not_modified
+    metrics = await db_trips.get_trip_metrics(trip_id) if trip_id else None
     return {
         "lat": point["lat"],
         "lon": point["lon"],
         "ts": point["ts"].isoformat(),
+        "trip": metrics,
     }
 
 
-@app.get("/map/{user_id}", response_class=HTMLResponse)
-async def map_view(
-    request: Request,
-    response: Response,
-    user_id: int,
-    token: Optional[str] = None
-):
+def _open_session(request: Request, token: Optional[str], template: str, context: dict) -> HTMLResponse:
     """
-    Отображает карту с местоположением водителя.
-
-    Использование:
-    /map/{user_id}?token=<ваш_токен>
+    Проверить токен из query, создать сессию и отдать страницу карты.
 
-    После проверки токена создается безопасная сессия (HttpOnly cookie).
+    Сессия передаётся HttpOnly cookie: JavaScript страницы токена не видит.
     """
-    # Проверка токена через query parameter
     if token != API_SECRET_TOKEN:
         raise HTTPException(
             status_code=403,
-            detail="Доступ запрещен. Используйте: /map/{user_id}?token=<ваш_токен>"
+            detail=f"Доступ запрещен. Используйте: {request.url.path}?token=<ваш_токен>"
         )
 
     # Создаем безопасную сессию
@@ -137,11 +191,14 @@ async def map_view(
     expires = datetime.now() + timedelta(hours=24)  # Сессия действует 24 часа
     active_sessions[session_id] = {
         'expires': expires,
-        'user_id': user_id
+        'user_id': context.get("user_id")
     }
 
+    # ВАЖНО: НЕ передаем api_token в шаблон!
+    html_response = templates.TemplateResponse(template, {"request": request, **context})
+
     # Устанавливаем HttpOnly cookie (защита от XSS)
-    response.set_cookie(
+    html_response.set_cookie(
         key="session_id",
         value=session_id,
         httponly=True,  # Защита от JavaScript доступа
@@ -150,43 +207,150 @@ async def map_view(
         max_age=86400   # 24 часа
     )
 
-    # ВАЖНО: НЕ передаем api_token в шаблон!
-    html_response = templates.TemplateResponse(
-        "map.html",
-        {
-            "request": request,
-            "user_id": user_id,
-            # api_token больше НЕ передается
-        },
-    )
+    return html_response
 
-    # Копируем cookie в ответ
-    html_response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        secure=False,
-        samesite="lax",
-        max_age=86400
-    )
 
-    return html_response
+@app.get("/map/{user_id}", response_class=HTMLResponse)
+async def map_view(
+    request: Request,
+    user_id: int,
+    token: Optional[str] = None
+):
+    """
+    Отображает карту с местоположением водителя.
+
+    Использование:
+    /map/{user_id}?token=<ваш_токен>
+
+    После проверки токена создается безопасная сессия (HttpOnly cookie).
+    """
+    return _open_session(request, token, "map.html", {"user_id": user_id})
+
+
+@app.get("/map", response_class=HTMLResponse)
+async def fleet_map_view(
+    request: Request,
+    token: Optional[str] = None
+):
+    """
+    Карта всего парка для диспетчеров (кластеры на мелком масштабе).
+
+    Использование:
+    /map?token=<ваш_токен>
+    """
+    return _open_session(request, token, "fleet.html", {})
+
+
+def _position(row: dict) -> dict:
+    result = {
+        "user_id": row["user_id"],
+        "phone": row["phone"],
+        "lat": row["lat"],
+        "lon": row["lon"],
+        "last_update": row["ts"].isoformat(),
+    }
+    if "distance_km" in row:
+        result["distance_km"] = round(row["distance_km"], 3)
+    return result
+
+
+@app.get("/api/drivers/nearby")
+async def drivers_nearby(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(50, gt=0, le=5000),
+    _: bool = Depends(verify_token),
+):
+    """
+    Активные водители в радиусе radius_km от точки, ближайшие первыми.
+
+    Пример: /api/drivers/nearby?lat=55.75&lon=37.62&radius_km=50
+    """
+    rows = await drivers_within(lat, lon, radius_km)
+    return {"drivers": [_position(row) for row in rows]}
+
+
+@app.get("/api/drivers/bbox")
+async def drivers_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    _: bool = Depends(verify_token),
+):
+    """
+    Активные водители в прямоугольнике (например, видимая область карты).
+
+    min_lon > max_lon означает прямоугольник через 180-й меридиан.
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+    rows = await drivers_in_bbox(min_lat, min_lon, max_lat, max_lon)
+    return {"drivers": [_position(row) for row in rows]}
+
+
+DRIVER_FIELDS = ("user_id", "phone", "active", "lat", "lon", "last_update")
+DRIVERS_PAGE_MAX = int(os.getenv("DRIVERS_PAGE_MAX", "5000"))
 
 
 @app.get("/api/drivers")
-async def list_drivers(_: bool = Depends(verify_token)):
-    """
-    Возвращает список всех активных водителей с последними координатами.
-    """
-    points_list = await get_last_points()
-    
-    result = []
-    for user_id, last_ts in points_list:
-        phone = await get_phone(user_id)
-        result.append({
-            "user_id": user_id,
-            "phone": phone,
-            "last_update": last_ts.isoformat(),
-        })
-    
-    return {"drivers": result}
\ No newline at end of file
+async def list_drivers(
+    active_only: bool = Query(False, description="Только с включённым отслеживанием"),
+    stale_hours: Optional[float] = Query(None, gt=0, description="Без точек дольше N часов"),
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lon: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lon: Optional[float] = Query(None, ge=-180, le=180),
+    fields: Optional[str] = Query(None, description="Поля через запятую: " + ",".join(DRIVER_FIELDS)),
+    after: Optional[int] = Query(None, description="Курсор: user_id последнего водителя страницы"),
+    limit: Optional[int] = Query(None, ge=1, le=DRIVERS_PAGE_MAX, description="Размер страницы"),
+    cond: Conditional = Depends(),
+    _: bool = Depends(verify_token),
+):
+    """
+    Водители с последними координатами — одним запросом.
+
+    Фильтры: active_only, stale_hours, прямоугольник min_lat/min_lon/max_lat/max_lon
+    (все четыре; min_lon > max_lon — через 180-й меридиан). С limit ответ
+    содержит курсор next для параметра after. ETag меняется с любой новой
+    точкой или изменением водителя — неизменный парк отдаёт 304.
+
+    Пример: /api/drivers?active_only=true&fields=user_id,lat,lon&limit=1000
+    """
+    corners = (min_lat, min_lon, max_lat, max_lon)
+    bbox = None
+    if any(c is not None for c in corners):
+        if any(c is None for c in corners):
+            raise HTTPException(status_code=400, detail="bbox: нужны все четыре min_lat, min_lon, max_lat, max_lon")
+        if min_lat > max_lat:
+            raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+        bbox = corners
+    selected = DRIVER_FIELDS
+    if fields:
+        selected = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = set(selected) - set(DRIVER_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"fields: неизвестные поля {', '.join(sorted(unknown))}")
+
+    # версия ленты изменений points.db — дешевле самого списка
+    version = [await db.get_change_seq()]
+    stale_before = None
+    if stale_hours is not None:
+        # «устаревшие» меняются и без новых данных — версия живёт минуту
+        now = datetime.now(timezone.utc)
+        stale_before = now - timedelta(hours=stale_hours)
+        version.append(int(now.timestamp()) // 60)
+    not_modified = cond.check(*version)
+    if not_modified:
+        return not_modified
+
+    rows = await db.list_drivers(
+        active_only=active_only, stale_before=stale_before, bbox=bbox, after=after, limit=limit
+    )
+    drivers = []
+    for row in rows:
+        row["last_update"] = row.pop("ts").isoformat()
+        drivers.append({name: row[name] for name in selected})
+    next_cursor = rows[-1]["user_id"] if limit is not None and len(rows) == limit else None
+    # готовые dict из примитивов: без jsonable_encoder на десятках тысяч строк
+    return JSONResponse({"drivers": drivers, "next": next_cursor}, headers=cond.headers)
@@ -0,0 +1,296 @@
+"""
+Карта всего парка: GeoJSON последних позиций с кластеризацией на сервере.
+
+FleetIndex держит в памяти последние позиции всех водителей в массивах
+NumPy и обновляет их из ленты изменений points.db (change_feed): новая
+точка меняет одну ячейку массива, а не перечитывает парк. Запрос
+/api/fleet.geojson?bbox=&zoom= — это маска по массивам и, на мелком
+масштабе, группировка по сетке:
+
+* сетка — квадраты FLEET_CLUSTER_PX пикселей веб-меркатора на текущем
+  zoom, привязанные к миру, а не к окну: при сдвиге карты кластеры не
+  прыгают;
+* начиная с FLEET_CLUSTER_MAX_ZOOM отдаются отдельные водители — если
+  их в окне не больше FLEET_MAX_FEATURES, иначе снова кластеры;
+* кластер из одного водителя отдаётся как водитель.
+
+Окно 1920×1080 вмещает ~32×18 ячеек, поэтому ответ — сотни объектов,
+сколько бы тысяч машин ни было в окне (см. benchmarks/bench_fleet.py).
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+import db
+from change_feed import Change, follow, points_feed
+from web.api import verify_token
+from web.conditional import Conditional
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["fleet"])
+
+CLUSTER_PX = float(os.getenv("FLEET_CLUSTER_PX", "60"))
+CLUSTER_MAX_ZOOM = int(os.getenv("FLEET_CLUSTER_MAX_ZOOM", "13"))
+MAX_FEATURES = int(os.getenv("FLEET_MAX_FEATURES", "500"))
+# телефон в ленте не передаётся: профили перечитываются с задержкой
+RELOAD_DELAY_S = 5.0
+MAX_ZOOM = 20
+MERCATOR_MAX_LAT = 85.05112878
+
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[BBox]:
+    """«west,south,east,north» (как Leaflet toBBoxString) → кортеж; 400 при ошибке."""
+    if not bbox:
+        return None
+    try:
+        west, south, east, north = (float(x) for x in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox: ожидается west,south,east,north")
+    if south > north:
+        raise HTTPException(status_code=400, detail="bbox: south must not exceed north")
+    if east - west >= 360:
+        return None  # весь мир по долготе
+    # карта, прокрученная за 180-й меридиан, даёт долготы вне [-180, 180)
+    west = (west + 180) % 360 - 180
+    east = (east + 180) % 360 - 180
+    return west, south, east, north
+
+
+def mercator_px(lat: np.ndarray, lon: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Пиксельные координаты веб-меркатора (тайлы 256 px) на масштабе zoom."""
+    scale = 256 * 2 ** zoom
+    x = (lon + 180) / 360 * scale
+    s = np.sin(np.radians(np.clip(lat, -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT)))
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale
+    return x, y
+
+
+class FleetIndex:
+    """Последние позиции парка в памяти процесса, обновляемые из ленты."""
+
+    def __init__(self, capacity: int = 1024):
+        self._index: Dict[int, int] = {}   # user_id → строка массивов
+        self._n = 0
+        self._alloc(capacity)
+        self._phones: list = []
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._reload_at: Optional[float] = None
+        # version считается с нуля в каждом процессе: epoch отличает
+        # ETag после перезапуска веба
+        self.epoch = time.time_ns() // 1_000_000
+        self.version = 0
+        self.updates = 0
+
+    def _alloc(self, capacity: int) -> None:
+        old = self._n
+        arrays = {
+            "_ids": np.zeros(capacity, dtype=np.int64),
+            "_lat": np.zeros(capacity),
+            "_lon": np.zeros(capacity),
+            "_ts": np.zeros(capacity, dtype=np.int64),
+            "_active": np.zeros(capacity, dtype=bool),
+            "_present": np.zeros(capacity, dtype=bool),
+        }
+        for name, array in arrays.items():
+            if old:
+                array[:old] = getattr(self, name)[:old]
+            setattr(self, name, array)
+
+    def _row(self, user_id: int) -> int:
+        row = self._index.get(user_id)
+        if row is None:
+            if self._n == len(self._ids):
+                self._alloc(2 * len(self._ids))
+            row = self._n
+            self._n += 1
+            self._index[user_id] = row
+            self._ids[row] = user_id
+            self._phones.append(None)
+            # водители без строки drivers считаются активными, как в db.is_active
+            self._active[row] = True
+        return row
+
+    def apply(self, user_id: int, lat: float, lon: float, ts_ms: int) -> None:
+        """Новая точка водителя; более старая, чем известная, игнорируется."""
+        row = self._row(user_id)
+        if self._present[row] and self._ts[row] > ts_ms:
+            return
+        self._lat[row], self._lon[row], self._ts[row] = lat, lon, ts_ms
+        self._present[row] = True
+        self.version += 1
+        self.updates += 1
+
+    def _on_change(self, change: Change) -> None:
+        if change.kind == "point":
+            self.apply(change.user_id, change.data["lat"], change.data["lon"], change.data["ts"])
+            return
+        row = self._index.get(change.user_id)
+        if change.data.get("deleted"):
+            if row is not None:
+                self._present[row] = False
+        elif row is not None:
+            self._active[row] = bool(change.data["active"])
+        self.version += 1
+        if self._reload_at is None:
+            self._reload_at = time.monotonic() + RELOAD_DELAY_S
+
+    async def _load(self) -> None:
+        self._reload_at = None
+        rows = await db.list_drivers()
+        seen = set()
+        for row in rows:
+            i = self._row(row["user_id"])
+            seen.add(row["user_id"])
+            self._phones[i] = row["phone"]
+            self._active[i] = row["active"] is not False
+            ts_ms = db.to_epoch_ms(row["ts"])
+            if not self._present[i] or self._ts[i] <= ts_ms:
+                self._lat[i], self._lon[i], self._ts[i] = row["lat"], row["lon"], ts_ms
+            self._present[i] = True
+        # удалённые из drivers/points за время, пока лента не читалась
+        for user_id, i in self._index.items():
+            if user_id not in seen:
+                self._present[i] = False
+        self.version += 1
+        logger.info("Fleet index loaded: %s drivers", len(rows))
+
+    async def ensure(self) -> None:
+        """Запустить подписку на ленту и загрузить парк (один раз)."""
+        if self._task is not None and self._reload_at is None:
+            return
+        async with self._lock:
+            if self._task is None:
+                # сначала подписка, потом загрузка: точки между ними не теряются
+                self._task = asyncio.create_task(
+                    follow(points_feed, self._on_change, kinds={"point", "driver"}), name="fleet-index"
+                )
+                await self._load()
+            elif self._reload_at is not None and time.monotonic() >= self._reload_at:
+                await self._load()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _select(self, bbox: Optional[BBox], active_only: bool) -> np.ndarray:
+        n = self._n
+        mask = self._present[:n].copy()
+        if active_only:
+            mask &= self._active[:n]
+        if bbox is not None:
+            west, south, east, north = bbox
+            lat, lon = self._lat[:n], self._lon[:n]
+            mask &= (lat >= south) & (lat <= north)
+            if west <= east:
+                mask &= (lon >= west) & (lon <= east)
+            else:
+                mask &= (lon >= west) | (lon <= east)
+        return np.flatnonzero(mask)
+
+    def _driver(self, row: int) -> dict:
+        return {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(self._lon[row]), float(self._lat[row])]},
+            "properties": {
+                "user_id": int(self._ids[row]),
+                "phone": self._phones[row],
+                "last_update": db.from_epoch_ms(int(self._ts[row])).isoformat(),
+            },
+        }
+
+    def geojson(self, bbox: Optional[BBox], zoom: int, active_only: bool = True) -> dict:
+        """FeatureCollection водителей в окне: отдельные точки или кластеры."""
+        rows = self._select(bbox, active_only)
+        clustered = len(rows) > 0 and (zoom < CLUSTER_MAX_ZOOM or len(rows) > MAX_FEATURES)
+        if not clustered:
+            features = [self._driver(row) for row in rows]
+        else:
+            features = self._clusters(rows, zoom)
+        return {
+            "type": "FeatureCollection",
+            "features": features,
+            "total": int(len(rows)),
+            "clustered": bool(clustered),
+        }
+
+    def _clusters(self, rows: np.ndarray, zoom: int) -> list:
+        lat, lon = self._lat[rows], self._lon[rows]
+        x, y = mercator_px(lat, lon, zoom)
+        cell = (np.floor(x / CLUSTER_PX).astype(np.int64) << 32) | np.floor(y / CLUSTER_PX).astype(np.int64)
+        _, group, count = np.unique(cell, return_inverse=True, return_counts=True)
+        c_lat = np.bincount(group, weights=lat) / count
+        c_lon = np.bincount(group, weights=lon) / count
+        # границы кластеров — для приближения по щелчку
+        order = np.argsort(group, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        bounds = [
+            np.minimum.reduceat(lon[order], starts), np.minimum.reduceat(lat[order], starts),
+            np.maximum.reduceat(lon[order], starts), np.maximum.reduceat(lat[order], starts),
+        ]
+
+        features = []
+        for g in range(len(count)):
+            if count[g] == 1:
+                features.append(self._driver(int(rows[order[starts[g]]])))
+                continue
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(float(c_lon[g]), 6), round(float(c_lat[g]), 6)]},
+                "properties": {
+                    "cluster": True,
+                    "count": int(count[g]),
+                    "bbox": [round(float(b[g]), 6) for b in bounds],
+                },
+            })
+        return features
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "drivers": int(self._present[:self._n].sum()),
+            "updates": self.updates,
+            "version": self.version,
+        }
+
+
+fleet_index = FleetIndex()
+
+
+@router.get("/api/fleet.geojson")
+async def fleet_geojson(
+    bbox: Optional[str] = Query(None, description="west,south,east,north; без него — весь мир"),
+    zoom: int = Query(5, ge=0, le=MAX_ZOOM),
+    active_only: bool = Query(True, description="Только с включённым отслеживанием"),
+    cond: Conditional = Depends(),
+    _: bool = Depends(verify_token),
+):
+    """
+    Последние позиции парка в окне карты (GeoJSON FeatureCollection).
+
+    Водитель — properties {user_id, phone, last_update}; кластер —
+    {cluster: true, count, bbox}. total — водителей в окне. ETag — версия
+    индекса: пока парк не менялся, повторный запрос получает 304.
+    Требует авторизации.
+    """
+    window = parse_bbox(bbox)
+    await fleet_index.ensure()
+    not_modified = cond.check("fleet", fleet_index.epoch, fleet_index.version)
+    if not_modified:
+        return not_modified
+    return JSONResponse(fleet_index.geojson(window, zoom, active_only), headers=cond.headers)
@@ -0,0 +1,189 @@
+"""
+Живые позиции водителей по Server-Sent Events.
+
+Раньше каждая открытая карта раз в 10 секунд запрашивала /api/last —
+360 запросов в час на вкладку, каждый со своим обращением к БД. Теперь
+страница держит одно SSE-соединение /api/live?drivers=1,2,3, а новые
+позиции раздаёт LiveHub:
+
+* на каждого водителя — одно множество подписчиков, сколько бы вкладок
+  за ним ни следило;
+* новые точки приходят из ленты изменений points.db (change_feed):
+  бот пишет точку — через доли секунды она у подписчиков, без опроса
+  БД на каждого водителя или вкладку; без подписчиков лента не читается
+  этим хабом;
+* очередь подписчика ограничена: медленный клиент теряет старые
+  позиции, а не копит их (важна только последняя).
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+import db
+from change_feed import Change, follow, points_feed
+from web.api import verify_token
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/live", tags=["live"])
+
+KEEPALIVE_S = float(os.getenv("LIVE_KEEPALIVE_S", "15"))
+MAX_DRIVERS = int(os.getenv("LIVE_MAX_DRIVERS", "500"))
+QUEUE_SIZE = 64
+
+
+class LiveHub:
+    """Раздача новых позиций подписчикам: одна выборка на всех."""
+
+    def __init__(self):
+        # user_id → очереди подписчиков
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        # user_id → последняя разосланная позиция
+        self._last: Dict[int, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+
+    def subscribe(self, user_ids: Iterable[int]) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        for user_id in user_ids:
+            self._subscribers.setdefault(user_id, set()).add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(
+                follow(points_feed, self._on_change, kinds={"point"}), name="live-hub"
+            )
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, user_ids: Iterable[int]) -> None:
+        for user_id in user_ids:
+            queues = self._subscribers.get(user_id)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+                self._last.pop(user_id, None)
+        if not self._subscribers and self._task is not None:
+            # смотреть больше некому — отписаться от ленты
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, position: dict) -> None:
+        """Новая позиция водителя: разослать, если она новее разосланной."""
+        user_id = position["user_id"]
+        last = self._last.get(user_id)
+        if last is not None and last["ts"] >= position["ts"]:
+            return
+        self._last[user_id] = position
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()  # медленный клиент: старая позиция не нужна
+            queue.put_nowait(position)
+        self.published += 1
+
+    async def snapshot(self, user_ids: List[int]) -> List[dict]:
+        """Текущие позиции водителей — первое, что получает новый подписчик."""
+        missing = [user_id for user_id in user_ids if user_id not in self._last]
+        if missing:
+            for row in await db.get_last_positions(missing):
+                # уже разосланное из ленты не перезаписываем более старым
+                if row["user_id"] in self._subscribers:
+                    self._last.setdefault(row["user_id"], row)
+        return [self._last[user_id] for user_id in user_ids if user_id in self._last]
+
+    def _on_change(self, change: Change) -> None:
+        if change.user_id in self._subscribers:
+            self.publish({
+                "user_id": change.user_id,
+                "lat": change.data["lat"],
+                "lon": change.data["lon"],
+                "ts": db.from_epoch_ms(change.data["ts"]),
+            })
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "drivers": len(self._subscribers),
+            "subscribers": len({q for queues in self._subscribers.values() for q in queues}),
+            "published": self.published,
+        }
+
+
+live_hub = LiveHub()
+
+
+def _event(position: dict) -> str:
+    data = json.dumps({
+        "user_id": position["user_id"],
+        "lat": position["lat"],
+        "lon": position["lon"],
+        "ts": position["ts"].isoformat(),
+    })
+    return f"event: position\ndata: {data}\n\n"
+
+
+async def _stream(user_ids: List[int]) -> AsyncIterator[str]:
+    queue = live_hub.subscribe(user_ids)
+    try:
+        # клиент переподключится через 5 с, если соединение оборвётся
+        yield "retry: 5000\n\n"
+        # user_id → время последней отправленной позиции: лента могла успеть
+        # положить в очередь ту же точку, что пришла в снимке
+        sent = {}
+        for position in await live_hub.snapshot(user_ids):
+            sent[position["user_id"]] = position["ts"]
+            yield _event(position)
+        while True:
+            try:
+                position = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                # комментарий SSE: держит соединение через прокси
+                yield ": keepalive\n\n"
+                continue
+            last_sent = sent.get(position["user_id"])
+            if last_sent is not None and position["ts"] <= last_sent:
+                continue
+            sent[position["user_id"]] = position["ts"]
+            yield _event(position)
+    finally:
+        live_hub.unsubscribe(queue, user_ids)
+
+
+@router.get("")
+async def live_positions(
+    drivers: str = Query(..., description="ID водителей через запятую"),
+    _: bool = Depends(verify_token),
+):
+    """
+    Поток новых позиций водителей (text/event-stream).
+
+    Событие position: {"user_id", "lat", "lon", "ts"}. Сразу после
+    подключения приходят текущие позиции. Требует авторизации.
+    """
+    try:
+        user_ids = sorted({int(x) for x in drivers.split(",") if x.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="drivers: ожидаются ID через запятую")
+    if not user_ids:
+        raise HTTPException(status_code=400, detail="drivers: пустой список")
+    if len(user_ids) > MAX_DRIVERS:
+        raise HTTPException(status_code=400, detail=f"drivers: не больше {MAX_DRIVERS}")
+
+    return StreamingResponse(
+        _stream(user_ids),
+        media_type="text/event-stream",
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-store"},
+    )
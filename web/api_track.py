@@ -0,0 +1,152 @@
+"""
+Потоковая выдача истории трека (NDJSON / GeoJSON).
+
+Строки читаются из points страницами по индексу (user_id, ts)
+(db.iter_track) и сразу уходят клиенту через StreamingResponse — список
+всех точек в памяти не собирается, а первая страница маленькая, поэтому
+неделя трека начинает рисоваться почти сразу.
+
+Продолжение с места обрыва — курсор «ts_ms:id» последней полученной
+точки в параметре after. С limit выдача обрывается после limit точек,
+и последним элементом идёт курсор next.
+
+simplify=<метры> упрощает трек по Дугласу — Пекеру постранично: каждая
+страница упрощается от последней оставленной вершины предыдущей, так
+что отклонение не превышает допуска, а поток не ждёт конца трека.
+"""
+
+import os
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+import db
+from track_simplify import simplify
+from web.api import verify_token
+
+router = APIRouter(prefix="/api/track", tags=["track"])
+
+DEFAULT_HOURS = float(os.getenv("TRACK_DEFAULT_HOURS", "24"))
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "geojson": "application/geo+json",
+}
+
+_Row = tuple[int, float, float, int]
+
+
+def parse_after(after: Optional[str]) -> Optional[tuple[int, int]]:
+    """Курсор «ts_ms:id» → (ts_ms, id); 400 при неверном формате."""
+    if not after:
+        return None
+    try:
+        ts_ms, point_id = after.split(":")
+        return int(ts_ms), int(point_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="after: ожидается курсор ts_ms:id")
+
+
+def _ndjson(rows: list[_Row], first: bool) -> str:
+    return "".join(
+        f'{{"id":{id_},"lat":{lat!r},"lon":{lon!r},"ts":{ts}}}\n' for id_, lat, lon, ts in rows
+    )
+
+
+def _geojson(rows: list[_Row], first: bool) -> str:
+    text = ",".join(
+        '{"type":"Feature","geometry":{"type":"Point","coordinates":'
+        f'[{lon!r},{lat!r}]}},"properties":{{"id":{id_},"ts":{ts}}}}}'
+        for id_, lat, lon, ts in rows
+    )
+    return text if first or not text else "," + text
+
+
+async def _stream(
+    user_id: int,
+    since: datetime,
+    until: Optional[datetime],
+    fmt: str,
+    simplify_m: float,
+    after: Optional[tuple[int, int]],
+    limit: Optional[int],
+) -> AsyncIterator[str]:
+    encode = _ndjson if fmt == "ndjson" else _geojson
+    if fmt == "geojson":
+        yield '{"type":"FeatureCollection","features":['
+
+    read = 0
+    first = True
+    last: Optional[_Row] = None
+    carry: Optional[_Row] = None  # последняя оставленная вершина — ждёт следующей страницы
+    truncated = False
+    async with aclosing(db.iter_track(user_id, since, until, after)) as pages:
+        async for page in pages:
+            if limit is not None and read + len(page) >= limit:
+                page = page[:limit - read]
+                truncated = True
+            read += len(page)
+            last = page[-1]
+            rows = page
+            if simplify_m > 0:
+                if carry is not None:
+                    rows = [carry, *page]
+                track = np.array(rows)
+                kept = [rows[i] for i in simplify(track[:, 1], track[:, 2], simplify_m)]
+                carry, rows = kept[-1], kept[:-1]
+            if rows:
+                yield encode(rows, first)
+                first = False
+            if truncated:
+                break
+
+    if carry is not None:
+        yield encode([carry], first)
+    cursor = f"{last[3]}:{last[0]}" if truncated and last else None
+    if fmt == "geojson":
+        yield "]" + (f',"next":"{cursor}"' if cursor else "") + "}"
+    elif cursor:
+        yield f'{{"next":"{cursor}"}}\n'
+
+
+def stream_track(
+    user_id: int,
+    since: datetime,
+    until: Optional[datetime] = None,
+    fmt: str = "ndjson",
+    simplify_m: float = 0,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> StreamingResponse:
+    """StreamingResponse с точками водителя за период."""
+    return StreamingResponse(
+        _stream(user_id, since, until, fmt, simplify_m, parse_after(after), limit),
+        media_type=MEDIA_TYPES[fmt],
+        # nginx не должен копить поток в буфере
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-store"},
+    )
+
+
+@router.get("/{user_id}")
+async def get_track(
+    user_id: int,
+    since: Optional[datetime] = Query(None, alias="from", description="Начало периода (ISO 8601)"),
+    until: Optional[datetime] = Query(None, alias="to", description="Конец периода (ISO 8601)"),
+    simplify_m: float = Query(0, alias="simplify", ge=0, description="Допуск упрощения, м (0 — без упрощения)"),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|geojson)$"),
+    after: Optional[str] = Query(None, description="Курсор ts_ms:id для продолжения"),
+    limit: Optional[int] = Query(None, ge=1, description="Не больше limit точек, затем курсор next"),
+    _: bool = Depends(verify_token),
+):
+    """
+    История трека водителя потоком NDJSON или GeoJSON.
+
+    По умолчанию — последние TRACK_DEFAULT_HOURS часов. Требует авторизации.
+    """
+    if since is None:
+        since = datetime.now(timezone.utc) - timedelta(hours=DEFAULT_HOURS)
+    return stream_track(user_id, since, until, fmt, simplify_m, after, limit)
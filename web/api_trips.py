@@ -2,6 +2,8 @@
 REST API для управления рейсами.
 """
 
+import os
+
 from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel, Field
 from typing import Optional, List
@@ -9,11 +11,17 @@ from datetime import datetime
 
 import db_trips
 import db_documents
+import track_analytics
+from track_simplify import track_cache
 from web.api import verify_token
+from web.api_track import stream_track
+from web.conditional import Conditional
 from db import get_last_point
 
 router = APIRouter(prefix="/api/trips", tags=["trips"])
 
+GEOFENCE_RADIUS_M = float(os.getenv("GEOFENCE_RADIUS_M", "1000"))
+
 
 class TripCreate(BaseModel):
     """Модель для создания рейса."""
@@ -37,6 +45,7 @@ class TripUpdate(BaseModel):
     loading_lon: Optional[float] = Field(None, description="Долгота погрузки")
     unloading_lat: Optional[float] = Field(None, description="Широта выгрузки")
     unloading_lon: Optional[float] = Field(None, description="Долгота выгрузки")
+    geofence_radius_m: Optional[float] = Field(None, gt=0, description="Радиус геозон, м")
     documents_sent: Optional[str] = Field(None, description="Трек-номер СДЭК")
 
 
@@ -66,12 +75,18 @@ async def create_trip(trip: TripCreate, _: bool = Depends(verify_token)):
 
 
 @router.get("/{trip_id}")
-async def get_trip(trip_id: int, _: bool = Depends(verify_token)):
+async def get_trip(trip_id: int, cond: Conditional = Depends(), _: bool = Depends(verify_token)):
     """
     Получить информацию о рейсе.
 
-    Требует авторизации.
+    Поддерживает If-None-Match (304). Требует авторизации.
     """
+    version = await db_trips.get_trip_version(trip_id)
+    if not version:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    not_modified = cond.check("trip", trip_id, version["version"])
+    if not_modified:
+        return not_modified
     trip = await db_trips.get_trip(trip_id)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
@@ -111,6 +126,15 @@ async def update_trip(
     if updates.status:
         await db_trips.update_trip_status(trip_id, updates.status)
 
+    # Координаты погрузки/выгрузки задают геозоны рейса
+    radius_m = updates.geofence_radius_m or GEOFENCE_RADIUS_M
+    for kind, lat, lon in (
+        ('loading', updates.loading_lat, updates.loading_lon),
+        ('unloading', updates.unloading_lat, updates.unloading_lon),
+    ):
+        if lat is not None and lon is not None:
+            await db_trips.set_trip_geofence(trip_id, kind, lat, lon, radius_m)
+
     # Обновляем трек-номер если указан
     if updates.documents_sent:
         await db_trips.update_trip_documents_tracking(
@@ -122,27 +146,101 @@ async def update_trip(
 
 
 @router.get("/{trip_id}/documents")
-async def get_trip_documents(trip_id: int, _: bool = Depends(verify_token)):
+async def get_trip_documents(trip_id: int, cond: Conditional = Depends(), _: bool = Depends(verify_token)):
     """
     Получить все документы по рейсу.
 
-    Требует авторизации.
+    Поддерживает If-None-Match (304). Требует авторизации.
     """
+    not_modified = cond.check("docs", trip_id, await db_documents.get_trip_documents_version(trip_id))
+    if not_modified:
+        return not_modified
     docs = await db_documents.get_trip_documents(trip_id)
     return {"trip_id": trip_id, "documents": docs}
 
 
 @router.get("/{trip_id}/events")
-async def get_trip_events(trip_id: int, _: bool = Depends(verify_token)):
+async def get_trip_events(trip_id: int, cond: Conditional = Depends(), _: bool = Depends(verify_token)):
     """
     Получить историю событий рейса.
 
-    Требует авторизации.
+    Поддерживает If-None-Match (304). Требует авторизации.
     """
+    version = await db_trips.get_trip_events_version(trip_id)
+    not_modified = cond.check("events", trip_id, version["count"], version["max_id"])
+    if not_modified:
+        return not_modified
     events = await db_trips.get_trip_events(trip_id)
     return {"trip_id": trip_id, "events": events}
 
 
+@router.get("/{trip_id}/analytics")
+async def get_trip_analytics(trip_id: int, _: bool = Depends(verify_token)):
+    """
+    Аналитика трека рейса: пробег, скорости, стоянки, простой на
+    погрузке/выгрузке, ночная езда.
+
+    Требует авторизации.
+    """
+    analytics = await track_analytics.trip_analytics(trip_id)
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return analytics
+
+
+@router.get("/{trip_id}/route")
+async def get_trip_route(
+    trip_id: int,
+    zoom: int = Query(12, ge=0, le=20, description="Масштаб карты (Leaflet/OSM zoom)"),
+    _: bool = Depends(verify_token),
+):
+    """
+    Упрощённый трек рейса для карты: вершины, заметные на масштабе zoom.
+
+    Формат: track — список [lat, lon, ts_ms]. Требует авторизации.
+    """
+    route = await track_cache.get(trip_id, zoom)
+    if route is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return {
+        "trip_id": trip_id,
+        "zoom": zoom,
+        "tolerance_m": round(route.tolerance_m, 1),
+        "raw_points": route.raw_points,
+        "track": [
+            [lat, lon, int(round(ts * 1000))]
+            for lat, lon, ts in zip(route.lat.tolist(), route.lon.tolist(), route.ts.tolist())
+        ],
+    }
+
+
+@router.get("/{trip_id}/track")
+async def get_trip_track(
+    trip_id: int,
+    simplify_m: float = Query(0, alias="simplify", ge=0, description="Допуск упрощения, м (0 — без упрощения)"),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|geojson)$"),
+    after: Optional[str] = Query(None, description="Курсор ts_ms:id для продолжения"),
+    limit: Optional[int] = Query(None, ge=1, description="Не больше limit точек, затем курсор next"),
+    _: bool = Depends(verify_token),
+):
+    """
+    Трек рейса потоком NDJSON или GeoJSON: от окончания погрузки
+    (loading_confirmed_at, если её ещё нет — от создания рейса) до
+    завершения (completed_at) или текущего момента.
+
+    Требует авторизации.
+    """
+    trip = await db_trips.get_trip(trip_id)
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    if not trip["user_id"]:
+        raise HTTPException(status_code=404, detail="Trip has no driver")
+    # метки trips.db — локальное время сервера без зоны
+    since = datetime.fromisoformat(trip["loading_confirmed_at"] or trip["created_at"]).astimezone()
+    until = datetime.fromisoformat(trip["completed_at"]).astimezone() if trip["completed_at"] else None
+    return stream_track(trip["user_id"], since, until, fmt, simplify_m, after, limit)
+
+
 @router.post("/{trip_id}/events", status_code=201)
 async def add_trip_event(
     trip_id: int,
@@ -193,7 +291,7 @@ async def list_active_trips(
 
 
 @router.get("/{trip_id}/summary")
-async def get_trip_summary(trip_id: int, _: bool = Depends(verify_token)):
+async def get_trip_summary(trip_id: int, cond: Conditional = Depends(), _: bool = Depends(verify_token)):
     """
     Получить полную сводку по рейсу (для дашборда).
 
@@ -201,10 +299,31 @@ async def get_trip_summary(trip_id: int, _: bool = Depends(verify_token)):
     - Информацию о рейсе
     - События
     - Документы
+    - Геозоны погрузки/выгрузки
+    - Пробег, среднюю скорость и ETA (накоплены ботом по точкам)
     - Последнее местоположение водителя
 
-    Требует авторизации.
+    Поддерживает If-None-Match (304): версия складывается из версии рейса
+    (с событиями, геозонами и метриками), отпечатка документов и id
+    последней точки водителя. Требует авторизации.
     """
+    version = await db_trips.get_trip_version(trip_id)
+    if not version:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    # Последнее местоположение водителя
+    last_location = await get_last_point(version["user_id"]) if version["user_id"] else None
+
+    not_modified = cond.check(
+        "summary",
+        trip_id,
+        version["version"],
+        await db_documents.get_trip_documents_version(trip_id),
+        last_location["id"] if last_location else 0,
+    )
+    if not_modified:
+        return not_modified
+
     # Основная информация о рейсе
     trip = await db_trips.get_trip(trip_id)
     if not trip:
@@ -216,12 +335,17 @@ async def get_trip_summary(trip_id: int, _: bool = Depends(verify_token)):
     # Документы
     documents = await db_documents.get_trip_documents(trip_id)
 
-    # Последнее местоположение водителя
-    last_location = await get_last_point(trip['user_id'])
+    # Геозоны погрузки/выгрузки
+    geofences = await db_trips.get_trip_geofences(trip_id)
+
+    # Пробег, скорость, ETA
+    metrics = await db_trips.get_trip_metrics(trip_id)
 
     return {
         "trip": trip,
         "events": events,
         "documents": documents,
+        "geofences": geofences,
+        "metrics": metrics,
         "last_location": last_location
     }
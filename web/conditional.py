@@ -0,0 +1,76 @@
+"""
+Условные GET-запросы: ETag и ответ 304.
+
+Эндпоинт сначала получает дешёвую версию ресурса (id последней точки,
+seq рейса в журнале changes, отпечаток документов — по одному поиску по
+индексу) и сверяет её с If-None-Match до тяжёлых запросов и
+сериализации:
+
+    @router.get("/{trip_id}")
+    async def get_trip(trip_id: int, cond: Conditional = Depends()):
+        version = await db_trips.get_trip_version(trip_id)
+        ...
+        if (not_modified := cond.check("trip", trip_id, version["version"])):
+            return not_modified
+        ...
+
+Last-Modified не отдаётся: у времени в trips.db точность — секунда, а
+события геозон пишутся асинхронно «задним числом», поэтому
+If-Modified-Since дал бы ложный 304. Версия в ETag такого не допускает.
+
+Cache-Control (API_CACHE_CONTROL, по умолчанию «private, no-cache»):
+ответы с авторизацией не кладутся в общие кэши, а браузер и клиенты
+партнёров хранят их, но перепроверяют при каждом запросе.
+"""
+
+import os
+from typing import Dict, Optional
+
+from fastapi import Header, Response
+
+CACHE_CONTROL = os.getenv("API_CACHE_CONTROL", "private, no-cache")
+
+
+def make_etag(*parts) -> str:
+    """Сильный ETag из частей версии: "trip-5-1042"."""
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Сравнение для If-None-Match: список тегов, «*», слабые W/ (RFC 9110)."""
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class Conditional:
+    """
+    Зависимость FastAPI: валидаторы ответа и проверка условных заголовков.
+
+    check() возвращает готовый ответ 304 или None; в последнем случае
+    ETag и Cache-Control уже выставлены на ответ эндпоинта (для
+    возвращаемого вручную Response — взять из headers).
+    """
+
+    def __init__(self, response: Response, if_none_match: Optional[str] = Header(None)):
+        self.response = response
+        self.if_none_match = if_none_match
+        self.headers: Dict[str, str] = {}
+
+    def check(self, *parts) -> Optional[Response]:
+        """
+        Сверить версию ресурса с If-None-Match.
+
+        Args:
+            parts: Части версии (ETag)
+
+        Returns:
+            Response 304 или None — отдавать полный ответ
+        """
+        etag = make_etag(*parts)
+        self.headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if self.if_none_match is not None and etag_matches(self.if_none_match, etag):
+            return Response(status_code=304, headers=self.headers)
+        self.response.headers.update(self.headers)
+        return None